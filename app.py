@@ -1,28 +1,39 @@
 # app.py
 import re
 import os
+import json
+import time
 import uuid
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, stream_with_context, g
 from auth import AuthManager
 from itinerary_generator import generate_itinerary
-from booking import search_flights, search_hotels
-from budget import estimate_budget
+from booking import booking_search
+from budget import trip_budget
 from openai_integration import ai_planner  # Import from the renamed module with correct variable
+from structured_itinerary import RenderedItinerary
+from state_store import create_state_store
+from gazetteer import find_destination, canonical_destination
+from metrics import REGISTRY, CONTENT_TYPE, STAGE_SECONDS, HTTP_REQUEST_SECONDS, FALLBACKS, CLARIFICATIONS, timed
 from pyngrok import ngrok
 
 # Initialize Flask app
 app = Flask(__name__)
 load_dotenv()
 app.secret_key = "itinify-secret-key"  # For session management
-ngrok.set_auth_token(os.environ.get("NGROK_AUTH_TOKEN"))
+if os.environ.get("NGROK_AUTH_TOKEN"):
+    ngrok.set_auth_token(os.environ.get("NGROK_AUTH_TOKEN"))
 
 # Initialize the AuthManager for user auth and data storage
 auth_manager = AuthManager()
 
-# Track user chat sessions
-user_sessions = {}
+# Configuration for the saved itinerary listing
+ITINERARY_PAGE_SIZE = 20
+MAX_ITINERARY_PAGE_SIZE = 100
+
+# Track user chat sessions (in the shared state store, so every worker agrees on the ID)
+user_sessions = create_state_store()
 
 # Email validation helper
 def is_valid_email(email):
@@ -32,9 +43,97 @@ def is_valid_email(email):
 
 # Get or create a unique session ID for a user
 def get_user_session_id(email):
-    if email not in user_sessions:
-        user_sessions[email] = str(uuid.uuid4())
-    return user_sessions[email]
+    # The first worker to store an ID wins; everyone else gets that one
+    return user_sessions.add("user_session", email, str(uuid.uuid4()))
+
+# Pick a destination out of a follow-up message, falling back to the last one discussed
+def extract_followup_destination(user_msg, default, last_destination=None):
+    place = find_destination(user_msg)
+    if place is not None:
+        return place.name
+    return last_destination or default
+
+# Build a basic local answer to a follow-up question when the AI is unavailable
+def local_followup_response(user_msg, destination, days, preferences):
+    if "restaurant" in user_msg.lower() or "food" in user_msg.lower() or "eat" in user_msg.lower():
+        response = f"Restaurant Recommendations for {destination}\n\nHere are some excellent dining options in {destination}:\n\n"
+        response += "1. **Local Traditional Restaurant** - Authentic cuisine with moderate prices\n"
+        response += "2. **Waterfront Dining** - Seafood with amazing views\n"
+        response += "3. **Street Food Market** - Various local vendors with budget-friendly options\n"
+        response += "4. **Garden Terrace** - Farm-to-table concept with vegetarian options\n\n"
+        response += "These range from budget-friendly street food to upscale dining experiences."
+    elif "hotel" in user_msg.lower() or "stay" in user_msg.lower() or "accommodation" in user_msg.lower():
+        response = f"Accommodation Options in {destination}\n\n"
+        response += "Luxury Options\n- **Grand Resort** - Full amenities and central location\n- **Beachfront Villa** - Private and exclusive\n\n"
+        response += "Mid-range Options\n- **Boutique Hotel** - Great location, comfortable rooms\n- **City Suites** - Modern amenities\n\n"
+        response += "Budget Options\n- **Backpacker's Hostel** - Social atmosphere and affordable\n- **Local Guesthouse** - Authentic experience\n\n"
+    else:
+        # Use the itinerary generator for general questions
+        response = generate_itinerary(destination, days, preferences)
+    return response
+
+# Check if a response is asking a clarification question
+def is_clarification_response(response):
+    # This is a simple heuristic - we check if it contains a question mark and is relatively short
+    # or explicitly contains phrases indicating a clarification
+    return ("?" in response and len(response) < 500) or any(phrase in response.lower() for phrase in [
+        "could you clarify", 
+        "can you provide more details",
+        "need more information",
+        "can you specify",
+        "would you mind telling me",
+        "would help to know"
+    ])
+
+# Work out the budget figure to report alongside a response
+@timed("budget_extraction")
+def extract_budget(response, days, preferences, destination=None):
+    # Structured itineraries carry their parsed budget
+    if isinstance(response, RenderedItinerary):
+        return response.budget_total
+    
+    # Extract budget from the response if it contains one
+    if "Budget" in response and "$" in response:
+        try:
+            # Very simple budget extraction
+            budget_section = response.split("Budget")[1]
+            total_line = [line for line in budget_section.split('\n') if "Total" in line][0]
+            # The amount may be followed by markup rather than whitespace (e.g. rendered tables)
+            budget_str = re.match(r"[\d,]+(\.\d+)?", total_line.split("$")[-1]).group(0).replace(',', '')
+            return float(budget_str)
+        except:
+            pass
+    return estimated_budget(destination, days, preferences)
+
+# Budget from flight and hotel prices when the response does not state one
+def estimated_budget(destination, days, preferences):
+    # Fall back to the base daily rate when no destination is known or no provider returned prices
+    base_budget = (trip_budget(destination, days) if destination else 0) or days * 100
+    return base_budget * (1 + 0.1 * len(preferences))  # Add 10% per preference
+
+# Budget line items for structured itineraries, None otherwise
+def extract_budget_breakdown(response):
+    if isinstance(response, RenderedItinerary):
+        return response.budget_breakdown
+    return None
+
+# Format a Server-Sent Events message
+@timed("serialization")
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+# Record end-to-end latency for every request
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=str(response.status_code))
+    return response
 
 # Flask routes
 @app.route('/')
@@ -126,6 +225,45 @@ def get_itineraries():
     itineraries = auth_manager.get_itineraries(session['email'])
     return jsonify({"success": True, "itineraries": itineraries})
 
+# Let the browser revalidate with If-None-Match and get a 304 when nothing changed
+def conditional_json(payload):
+    response = jsonify(payload)
+    response.add_etag()
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+@app.route('/itineraries')
+def list_itineraries():
+    """API endpoint to list one page of the user's saved itineraries as summaries, without their content."""
+    if 'email' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(MAX_ITINERARY_PAGE_SIZE, max(1, int(request.args.get('limit', ITINERARY_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid offset or limit"}), 400
+    
+    summaries, total = auth_manager.get_itinerary_page(session['email'], offset, limit)
+    return conditional_json({
+        "success": True,
+        "itineraries": summaries,
+        "total": total,
+        "offset": offset,
+        "limit": limit
+    })
+
+@app.route('/itineraries/<int:itinerary_id>')
+def get_itinerary(itinerary_id):
+    """API endpoint to get the full content of one saved itinerary."""
+    if 'email' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    itinerary = auth_manager.get_itinerary(session['email'], itinerary_id)
+    if itinerary is None:
+        return jsonify({"success": False, "message": "Itinerary not found"}), 404
+    return conditional_json({"success": True, "id": itinerary_id, "itinerary": itinerary})
+
 @app.route('/delete_itinerary', methods=['POST'])
 def delete_itinerary():
     """API endpoint to delete a saved itinerary."""
@@ -133,18 +271,40 @@ def delete_itinerary():
         return jsonify({"success": False, "message": "Not logged in"}), 401
     
     data = request.get_json()
-    if not data or 'index' not in data:
-        return jsonify({"success": False, "message": "No itinerary index provided"}), 400
+    if not data or 'id' not in data:
+        return jsonify({"success": False, "message": "No itinerary ID provided"}), 400
     
     try:
-        index = int(data['index'])
-        success, msg = auth_manager.delete_itinerary(session['email'], index)
+        itinerary_id = int(data['id'])
+        success, msg = auth_manager.delete_itinerary(session['email'], itinerary_id)
         return jsonify({"success": success, "message": msg})
     except ValueError:
-        return jsonify({"success": False, "message": "Invalid itinerary index"}), 400
+        return jsonify({"success": False, "message": "Invalid itinerary ID"}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/status')
+def status():
+    """Monitoring endpoint with the OpenAI circuit breaker state and cache statistics."""
+    return jsonify({
+        "circuit_breaker": ai_planner.circuit_breaker.snapshot(),
+        "response_cache": ai_planner.response_cache.stats(),
+        "similarity_cache": ai_planner.similarity_cache.stats() if ai_planner.similarity_cache else None,
+        "rate_limiter": ai_planner.rate_limiter.stats(),
+        "model_router": ai_planner.model_router.stats(),
+        "hedging": ai_planner.hedger.stats() if ai_planner.hedger else None,
+        "prefetch": ai_planner.prefetcher.stats() if ai_planner.prefetcher else None,
+        "single_flight": ai_planner.single_flight.stats(),
+        "itinerary_storage": auth_manager.storage_stats(),
+        "write_behind": auth_manager.write_queue.stats() if auth_manager.write_queue else None,
+        "booking_search": booking_search.stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, cache, retry, fallback and token counters."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """API endpoint for chat interactions to generate travel itineraries using OpenAI."""
@@ -177,16 +337,7 @@ def chat():
             # First try to generate response using OpenAI
             if "?" in user_msg or is_followup:
                 # Follow-up question logic
-                destination = None
-                for word in user_msg.split():
-                    if word.istitle() and len(word) > 3 and word.lower() not in ['what', 'where', 'when', 'how', 'tell', 'about']:
-                        destination = word
-                        break
-                
-                if not destination and 'last_destination' in session:
-                    destination = session.get('last_destination')
-                elif not destination:
-                    destination = "the destination"
+                destination = extract_followup_destination(user_msg, "the destination", session.get('last_destination'))
                 
                 response = ai_planner.generate_travel_plan(
                     user_id=user_id,
@@ -197,7 +348,7 @@ def chat():
                 )
             else:
                 # New destination query
-                destination = user_msg
+                destination = canonical_destination(user_msg)
                 session['last_destination'] = destination
                 
                 response = ai_planner.generate_travel_plan(
@@ -208,20 +359,10 @@ def chat():
                 )
                 
                 # Check if the response is asking a clarification question
-                # This is a simple heuristic - we check if it contains a question mark and is relatively short
-                # or explicitly contains phrases indicating a clarification
-                is_clarification = ("?" in response and len(response) < 500) or any(phrase in response.lower() for phrase in [
-                    "could you clarify", 
-                    "can you provide more details",
-                    "need more information",
-                    "can you specify",
-                    "would you mind telling me",
-                    "would help to know"
-                ])
-                
-                if is_clarification:
+                if is_clarification_response(response):
                     # If it's a clarification question, we'll set a flag to indicate this
                     # so the frontend can handle it appropriately
+                    CLARIFICATIONS.inc()
                     return jsonify({
                         "success": True,
                         "response": response,
@@ -232,66 +373,32 @@ def chat():
         except Exception as e:
             # If OpenAI API fails, fall back to local itinerary generator
             print(f"OpenAI API error: {str(e)}. Falling back to local generator.")
+            FALLBACKS.inc(source="local_generator")
             
             if "?" in user_msg or is_followup:
                 # For follow-up questions, extract destination if possible
-                destination = None
-                for word in user_msg.split():
-                    if word.istitle() and len(word) > 3 and word.lower() not in ['what', 'where', 'when', 'how', 'tell', 'about']:
-                        destination = word
-                        break
-                
-                if not destination and 'last_destination' in session:
-                    destination = session.get('last_destination')
-                elif not destination:
-                    destination = "Generic Destination"
+                destination = extract_followup_destination(user_msg, "Generic Destination", session.get('last_destination'))
                 
                 # Generate basic response for follow-up
-                if "restaurant" in user_msg.lower() or "food" in user_msg.lower() or "eat" in user_msg.lower():
-                    response = f"Restaurant Recommendations for {destination}\n\nHere are some excellent dining options in {destination}:\n\n"
-                    response += "1. **Local Traditional Restaurant** - Authentic cuisine with moderate prices\n"
-                    response += "2. **Waterfront Dining** - Seafood with amazing views\n"
-                    response += "3. **Street Food Market** - Various local vendors with budget-friendly options\n"
-                    response += "4. **Garden Terrace** - Farm-to-table concept with vegetarian options\n\n"
-                    response += "These range from budget-friendly street food to upscale dining experiences."
-                elif "hotel" in user_msg.lower() or "stay" in user_msg.lower() or "accommodation" in user_msg.lower():
-                    response = f"Accommodation Options in {destination}\n\n"
-                    response += "Luxury Options\n- **Grand Resort** - Full amenities and central location\n- **Beachfront Villa** - Private and exclusive\n\n"
-                    response += "Mid-range Options\n- **Boutique Hotel** - Great location, comfortable rooms\n- **City Suites** - Modern amenities\n\n"
-                    response += "Budget Options\n- **Backpacker's Hostel** - Social atmosphere and affordable\n- **Local Guesthouse** - Authentic experience\n\n"
-                else:
-                    # Use the itinerary generator for general questions
-                    response = generate_itinerary(destination, days, preferences)
+                response = local_followup_response(user_msg, destination, days, preferences)
             else:
                 # For new destination queries, use the itinerary generator
-                destination = user_msg
+                destination = canonical_destination(user_msg)
                 session['last_destination'] = destination
                 response = generate_itinerary(destination, days, preferences)
         
-        # Calculate a placeholder budget
-        base_budget = days * 100  # Base daily rate
-        budget = base_budget * (1 + 0.1 * len(preferences))  # Add 10% per preference
+        response_budget = extract_budget(response, days, preferences, destination)
         
-        # Extract budget from the response if it contains one
-        response_budget = budget
-        if "Budget" in response and "$" in response:
-            try:
-                # Very simple budget extraction
-                budget_section = response.split("Budget")[1]
-                total_line = [line for line in budget_section.split('\n') if "Total" in line][0]
-                budget_str = total_line.split("$")[-1].split()[0].replace(',', '')
-                response_budget = float(budget_str)
-            except:
-                response_budget = budget
-        
-        return jsonify({
-            "success": True, 
-            "response": response,
-            "budget": response_budget,
-            "destination": destination,
-            "streaming": False,  # Indicate this is not a streaming response
-            "is_clarification": False  # Default is not a clarification question
-        })
+        with STAGE_SECONDS.time(stage="serialization"):
+            return jsonify({
+                "success": True, 
+                "response": response,
+                "budget": response_budget,
+                "budget_breakdown": extract_budget_breakdown(response),
+                "destination": destination,
+                "streaming": False,  # Indicate this is not a streaming response
+                "is_clarification": False  # Default is not a clarification question
+            })
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -300,6 +407,89 @@ def chat():
             "message": f"Error generating itinerary: {str(e)}"
         }), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /chat that sends the response as Server-Sent Events."""
+    if 'email' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({"success": False, "message": "No message provided"}), 400
+    
+    user_msg = data['message'].strip()
+    if not user_msg:
+        return jsonify({"success": False, "message": "Empty message"}), 400
+    
+    days = int(data.get('days', 5))
+    preferences = data.get('preferences', [])
+    user_id = get_user_session_id(session['email'])
+    is_followup = "?" in user_msg or data.get('is_followup', False)
+    
+    # Resolve the destination before streaming starts, since the session
+    # cookie cannot be updated once the response headers have been sent
+    if is_followup:
+        destination = extract_followup_destination(user_msg, "the destination", session.get('last_destination'))
+    else:
+        destination = canonical_destination(user_msg)
+        session['last_destination'] = destination
+    
+    def generate():
+        sent = []  # deltas already on the client
+        try:
+            stream = ai_planner.generate_travel_plan_stream(
+                user_id=user_id,
+                destination=destination,
+                days=days,
+                preferences=preferences,
+                new_message=user_msg if is_followup else None
+            )
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as done:
+                    # The planner returns the final post-processed text once the stream ends
+                    response = done.value
+                    break
+                sent.append(chunk)
+                yield sse_event({"delta": chunk})
+        except Exception as e:
+            if sent:
+                # Part of the answer is already shown, so end with it rather than append a whole local itinerary
+                print(f"OpenAI API error after partial response: {str(e)}")
+                yield sse_event({
+                    "success": False,
+                    "message": "The response was interrupted. Please try again.",
+                    "response": "".join(sent),
+                    "destination": destination,
+                    "streaming": True,
+                    "partial": True
+                }, event="done")
+                return
+            print(f"OpenAI API error: {str(e)}. Falling back to local generator.")
+            FALLBACKS.inc(source="local_generator")
+            response = generate_itinerary(destination, days, preferences)
+            yield sse_event({"delta": response})
+        
+        is_clarification = not is_followup and is_clarification_response(response)
+        if is_clarification:
+            CLARIFICATIONS.inc()
+        yield sse_event({
+            "success": True,
+            "response": response,
+            "budget": extract_budget(response, days, preferences, destination),
+            "budget_breakdown": extract_budget_breakdown(response),
+            "destination": destination,
+            "streaming": True,
+            "is_clarification": is_clarification
+        }, event="done")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == '__main__':
     public_url = ngrok.connect("5000")
     app.run(port=5000)
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+ASGI entry point for AI Trip Planner
+Serves /chat with the async planner so one process can hold hundreds of
+in-flight LLM calls; every other route is handed to the Flask app.
+
+Run with any ASGI server, for example:
+    pip install uvicorn asgiref
+    uvicorn asgi:application
+"""
+import json
+import asyncio
+import time
+from http.cookies import SimpleCookie
+
+from app import (
+    app as flask_app, ai_planner, auth_manager, get_user_session_id, extract_followup_destination,
+    local_followup_response, is_clarification_response, extract_budget, extract_budget_breakdown
+)
+from async_planner import AsyncOpenAITravelPlanner
+from itinerary_generator import generate_itinerary
+from gazetteer import canonical_destination
+from metrics import STAGE_SECONDS, HTTP_REQUEST_SECONDS, FALLBACKS, CLARIFICATIONS
+
+# Flask routes other than /chat are served through asgiref's WSGI adapter when it is installed
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    wsgi_application = WsgiToAsgi(flask_app)
+except ImportError:
+    wsgi_application = None
+
+# Share histories and the response cache with the Flask app's planner
+async_ai_planner = AsyncOpenAITravelPlanner(
+    chat_histories=ai_planner.chat_histories,
+    response_cache=ai_planner.response_cache
+)
+# Both planners share one view of upstream health, the near-duplicate index, the rate limit and
+# hedge budgets, the per-model stats and the follow-up prefetcher
+async_ai_planner.circuit_breaker = ai_planner.circuit_breaker
+async_ai_planner.similarity_cache = ai_planner.similarity_cache
+async_ai_planner.rate_limiter = ai_planner.rate_limiter
+async_ai_planner.model_router = ai_planner.model_router
+async_ai_planner.hedger = ai_planner.hedger
+async_ai_planner.prefetcher = ai_planner.prefetcher
+
+# Read and write the same signed session cookie as Flask
+session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+SESSION_COOKIE_NAME = flask_app.config["SESSION_COOKIE_NAME"]
+
+
+def load_session(scope):
+    """Decode the Flask session cookie from the request headers."""
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookie = SimpleCookie()
+            cookie.load(value.decode("latin-1"))
+            if SESSION_COOKIE_NAME in cookie:
+                try:
+                    return dict(session_serializer.loads(cookie[SESSION_COOKIE_NAME].value))
+                except Exception:
+                    return {}
+    return {}
+
+
+def session_cookie_header(session_data):
+    """Build a Set-Cookie header for an updated session."""
+    value = session_serializer.dumps(session_data)
+    return (b"set-cookie", f"{SESSION_COOKIE_NAME}={value}; Path=/; HttpOnly".encode("latin-1"))
+
+
+async def read_body(receive):
+    """Read the full request body."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_json(send, payload, status=200, headers=None):
+    """Send a JSON response."""
+    with STAGE_SECONDS.time(stage="serialization"):
+        body = json.dumps(payload).encode("utf-8")
+    response_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    response_headers.extend(headers or [])
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def chat(scope, receive, send):
+    """Async version of the Flask /chat endpoint."""
+    session_data = load_session(scope)
+    if 'email' not in session_data:
+        return await send_json(send, {"success": False, "message": "Not logged in"}, 401)
+
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        data = None
+    if not data or 'message' not in data:
+        return await send_json(send, {"success": False, "message": "No message provided"}, 400)
+
+    user_msg = data['message'].strip()
+    if not user_msg:
+        return await send_json(send, {"success": False, "message": "Empty message"}, 400)
+
+    days = int(data.get('days', 5))
+    preferences = data.get('preferences', [])
+    user_id = get_user_session_id(session_data['email'])
+    is_followup = "?" in user_msg or data.get('is_followup', False)
+    headers = []
+
+    try:
+        if is_followup:
+            destination = extract_followup_destination(user_msg, "the destination", session_data.get('last_destination'))
+            response = await async_ai_planner.generate_travel_plan(
+                user_id=user_id,
+                destination=destination,
+                days=days,
+                preferences=preferences,
+                new_message=user_msg
+            )
+        else:
+            destination = canonical_destination(user_msg)
+            session_data['last_destination'] = destination
+            headers.append(session_cookie_header(session_data))
+            response = await async_ai_planner.generate_travel_plan(
+                user_id=user_id,
+                destination=destination,
+                days=days,
+                preferences=preferences
+            )
+
+            if is_clarification_response(response):
+                CLARIFICATIONS.inc()
+                return await send_json(send, {
+                    "success": True,
+                    "response": response,
+                    "is_clarification": True,
+                    "destination": destination,
+                    "streaming": False
+                }, headers=headers)
+    except Exception as e:
+        print(f"OpenAI API error: {str(e)}. Falling back to local generator.")
+        FALLBACKS.inc(source="local_generator")
+        if is_followup:
+            destination = extract_followup_destination(user_msg, "Generic Destination", session_data.get('last_destination'))
+            response = local_followup_response(user_msg, destination, days, preferences)
+        else:
+            destination = canonical_destination(user_msg)
+            response = generate_itinerary(destination, days, preferences)
+
+    # The budget may search the booking providers, so keep it off the event loop
+    budget = await asyncio.to_thread(extract_budget, response, days, preferences, destination)
+    await send_json(send, {
+        "success": True,
+        "response": response,
+        "budget": budget,
+        "budget_breakdown": extract_budget_breakdown(response),
+        "destination": destination,
+        "streaming": False,
+        "is_clarification": False
+    }, headers=headers)
+
+
+async def timed_chat(scope, receive, send):
+    """Run the async /chat endpoint, recording its latency like Flask's after_request hook."""
+    status = []
+
+    async def send_and_capture(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        await send(message)
+
+    start = time.perf_counter()
+    try:
+        await chat(scope, receive, send_and_capture)
+    finally:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/chat", status=str(status[0] if status else 500))
+
+
+async def lifespan(scope, receive, send):
+    """Close the shared connection pool and commit journaled itinerary writes when the server shuts down."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_ai_planner.aclose()
+            auth_manager.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application: async /chat, everything else served by Flask."""
+    if scope["type"] == "lifespan":
+        return await lifespan(scope, receive, send)
+    if scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+        return await timed_chat(scope, receive, send)
+    if wsgi_application is not None:
+        return await wsgi_application(scope, receive, send)
+    await send_json(send, {"success": False, "message": "Not found"}, 404)
@@ -0,0 +1,225 @@
+"""
+Async OpenAI Integration for AI Trip Planner
+An asyncio variant of OpenAITravelPlanner for ASGI deployments. All requests
+share one keep-alive connection pool and retries back off with asyncio.sleep,
+so a single process can hold hundreds of in-flight LLM calls without pinning
+a thread per request.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+from openai_integration import OpenAITravelPlanner, API_KEY, API_URL, MAX_TOKENS
+from circuit_breaker import CircuitOpenError
+from model_router import REQUEST_ITINERARY, REQUEST_FOLLOWUP, REQUEST_OUTLINE
+from rate_limiter import RateLimitTimeout, PRIORITY_NEW, PRIORITY_FOLLOWUP
+from long_trip import (
+    OUTLINE_MAX_TOKENS, OUTLINE_RESPONSE_FORMAT, EMPTY_OUTLINE,
+    is_long_trip, split_days, outline_messages, parse_outline, chunk_messages
+)
+from structured_itinerary import RESPONSE_FORMAT, to_response
+from metrics import STAGE_SECONDS, LLM_RETRIES, record_usage
+
+logger = logging.getLogger('async_planner')
+
+# Configuration for the shared connection pool and retries
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("OPENAI_ASYNC_MAX_CONNECTIONS", "200"))
+ASYNC_MAX_KEEPALIVE = int(os.environ.get("OPENAI_ASYNC_MAX_KEEPALIVE", "50"))
+ASYNC_TIMEOUT = float(os.environ.get("OPENAI_ASYNC_TIMEOUT", "60"))  # seconds
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 1.0  # seconds
+RETRY_MAX_DELAY = 8.0  # seconds
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class AsyncOpenAITravelPlanner(OpenAITravelPlanner):
+    """OpenAITravelPlanner whose API calls are made with AsyncOpenAI."""
+
+    def __init__(self, chat_histories=None, response_cache=None):
+        super().__init__(chat_histories=chat_histories, response_cache=response_cache)
+        # One pooled HTTP client shared by every request made through this planner
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(ASYNC_TIMEOUT, connect=5.0)
+        )
+        self.async_client = AsyncOpenAI(api_key=API_KEY, base_url=API_URL, http_client=self.http_client, max_retries=0)
+        self._inflight = {}  # cache_key -> task shared by identical concurrent new queries
+        logger.info("AsyncOpenAITravelPlanner initialized")
+
+    async def generate_travel_plan(self, user_id, destination, days, preferences, new_message=None):
+        """Generate a travel plan using the async OpenAI client"""
+        logger.info(f"Generating travel plan (async) for user_id: {user_id}, destination: {destination}, days: {days}")
+
+        # Check cache for common destinations (only for new queries, not follow-ups)
+        cache_key = self._get_cache_key(destination, days, preferences)
+        if not new_message:
+            cached = self._lookup_cache(cache_key, user_id, destination, days, preferences)
+            if cached is not None:
+                logger.info(f"Using cached response for {destination}")
+                self._schedule_prefetch(destination, preferences)
+                return cached
+        else:
+            prefetched = self._lookup_prefetched(user_id, cache_key, destination, preferences, new_message)
+            if prefetched is not None:
+                return prefetched
+
+        try:
+            if new_message:
+                messages = self._prepare_messages(user_id, destination, days, preferences, new_message)
+                response = await self._call_with_retries_async(
+                    messages, user_id=user_id, priority=PRIORITY_FOLLOWUP, request_type=REQUEST_FOLLOWUP
+                )
+            else:
+                response = await self._coalesce(
+                    cache_key,
+                    lambda: self._generate_long_trip_async(user_id, destination, days, preferences) if is_long_trip(days)
+                    else self._call_with_retries_async(
+                        self._prepare_messages(user_id, destination, days, preferences),
+                        structured=self.structured_output,
+                        user_id=user_id
+                    )
+                )
+        except Exception:
+            logger.info(f"All API attempts failed, using fallback response")
+            return self.get_fallback_response(destination, days, preferences)
+
+        self._record_response(user_id, cache_key, destination, response, new_message, days, preferences)
+        if not new_message:
+            self._schedule_prefetch(destination, preferences)
+        return response
+
+    async def _coalesce(self, key, factory):
+        """Await one shared call for all concurrent coroutines with the same key."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.single_flight.coalesced += 1
+            logger.info(f"Waiting for in-flight request: {key}")
+        # Shield so one cancelled caller doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    async def _generate_long_trip_async(self, user_id, destination, days, preferences):
+        """Generate a long trip as an outline plus day ranges requested together; raises if a range fails"""
+        ranges = split_days(days)
+        logger.info(f"Generating {days}-day trip to {destination} in {len(ranges)} concurrent chunks (async)")
+        try:
+            outline = parse_outline(await self._call_with_retries_async(
+                outline_messages(destination, days, preferences), user_id=user_id,
+                response_format=OUTLINE_RESPONSE_FORMAT, max_tokens=OUTLINE_MAX_TOKENS, request_type=REQUEST_OUTLINE
+            ))
+        except (CircuitOpenError, RateLimitTimeout):
+            raise
+        except Exception as e:
+            logger.warning(f"Trip outline failed, generating chunks without it: {str(e)}")
+            outline = EMPTY_OUTLINE
+        replies = await asyncio.gather(*(
+            self._call_with_retries_async(
+                chunk_messages(destination, days, preferences, outline, first, last), structured=True, user_id=user_id
+            )
+            for first, last in ranges
+        ))
+        return self._merge_long_trip(destination, days, outline, ranges, replies)
+
+    async def _call_with_retries_async(self, messages, structured=False, user_id=None, priority=PRIORITY_NEW, **kwargs):
+        """Call the OpenAI API, retrying with jittered backoff; raises once all attempts fail"""
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                # Fail fast while the circuit is open instead of queueing for rate limit capacity
+                self.circuit_breaker.check_available()
+                await self.rate_limiter.acquire_async(
+                    self._estimate_tokens(messages, kwargs.get("max_tokens", MAX_TOKENS)), user_id, priority
+                )
+                return await self._call_openai_api_async(messages, structured, **kwargs)
+            except CircuitOpenError:
+                logger.info(f"Circuit open, skipping OpenAI API call")
+                raise
+            except RateLimitTimeout:
+                raise
+            except Exception as e:
+                logger.error(f"Error generating travel plan (attempt {attempt+1}/{MAX_RETRIES+1}): {str(e)}")
+
+                if self._should_retry(attempt, MAX_RETRIES):
+                    # Yield the event loop while waiting instead of blocking a worker
+                    sleep_time = backoff_delay(attempt)
+                    logger.info(f"Retrying in {sleep_time:.2f} seconds...")
+                    LLM_RETRIES.inc()
+                    await asyncio.sleep(sleep_time)
+                else:
+                    raise
+
+    async def _call_openai_api_async(self, messages, structured=False, response_format=None, max_tokens=MAX_TOKENS,
+                                     request_type=REQUEST_ITINERARY):
+        """Call the OpenAI API using the async client library (raw JSON text for a custom response_format)"""
+        self.circuit_breaker.check()
+        model = self.model_router.choose(request_type)
+        logger.info(f"Calling OpenAI API (async) with model {model}")
+        logger.debug(f"Sending {len(messages)} messages to OpenAI")
+
+        if structured:
+            response_format = RESPONSE_FORMAT
+
+        def create():
+            return self._create_completion_async(model, messages, max_tokens, response_format, request_type)
+
+        if self.hedger is None:
+            response = await create()
+        else:
+            # A stalled call gets a second copy; the slower one is cancelled
+            response = await self.hedger.run_async(
+                create, f"async:{request_type}",
+                admit=lambda: self.rate_limiter.try_acquire(self._estimate_tokens(messages, max_tokens))
+            )
+        content = response.choices[0].message.content
+        with STAGE_SECONDS.time(stage="postprocess"):
+            if structured:
+                content = to_response(content)
+            elif response_format is None:
+                content = self._postprocess_content(content)
+        logger.info(f"OpenAI API response successful")
+        return content
+
+    async def _create_completion_async(self, model, messages, max_tokens, response_format, request_type):
+        """Make one API call with the async client and record its outcome"""
+        start = time.monotonic()
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                presence_penalty=0.2,
+                frequency_penalty=0.2,
+                **({"response_format": response_format} if response_format else {})
+            )
+        except asyncio.CancelledError:
+            # Cancelled by the caller or a winning hedge; this must still free a half-open probe slot
+            self._record_call("async", "cancelled", time.monotonic() - start, model=model)
+            raise
+        except BaseException as e:
+            self._record_call("async", "error", time.monotonic() - start, error=e, model=model)
+            raise
+        duration = time.monotonic() - start
+        self._record_call("async", "success", duration, model=model)
+        if self.hedger is not None:
+            self.hedger.observe(f"async:{request_type}", duration)
+        record_usage(getattr(response, "usage", None))
+        return response
+
+    async def aclose(self):
+        """Close the shared connection pool."""
+        await self.async_client.close()
@@ -1,52 +1,98 @@
 # auth.py
-import json, os, hashlib
+import sys
+import hashlib
 import re
+import threading
+import weakref
 
-DB_FILE = "users_db.json"
+from auth_storage import create_storage, STORAGE_BACKEND
+from blob_store import BLOB_COMPACT_INTERVAL, BLOB_COMPACT_VACUUM
+from write_behind import create_write_queue, WRITE_ADD, WRITE_DELETE
+from metrics import timed
+
+
+class _CompactionScheduler:
+    """One background thread per process that compacts the storage of every open AuthManager."""
+
+    def __init__(self, interval=BLOB_COMPACT_INTERVAL, vacuum=BLOB_COMPACT_VACUUM):
+        self.interval = interval
+        self.vacuum = vacuum
+        self._managers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._stop = None  # set to stop the running thread
+
+    def register(self, manager):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            self._managers.add(manager)
+            if self._stop is None:
+                self._stop = threading.Event()
+                threading.Thread(target=self._run, args=(self._stop,), name="blob-compaction", daemon=True).start()
+
+    def unregister(self, manager):
+        with self._lock:
+            self._managers.discard(manager)
+            if not self._managers and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            with self._lock:
+                managers = list(self._managers)
+            for manager in managers:
+                try:
+                    manager.compact_storage(vacuum=self.vacuum)
+                except Exception as e:
+                    print(f"Itinerary blob compaction failed: {e}")
+
+
+_compaction = _CompactionScheduler()
 
 
 class AuthManager:
-    def __init__(self, db_path=DB_FILE):
-        self.db_path = db_path
-        # If database file doesn't exist, create an empty JSON file
-        if not os.path.exists(self.db_path):
-            with open(self.db_path, 'w') as f:
-                json.dump({}, f)
-
-    def _load_db(self):
-        """Load user database from the JSON file."""
-        with open(self.db_path, 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
-        return data
-
-    def _save_db(self, data):
-        """Save the entire database dictionary back to the JSON file."""
-        with open(self.db_path, 'w') as f:
-            json.dump(data, f, indent=4)
+    def __init__(self, db_path=None, backend=STORAGE_BACKEND):
+        # Users and itineraries live in a pluggable storage backend (SQLite by default)
+        self.storage = create_storage(backend, db_path)
+        self.db_path = self.storage.db_path
+        # Journals saves and deletes for group commits (None unless AUTH_WRITE_BEHIND is on)
+        self.write_queue = create_write_queue(self.storage)
+        # Reclaim itinerary blobs that deleted itineraries left behind
+        _compaction.register(self)
+    
+    def _read_own_writes(self, email):
+        """Commit the user's journaled saves and deletes before reading their itineraries."""
+        if self.write_queue is not None and self.write_queue.has_pending(email):
+            if not self.write_queue.flush():
+                # Serve a view without the journaled writes rather than hold the request
+                print(f"Journaled itinerary writes for {email} not committed yet, reading without them")
+    
+    def close(self):
+        """Commit any journaled writes and stop compacting this storage; call on shutdown."""
+        _compaction.unregister(self)
+        if self.write_queue is not None:
+            self.write_queue.close()
     
     def _is_valid_email(self, email):
         """Check if the provided string is a valid email address."""
         email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
         return re.match(email_pattern, email) is not None
 
+    @timed("auth")
     def register(self, email, password):
         """Register a new user with a hashed password."""
         # Validate email format
         if not self._is_valid_email(email):
             return False, "Please enter a valid email address."
             
-        data = self._load_db()
-        if email in data:
-            return False, "This email address is already registered."
         # Hash the password for storage
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
-        data[email] = {"password": hashed_pw, "itineraries": []}
-        self._save_db(data)
+        if not self.storage.add_user(email, hashed_pw):
+            return False, "This email address is already registered."
         return True, "Account created successfully."
 
+    @timed("auth")
     def authenticate(self, email, password):
         """Verify email and password. Returns (True, msg) if valid, else (False, msg)."""
         # Special case for test user (for development purposes)
@@ -57,56 +103,104 @@ class AuthManager:
         if not self._is_valid_email(email):
             return False, "Please enter a valid email address."
             
-        data = self._load_db()
-        if email not in data:
+        user = self.storage.get_user(email)
+        if user is None:
             return False, "No account found with this email address."
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
-        if data[email]["password"] == hashed_pw:
+        if user["password"] == hashed_pw:
             return True, "Authentication successful."
         else:
             return False, "Incorrect password."
 
+    @timed("auth")
     def save_itinerary(self, email, itinerary_text):
         """Save a new itinerary (text) under the given user's account."""
         # Special case for test user
         if email == "test":
             return True, "Itinerary saved."
             
-        data = self._load_db()
-        if email not in data:
-            return False, "User not found."
         # Append the itinerary text to the user's list of itineraries
-        data[email]["itineraries"].append(itinerary_text)
-        self._save_db(data)
+        if self.write_queue is not None:
+            if self.storage.get_user(email) is None:
+                return False, "User not found."
+            itinerary_id = self.write_queue.submit(WRITE_ADD, email, itinerary_text)
+        else:
+            itinerary_id = self.storage.add_itinerary(email, itinerary_text)
+        if itinerary_id is None:
+            return False, "User not found."
         return True, "Itinerary saved."
 
+    @timed("auth")
     def get_itineraries(self, email):
         """Retrieve all itineraries saved by the user."""
         # Special case for test user
         if email == "test":
             return []
             
-        data = self._load_db()
-        if email in data:
-            return data[email].get("itineraries", [])
-        return []
+        self._read_own_writes(email)
+        return self.storage.get_itineraries(email)
 
-    def delete_itinerary(self, email, index):
-        """Delete an itinerary at the specified index from the user's account."""
+    @timed("auth")
+    def get_itinerary_page(self, email, offset=0, limit=20):
+        """Return (summaries, total) for one page of the user's itineraries, oldest first."""
+        # Special case for test user
+        if email == "test":
+            return [], 0
+            
+        self._read_own_writes(email)
+        return self.storage.get_itinerary_summaries(email, offset, limit), self.storage.count_itineraries(email)
+
+    @timed("auth")
+    def get_itinerary(self, email, itinerary_id):
+        """Retrieve one saved itinerary by its ID, or None if the user has no such itinerary."""
+        # Special case for test user
+        if email == "test":
+            return None
+            
+        self._read_own_writes(email)
+        return self.storage.get_itinerary(email, itinerary_id)
+
+    def storage_stats(self):
+        """Return itinerary and blob counts and their raw, compressed and database sizes."""
+        return self.storage.storage_stats()
+
+    def compact_storage(self, vacuum=False):
+        """Delete itinerary blobs that no saved itinerary refers to. Returns how many were removed.
+
+        vacuum=True also shrinks an SQLite file, locking it for the whole rewrite.
+        """
+        return self.storage.compact(vacuum=vacuum)
+
+    @timed("auth")
+    def delete_itinerary(self, email, itinerary_id):
+        """Delete an itinerary by its ID from the user's account."""
         # Special case for test user
         if email == "test":
             return True, "Itinerary deleted."
             
-        data = self._load_db()
-        if email not in data:
+        if self.storage.get_user(email) is None:
             return False, "User not found."
             
-        itineraries = data[email].get("itineraries", [])
-        if not 0 <= index < len(itineraries):
+        # Remove the itinerary with the given ID
+        if self.write_queue is not None:
+            # The itinerary may be a journaled save that is not committed yet
+            self._read_own_writes(email)
+            deleted = self.storage.has_itinerary(email, itinerary_id) and \
+                self.write_queue.submit(WRITE_DELETE, email, itinerary_id)
+        else:
+            deleted = self.storage.delete_itinerary(email, itinerary_id)
+        if not deleted:
             return False, "Itinerary not found."
-            
-        # Remove the itinerary at the specified index
-        del itineraries[index]
-        data[email]["itineraries"] = itineraries
-        self._save_db(data)
         return True, "Itinerary deleted."
+
+
+if __name__ == "__main__":
+    # Maintenance: python auth.py compact [--vacuum]
+    if sys.argv[1:2] != ["compact"]:
+        sys.exit("usage: python auth.py compact [--vacuum]")
+    manager = AuthManager()
+    try:
+        removed = manager.compact_storage(vacuum="--vacuum" in sys.argv[2:])
+        print(f"Removed {removed} unreferenced itinerary blobs")
+    finally:
+        manager.close()
@@ -0,0 +1,636 @@
+# auth_storage.py
+import json, os, re, time
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from blob_store import FileBlobStore, blob_key, compress, decompress
+
+try:
+    import fcntl  # POSIX only; without it writes are only serialised within the process
+except ImportError:
+    fcntl = None
+
+DB_FILE = "users_db.json"  # Legacy JSON database
+SQLITE_DB_FILE = "users.db"
+STORAGE_BACKEND = os.environ.get("AUTH_STORAGE_BACKEND", "sqlite")  # "sqlite" or "json"
+
+
+class JSONStorage:
+    """Stores every user and itinerary in a single JSON file.
+
+    Reads are served from an in-memory snapshot that is reloaded only when the
+    file changes on disk. Writes hold an inter-process lock and replace the file
+    atomically, so concurrent writers don't lose updates and readers never see
+    a half-written file. Writers change a copy of the snapshot and swap it in,
+    so readers can iterate the snapshot without taking the lock. Itinerary bodies are kept out of the file, as
+    compressed blobs in a directory next to it. Each itinerary has an ID that
+    is unique per user and never reused, like an SQLite AUTOINCREMENT key.
+    """
+
+    def __init__(self, db_path=DB_FILE):
+        self.db_path = db_path
+        self.lock_path = db_path + ".lock"
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._snapshot_signature = None
+        # If database file doesn't exist, create an empty JSON file
+        if not os.path.exists(self.db_path):
+            with self._write_lock():
+                if not os.path.exists(self.db_path):
+                    self._save_db({})
+        self.blobs = FileBlobStore(json_blob_directory(db_path))
+        self._move_bodies_to_blobs()
+
+    def _file_signature(self):
+        """Identify the current version of the file; atomic replaces change the inode."""
+        st = os.stat(self.db_path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_db(self):
+        """Return the user database, re-reading the JSON file only if it changed. Treat it as read-only."""
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._snapshot_signature:
+                return self._snapshot
+            with open(self.db_path, 'r') as f:
+                try:
+                    data = json.load(f)
+                except json.JSONDecodeError as e:
+                    # Never treat a corrupt file as an empty database
+                    if self._snapshot is not None:
+                        print(f"Could not parse {self.db_path} ({e}), keeping last good copy")
+                        return self._snapshot
+                    raise ValueError(f"User database {self.db_path} is corrupt: {e}")
+            self._snapshot = data
+            self._snapshot_signature = signature
+            return data
+
+    def _load_db_for_update(self):
+        """Return a copy of the database for a writer to change and save.
+
+        The snapshot _load_db hands out is shared with readers that iterate it
+        without the lock, so writers never change it in place; _save_db swaps
+        the saved copy in as the new snapshot.
+        """
+        return {
+            email: {**user, "itineraries": list(user.get("itineraries", []))}
+            for email, user in self._load_db().items()
+        }
+
+    def _save_db(self, data):
+        """Atomically replace the JSON file with the given database dictionary."""
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".users_db.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.db_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._snapshot = data
+        self._snapshot_signature = self._file_signature()
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialise read-modify-write cycles across threads and processes."""
+        with self._lock:
+            lock_file = open(self.lock_path, 'a') if fcntl else None
+            try:
+                if lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                if lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def get_user(self, email):
+        """Return the user's record ({"password": hash}) or None."""
+        user = self._load_db().get(email)
+        if user is None:
+            return None
+        return {"password": user["password"]}
+
+    def add_user(self, email, password_hash):
+        """Create a user. Returns False if the email is already registered."""
+        with self._write_lock():
+            data = self._load_db_for_update()
+            if email in data:
+                return False
+            data[email] = {"password": password_hash, "itineraries": [], "next_id": 0}
+            self._save_db(data)
+        return True
+
+    def add_itinerary(self, email, itinerary_text):
+        """Append an itinerary for the user. Returns its ID, or None if the user doesn't exist."""
+        with self._write_lock():
+            data = self._load_db_for_update()
+            itinerary_id = self._add_itinerary(data, email, itinerary_text)
+            if itinerary_id is not None:
+                self._save_db(data)
+        return itinerary_id
+
+    def get_itineraries(self, email):
+        """Return the user's itinerary texts, oldest first."""
+        user = self._load_db().get(email)
+        if user is None:
+            return []
+        return [self._resolve(entry) for entry in user.get("itineraries", [])]
+
+    def delete_itinerary(self, email, itinerary_id):
+        """Delete an itinerary by ID. Returns False if there is no such itinerary."""
+        with self._write_lock():
+            data = self._load_db_for_update()
+            deleted = self._delete_itinerary(data, email, itinerary_id)
+            if deleted:
+                self._save_db(data)
+        return deleted
+
+    def apply_batch(self, writes):
+        """Apply ("add", email, itinerary) and ("delete", email, itinerary_id) writes in order with one file rewrite.
+
+        Returns each write's result, as add_itinerary or delete_itinerary would.
+        """
+        with self._write_lock():
+            data = self._load_db_for_update()
+            results = [
+                self._add_itinerary(data, email, argument) if op == "add" else self._delete_itinerary(data, email, argument)
+                for op, email, argument in writes
+            ]
+            if any(result not in (None, False) for result in results):
+                self._save_db(data)
+        return results
+
+    def _add_itinerary(self, data, email, itinerary):
+        if email not in data:
+            return None
+        user = data[email]
+        itinerary_id = self._next_id(user)
+        user.setdefault("itineraries", []).append({"id": itinerary_id, **self._blob_reference(itinerary)})
+        return itinerary_id
+
+    def _delete_itinerary(self, data, email, itinerary_id):
+        if email not in data:
+            return False
+        itineraries = data[email].get("itineraries", [])
+        index = _find_itinerary(itineraries, itinerary_id)
+        if index is None:
+            return False
+        # The blob stays until compact() finds it unreferenced
+        del itineraries[index]
+        data[email]["itineraries"] = itineraries
+        return True
+
+    def _next_id(self, user):
+        """Take the user's next itinerary ID; IDs of deleted itineraries are never handed out again."""
+        if "next_id" not in user:
+            # Records written by older versions have no counter yet
+            user["next_id"] = max((entry.get("id", -1) for entry in user.get("itineraries", [])), default=-1) + 1
+        itinerary_id = user["next_id"]
+        user["next_id"] = itinerary_id + 1
+        return itinerary_id
+
+    def count_itineraries(self, email):
+        """Return how many itineraries the user has saved."""
+        user = self._load_db().get(email)
+        return len(user.get("itineraries", [])) if user else 0
+
+    def get_itinerary_summaries(self, email, offset=0, limit=None):
+        """Return summaries of the user's itineraries, oldest first, without their content."""
+        user = self._load_db().get(email)
+        if user is None:
+            return []
+        itineraries = user.get("itineraries", [])
+        end = len(itineraries) if limit is None else offset + limit
+        return [
+            {"id": entry["id"], "created_at": None, **self._summary(entry)}
+            for entry in itineraries[offset:end]
+        ]
+
+    def get_itinerary(self, email, itinerary_id):
+        """Return one itinerary by ID, or None."""
+        user = self._load_db().get(email)
+        itineraries = user.get("itineraries", []) if user else []
+        index = _find_itinerary(itineraries, itinerary_id)
+        return None if index is None else self._resolve(itineraries[index])
+
+    def has_itinerary(self, email, itinerary_id):
+        """Whether the user has an itinerary with this ID."""
+        user = self._load_db().get(email)
+        return user is not None and _find_itinerary(user.get("itineraries", []), itinerary_id) is not None
+
+    def storage_stats(self):
+        """Return itinerary and blob counts and their raw, stored and database sizes in bytes."""
+        entries = [entry for user in self._load_db().values() for entry in user.get("itineraries", [])]
+        referenced = {entry["$blob"] for entry in entries if _is_blob_reference(entry)}
+        keys = self.blobs.keys()
+        return {
+            "itineraries": len(entries),
+            "blobs": len(keys),
+            "unreferenced_blobs": sum(key not in referenced for key in keys),
+            "raw_bytes": sum(self._summary(entry)["size"] for entry in entries),
+            "stored_bytes": sum(self.blobs.stored_size(key) for key in keys),
+            "db_bytes": os.path.getsize(self.db_path),
+        }
+
+    def compact(self, vacuum=False):
+        """Delete blobs no itinerary refers to. Returns how many were removed.
+
+        vacuum is accepted for parity with SQLiteStorage; deleted files free their space at once.
+        """
+        with self._write_lock():
+            data = self._load_db()
+            referenced = {
+                entry["$blob"] for user in data.values() for entry in user.get("itineraries", [])
+                if _is_blob_reference(entry)
+            }
+            removed = [key for key in self.blobs.keys() if key not in referenced]
+            for key in removed:
+                self.blobs.delete(key)
+        return len(removed)
+
+    def _blob_reference(self, itinerary):
+        """Store an itinerary's body as a blob; return the entry kept in the user's record."""
+        return {"$blob": self.blobs.put(encode_itinerary(itinerary).encode()), **summarize_itinerary(itinerary)}
+
+    def _resolve(self, entry):
+        """Return the itinerary an entry refers to, decompressing its blob."""
+        if _is_blob_reference(entry):
+            return decode_itinerary(self.blobs.get(entry["$blob"]).decode())
+        return entry
+
+    def _summary(self, entry):
+        if _is_blob_reference(entry):
+            return {field: entry[field] for field in ("title", "destination", "days", "size")}
+        return summarize_itinerary(entry)
+
+    def _move_bodies_to_blobs(self):
+        """Replace itineraries stored inline (by older versions) with blob references, and give them IDs.
+
+        Older versions used the position as the ID, so entries without one get
+        their position, keeping IDs clients already hold valid.
+        """
+        with self._write_lock():
+            data = self._load_db_for_update()
+            moved = numbered = 0
+            for user in data.values():
+                itineraries = user.get("itineraries", [])
+                for index, entry in enumerate(itineraries):
+                    if not _is_blob_reference(entry):
+                        itineraries[index] = entry = self._blob_reference(entry)
+                        moved += 1
+                    if "id" not in entry:
+                        itineraries[index] = {"id": index, **entry}
+                        numbered += 1
+                if "next_id" not in user:
+                    user["next_id"] = max((entry["id"] for entry in itineraries), default=-1) + 1
+                    numbered += 1
+            if moved or numbered:
+                self._save_db(data)
+            if moved:
+                print(f"Moved {moved} itineraries from {self.db_path} into {self.blobs.directory}")
+
+
+def json_blob_directory(db_path):
+    """Directory holding the itinerary blobs of the JSON database at db_path."""
+    return os.path.splitext(db_path)[0] + "_blobs"
+
+
+def _find_itinerary(itineraries, itinerary_id):
+    """Return the position of the itinerary with this ID, or None."""
+    return next((index for index, entry in enumerate(itineraries) if entry.get("id") == itinerary_id), None)
+
+
+def _is_blob_reference(entry):
+    return isinstance(entry, dict) and "$blob" in entry
+
+
+def encode_itinerary(itinerary):
+    """Serialise an itinerary (text or the dashboard's JSON object) for an SQLite row."""
+    return json.dumps(itinerary, separators=(",", ":"))
+
+
+def decode_itinerary(body):
+    """Inverse of encode_itinerary; rows stored as raw text are returned as is."""
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+# Titles such as "5-Day Trip to Paris" or "3 day itinerary for Kyoto"
+_TITLE_PATTERN = re.compile(r"(\d+)[\s-]*day\b.*?\b(?:to|in|for)\s+(.+)", re.IGNORECASE)
+
+
+def summarize_itinerary(itinerary):
+    """Return the title, destination, trip length and stored size (bytes) of an itinerary."""
+    text = itinerary.get("title", "") if isinstance(itinerary, dict) else str(itinerary)
+    # The title is the first line of text, whether the itinerary is HTML or Markdown
+    lines = [line.strip(" #*") for line in re.sub(r"<[^>]+>", "\n", text[:1000]).splitlines()]
+    title = next((line for line in lines if line), "")
+    match = _TITLE_PATTERN.search(title)
+    return {
+        "title": title or "Unnamed Trip",
+        "destination": match.group(2).strip(" .!") if match else None,
+        "days": int(match.group(1)) if match else None,
+        "size": len(encode_itinerary(itinerary).encode()),
+    }
+
+
+class SQLiteStorage:
+    """Stores users and itineraries as indexed rows in an SQLite database (WAL mode).
+
+    Itinerary bodies live in a reference-counted table of compressed blobs
+    keyed by content hash, so identical itineraries are stored once.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_FILE, migrate_from=DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "email TEXT PRIMARY KEY, password TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS itineraries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "email TEXT NOT NULL REFERENCES users(email), "
+                "body TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS itineraries_email ON itineraries (email, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, "
+                "stored_size INTEGER NOT NULL, refcount INTEGER NOT NULL)"
+            )
+            self._add_summary_columns(conn)
+            self._move_bodies_to_blobs(conn)
+        if migrate_from and os.path.exists(migrate_from):
+            self.migrate_from_json(migrate_from)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _add_summary_columns(self, conn):
+        """Add the columns listings are served from to older databases, filling them in from the bodies."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(itineraries)")}
+        if "size" in columns:
+            return
+        for column, kind in (("title", "TEXT"), ("destination", "TEXT"), ("days", "INTEGER"), ("size", "INTEGER")):
+            conn.execute(f"ALTER TABLE itineraries ADD COLUMN {column} {kind}")
+        rows = conn.execute("SELECT id, body FROM itineraries").fetchall()
+        conn.executemany(
+            "UPDATE itineraries SET title = ?, destination = ?, days = ?, size = ? WHERE id = ?",
+            [(*self._summary_values(decode_itinerary(body)), row_id) for row_id, body in rows]
+        )
+
+    def _move_bodies_to_blobs(self, conn):
+        """Move itinerary bodies stored inline (by older versions) into the blob table."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(itineraries)")}
+        if "blob" not in columns:
+            conn.execute("ALTER TABLE itineraries ADD COLUMN blob TEXT REFERENCES blobs(key)")
+        rows = conn.execute("SELECT id, body FROM itineraries WHERE blob IS NULL").fetchall()
+        for row_id, body in rows:
+            conn.execute(
+                "UPDATE itineraries SET blob = ?, body = '' WHERE id = ?", (self._put_blob(conn, body), row_id)
+            )
+        if rows:
+            print(f"Moved {len(rows)} itinerary bodies into blobs in {self.db_path}")
+
+    def _put_blob(self, conn, body):
+        """Add a reference to the blob holding body, storing it first if it is new; return its key."""
+        data = body.encode()
+        key = blob_key(data)
+        # The update takes the write lock, so no other writer can insert the same blob before we do
+        if conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE key = ?", (key,)).rowcount == 0:
+            stored = compress(data)
+            conn.execute(
+                "INSERT INTO blobs (key, data, size, stored_size, refcount) VALUES (?, ?, ?, ?, 1)",
+                (key, stored, len(data), len(stored))
+            )
+        return key
+
+    def _summary_values(self, itinerary):
+        summary = summarize_itinerary(itinerary)
+        return summary["title"], summary["destination"], summary["days"], summary["size"]
+
+    def migrate_from_json(self, json_path):
+        """Import users and itineraries from a legacy JSON database, then rename it.
+
+        The JSON file is renamed to <name>.migrated so the import only happens once.
+        A file that cannot be read completely is left in place and nothing is imported.
+        Returns the number of users imported.
+        """
+        with open(json_path, 'r') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                # Never hide the data behind an empty database; the import is retried on the next start
+                print(f"Could not migrate {json_path}, it is corrupt ({e}); leaving it in place")
+                return 0
+
+        json_blobs = None  # opened only if the JSON database keeps its bodies as blobs
+
+        def resolve(entry):
+            """Return the itinerary a JSON entry holds, reading it from the JSON database's blobs if needed."""
+            nonlocal json_blobs
+            if not _is_blob_reference(entry):
+                return entry
+            if json_blobs is None:
+                json_blobs = FileBlobStore(json_blob_directory(json_path))
+            return decode_itinerary(json_blobs.get(entry["$blob"]).decode())
+
+        now = time.time()
+        imported = 0
+        try:
+            with self._connect() as conn:
+                for email, user in data.items():
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO users (email, password) VALUES (?, ?)",
+                        (email, user["password"])
+                    )
+                    if cursor.rowcount == 0:
+                        continue  # Already present, keep the SQLite copy
+                    bodies = [resolve(entry) for entry in user.get("itineraries", [])]
+                    conn.executemany(
+                        "INSERT INTO itineraries (email, body, blob, created_at, title, destination, days, size) "
+                        "VALUES (?, '', ?, ?, ?, ?, ?, ?)",
+                        [(email, self._put_blob(conn, encode_itinerary(body)), now, *self._summary_values(body))
+                         for body in bodies]
+                    )
+                    imported += 1
+        except OSError as e:
+            # A missing or unreadable blob rolls the whole import back
+            print(f"Could not migrate {json_path} ({e}); leaving it in place")
+            return 0
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {imported} users from {json_path} to {self.db_path}")
+        return imported
+
+    def get_user(self, email):
+        """Return the user's record ({"password": hash}) or None."""
+        row = self._connect().execute(
+            "SELECT password FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"password": row[0]}
+
+    def add_user(self, email, password_hash):
+        """Create a user. Returns False if the email is already registered."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO users (email, password) VALUES (?, ?)",
+                (email, password_hash)
+            )
+        return cursor.rowcount == 1
+
+    def add_itinerary(self, email, itinerary_text):
+        """Append an itinerary for the user. Returns its ID, or None if the user doesn't exist."""
+        with self._connect() as conn:
+            return self._add_itinerary(conn, email, itinerary_text)
+
+    def get_itineraries(self, email):
+        """Return the user's itinerary texts, oldest first."""
+        rows = self._connect().execute(
+            "SELECT blobs.data FROM itineraries JOIN blobs ON blobs.key = itineraries.blob "
+            "WHERE email = ? ORDER BY id", (email,)
+        ).fetchall()
+        return [decode_itinerary(decompress(row[0]).decode()) for row in rows]
+
+    def delete_itinerary(self, email, itinerary_id):
+        """Delete an itinerary by ID. Returns False if there is no such itinerary."""
+        with self._connect() as conn:
+            return self._delete_itinerary(conn, email, itinerary_id)
+
+    def apply_batch(self, writes):
+        """Apply ("add", email, itinerary) and ("delete", email, itinerary_id) writes in order in one transaction.
+
+        Returns each write's result, as add_itinerary or delete_itinerary would.
+        """
+        with self._connect() as conn:
+            return [
+                self._add_itinerary(conn, email, argument) if op == "add" else self._delete_itinerary(conn, email, argument)
+                for op, email, argument in writes
+            ]
+
+    def _add_itinerary(self, conn, email, itinerary):
+        key = self._put_blob(conn, encode_itinerary(itinerary))
+        cursor = conn.execute(
+            "INSERT INTO itineraries (email, body, blob, created_at, title, destination, days, size) "
+            "SELECT email, '', ?, ?, ?, ?, ?, ? FROM users WHERE email = ?",
+            (key, time.time(), *self._summary_values(itinerary), email)
+        )
+        if cursor.rowcount == 0:
+            # No such user; compaction reclaims the blob if it was new
+            self._release_blob(conn, key)
+            return None
+        return cursor.lastrowid
+
+    def _delete_itinerary(self, conn, email, itinerary_id):
+        row = conn.execute(
+            "SELECT blob FROM itineraries WHERE email = ? AND id = ?", (email, itinerary_id)
+        ).fetchone()
+        if row is None:
+            return False
+        # Another worker may have deleted it in the meantime
+        if conn.execute("DELETE FROM itineraries WHERE id = ?", (itinerary_id,)).rowcount == 0:
+            return False
+        self._release_blob(conn, row[0])
+        return True
+
+    def count_itineraries(self, email):
+        """Return how many itineraries the user has saved."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM itineraries WHERE email = ?", (email,)
+        ).fetchone()[0]
+
+    def get_itinerary_summaries(self, email, offset=0, limit=None):
+        """Return summaries of the user's itineraries, oldest first, without their content."""
+        # Only the summary columns are read, so large bodies stay on disk
+        rows = self._connect().execute(
+            "SELECT id, title, destination, days, size, created_at FROM itineraries "
+            "WHERE email = ? ORDER BY id LIMIT ? OFFSET ?",
+            (email, -1 if limit is None else limit, offset)
+        ).fetchall()
+        return [
+            {"id": row[0], "title": row[1], "destination": row[2], "days": row[3], "size": row[4], "created_at": row[5]}
+            for row in rows
+        ]
+
+    def get_itinerary(self, email, itinerary_id):
+        """Return one itinerary by ID, or None."""
+        # Only this one blob is decompressed
+        row = self._connect().execute(
+            "SELECT blobs.data FROM itineraries JOIN blobs ON blobs.key = itineraries.blob "
+            "WHERE email = ? AND id = ?", (email, itinerary_id)
+        ).fetchone()
+        return decode_itinerary(decompress(row[0]).decode()) if row else None
+
+    def has_itinerary(self, email, itinerary_id):
+        """Whether the user has an itinerary with this ID."""
+        return self._connect().execute(
+            "SELECT 1 FROM itineraries WHERE email = ? AND id = ?", (email, itinerary_id)
+        ).fetchone() is not None
+
+    def storage_stats(self):
+        """Return itinerary and blob counts and their raw, stored and database sizes in bytes."""
+        conn = self._connect()
+        itineraries, raw_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM itineraries").fetchone()
+        blobs, stored_bytes, unreferenced = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(stored_size), 0), COALESCE(SUM(refcount <= 0), 0) FROM blobs"
+        ).fetchone()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "itineraries": itineraries,
+            "blobs": blobs,
+            "unreferenced_blobs": unreferenced,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "db_bytes": page_count * page_size,
+        }
+
+    def compact(self, vacuum=False):
+        """Delete blobs no itinerary refers to. Returns how many were removed.
+
+        Freed pages are reused by later writes. With vacuum=True the file is
+        also rewritten to return them to the OS; VACUUM holds an exclusive lock
+        for the whole rewrite, so only do that in a maintenance window.
+        """
+        conn = self._connect()
+        with conn:
+            removed = conn.execute("DELETE FROM blobs WHERE refcount <= 0").rowcount
+        if vacuum:
+            conn.execute("VACUUM")
+        return removed
+
+    def _release_blob(self, conn, key):
+        """Drop one reference to a blob; compact() deletes it once none are left."""
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE key = ?", (key,))
+
+
+def create_storage(backend=STORAGE_BACKEND, db_path=None):
+    """Create the storage backend selected by AUTH_STORAGE_BACKEND."""
+    if backend == "json":
+        return JSONStorage(db_path or DB_FILE)
+    if backend == "sqlite":
+        if db_path and db_path.endswith(".json"):
+            # A legacy JSON path: migrate it into an SQLite database next to it
+            return SQLiteStorage(os.path.splitext(db_path)[0] + ".db", migrate_from=db_path)
+        return SQLiteStorage(db_path or SQLITE_DB_FILE)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,108 @@
+"""
+Booking search benchmark for AI Trip Planner
+Runs flight searches against mock providers with configurable latency, once
+calling the providers one after another and once with the concurrent fan-out
+in booking.py, and reports latency percentiles, how many searches came back
+partial and how long the first batch of offers took. Everything runs offline;
+the result cache is bypassed so every search reaches the providers.
+
+Usage:
+    python benchmarks/booking_benchmark.py --providers 4 --latency lognormal:0.3:0.5
+    python benchmarks/booking_benchmark.py --latency 0.1,0.2,0.3,uniform:1:4 --timeout 1.5 --error-rate 0.05
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from booking import BookingSearch, FLIGHTS, create_mock_providers
+from load_test import DESTINATIONS, percentile
+
+
+class _NoCache:
+    """Stands in for the result cache so every search reaches the providers."""
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def run_sequential(providers, searches, days):
+    """Call each provider in turn, as the synchronous stubs would; return per-search latencies."""
+    latencies = []
+    for i in range(searches):
+        destination = DESTINATIONS[i % len(DESTINATIONS)]
+        started = time.monotonic()
+        for provider in providers:
+            try:
+                provider.search_flights("Home", destination, days)
+            except Exception:
+                pass
+        latencies.append(time.monotonic() - started)
+    return latencies
+
+
+def run_fanout(search, searches, days):
+    """Search through the fan-out; return per-search latencies and time to the first offers."""
+    latencies, first_offers = [], []
+    for i in range(searches):
+        destination = DESTINATIONS[i % len(DESTINATIONS)]
+        started = time.monotonic()
+        first = None
+        for offers, _ in search.iter_cheapest(FLIGHTS, "Home", destination, days):
+            if first is None and offers:
+                first = time.monotonic() - started
+        latencies.append(time.monotonic() - started)
+        if first is not None:
+            first_offers.append(first)
+    return latencies, first_offers
+
+
+def report(name, latencies):
+    print(f"{name:<22}{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}"
+          f"{percentile(latencies, 99) * 1000:>10.1f}{max(latencies) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=4, help="number of mock providers")
+    parser.add_argument("--latency", default="lognormal:0.2:0.6",
+                        help="provider latency spec, or a comma-separated spec per provider")
+    parser.add_argument("--timeout", type=float, default=1.0, help="per-provider timeout in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of provider calls that fail")
+    parser.add_argument("--searches", type=int, default=50, help="searches per mode")
+    parser.add_argument("--days", type=int, default=5, help="trip length searched")
+    parser.add_argument("--seed", type=int, help="random seed for repeatable runs")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    providers = create_mock_providers(args.providers, args.latency, args.error_rate, args.timeout)
+    search = BookingSearch(providers, cache=_NoCache())
+
+    sequential = run_sequential(providers, args.searches, args.days)
+    fanout, first_offers = run_fanout(search, args.searches, args.days)
+
+    print(f"{args.searches} searches, {args.providers} providers, latency {args.latency}, timeout {args.timeout}s")
+    print(f"{'mode':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    report("sequential", sequential)
+    report("fan-out", fanout)
+    if first_offers:
+        report("fan-out first offers", first_offers)
+    stats = search.stats()
+    print(f"\nPartial results: {stats['partial']} of {stats['searches']} searches")
+    for name, counts in stats["provider_results"].items():
+        print(f"  {name}: {counts['ok']} ok, {counts['timeout']} timed out, {counts['error']} failed")
+    search.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Load test for AI Trip Planner
+Drives register/login -> chat -> follow-up -> save flows at a target rate
+against the app and reports per-step latency percentiles, error rates and the
+response cache hit ratio. By default everything runs in-process and offline:
+OpenAI calls go to the mock server in mock_openai_server.py and the app is
+exercised through Flask's test client.
+
+Usage:
+    python benchmarks/load_test.py --rps 20 --duration 30
+    python benchmarks/load_test.py --rps 20 --duration 30 --latency lognormal:2:0.6 --error-rate 0.05
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --rps 5   # a running server
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai_server import start_server, add_arguments, config_from_args
+
+DESTINATIONS = [
+    "Paris", "Tokyo", "New York", "Rome", "Barcelona", "London", "Bangkok", "Bali", "Sydney", "Istanbul",
+    "Lisbon", "Prague", "Kyoto", "Cape Town", "Reykjavik", "Marrakech", "Vancouver", "Seoul", "Hanoi", "Lima"
+]
+FOLLOWUPS = [
+    "What are the best restaurants in {destination}?",
+    "Which hotels would you recommend in {destination}?",
+    "What should I do in {destination} if it rains?",
+]
+# Different ways users phrase the same new query
+PHRASINGS = ["{destination}", "I want to go to {destination}", "Plan a trip to {destination}", "{destination} please"]
+PREFERENCES = [[], ["food"], ["culture", "history"], ["nature"]]
+STEPS = ["login", "chat", "followup", "save"]
+
+
+def zipf_choice(items, s=1.1):
+    """Pick an item with Zipf-like popularity so a few destinations dominate, as in real traffic."""
+    weights = [1.0 / (rank ** s) for rank in range(1, len(items) + 1)]
+    return random.choices(items, weights=weights)[0]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Results:
+    """Thread-safe collection of step latencies and outcomes."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.flows = 0
+        self.lock = threading.Lock()
+
+    def record(self, step, seconds, ok):
+        with self.lock:
+            self.latencies[step].append(seconds)
+            if not ok:
+                self.errors[step] += 1
+
+
+class InProcessClient:
+    """Calls the Flask app directly through its test client."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def post_form(self, path, form):
+        response = self.client.post(path, data=form)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post_json(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code, response.get_data(as_text=True)
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HTTPClient:
+    """Calls a running server over HTTP, keeping its session cookie."""
+
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            # Keep redirect responses so login is timed on its own
+            type("NoRedirect", (urllib.request.HTTPRedirectHandler,), {"redirect_request": lambda *args: None})()
+        )
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.read().decode("utf-8")
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode("utf-8", "replace")
+
+    def post_form(self, path, form):
+        body = urllib.parse.urlencode(form).encode()
+        return self._open(urllib.request.Request(self.base_url + path, data=body, method="POST"))
+
+    def post_json(self, path, payload):
+        request = urllib.request.Request(
+            self.base_url + path, data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        return self._open(request)
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+
+def timed(results, step, fn, is_ok):
+    start = time.perf_counter()
+    try:
+        status, body = fn()
+        ok = is_ok(status, body)
+    except Exception:
+        status, body, ok = 0, "", False
+    results.record(step, time.perf_counter() - start, ok)
+    return ok, body
+
+
+def json_success(status, body):
+    return status == 200 and json.loads(body).get("success", False)
+
+
+def stream_success(status, body):
+    return status == 200 and "event: done" in body and '"success": true' in body
+
+
+def run_flow(make_client, email, password, results, days, stream=False):
+    """One user session: login, a new destination, a follow-up question and a save."""
+    client = make_client()
+    ok, _ = timed(results, "login", lambda: client.post_form("/login", {"email": email, "password": password}),
+                  lambda status, body: status in (302, 303))
+    if not ok:
+        return
+
+    destination = zipf_choice(DESTINATIONS)
+    message = random.choice(PHRASINGS).format(destination=destination)
+    payload = {"message": message, "days": days, "preferences": random.choice(PREFERENCES)}
+    if stream:
+        ok, body = timed(results, "chat", lambda: client.post_json("/chat/stream", payload), stream_success)
+        if not ok:
+            return
+        itinerary = json.loads(body.rsplit("data: ", 1)[1])
+    else:
+        ok, body = timed(results, "chat", lambda: client.post_json("/chat", payload), json_success)
+        if not ok:
+            return
+        itinerary = json.loads(body)
+
+    question = random.choice(FOLLOWUPS).format(destination=destination)
+    payload = {"message": question, "days": days, "is_followup": True}
+    timed(results, "followup", lambda: client.post_json("/chat", payload), json_success)
+
+    saved = {"destination": destination, "days": days, "content": itinerary.get("response", ""),
+             "budget": itinerary.get("budget")}
+    timed(results, "save", lambda: client.post_json("/save_itinerary", {"itinerary": saved}), json_success)
+    with results.lock:
+        results.flows += 1
+
+
+def register_users(make_client, count):
+    users = []
+    client = make_client()
+    for i in range(count):
+        email, password = f"loadtest{i}@example.com", "loadtest-password"
+        client.post_form("/register", {"email": email, "password": password, "confirm_password": password})
+        users.append((email, password))
+    return users
+
+
+def drive(make_client, users, rps, duration, concurrency, days, stream=False):
+    """Start flows open-loop at the target rate, so slow responses don't lower the offered load."""
+    results = Results()
+    interval = 1.0 / rps
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        next_start = started
+        while next_start - started < duration:
+            now = time.perf_counter()
+            if now < next_start:
+                time.sleep(next_start - now)
+            email, password = random.choice(users)
+            pool.submit(run_flow, make_client, email, password, results, days, stream)
+            # Poisson arrivals around the target rate
+            next_start += random.expovariate(1.0 / interval)
+    results.elapsed = time.perf_counter() - started
+    return results
+
+
+def report(results, cache_stats):
+    print(f"\nCompleted {results.flows} flows in {results.elapsed:.1f}s ({results.flows / results.elapsed:.2f} flows/s)")
+    print(f"{'step':<10}{'count':>8}{'errors':>8}{'err %':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step in STEPS:
+        values = results.latencies.get(step, [])
+        errors = results.errors.get(step, 0)
+        print(f"{step:<10}{len(values):>8}{errors:>8}{(100.0 * errors / len(values) if values else 0):>8.1f}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{(max(values) if values else 0) * 1000:>10.1f}")
+    if cache_stats:
+        print(f"\nResponse cache: hit ratio {cache_stats.get('hit_ratio', 0):.1%} "
+              f"({cache_stats.get('hits', 0)} hits, {cache_stats.get('misses', 0)} misses, "
+              f"{cache_stats.get('size', 0)} entries)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running app; default runs the app in-process")
+    parser.add_argument("--mock-url", help="use an already running mock OpenAI server instead of starting one")
+    parser.add_argument("--rps", type=float, default=10.0, help="flows started per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to keep starting flows")
+    parser.add_argument("--users", type=int, default=50, help="number of registered test users")
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum flows in flight")
+    parser.add_argument("--days", type=int, default=5, help="trip length requested in each chat")
+    parser.add_argument("--stream", action="store_true", help="request itineraries from /chat/stream")
+    parser.add_argument("--seed", type=int, help="random seed for repeatable runs")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.url:
+        make_client = lambda: HTTPClient(args.url)
+        get_cache_stats = lambda: json.loads(HTTPClient(args.url).get("/status")[1]).get("response_cache")
+    else:
+        mock_url = args.mock_url
+        if not mock_url:
+            _, mock_url = start_server(config=config_from_args(args))
+            print(f"Mock OpenAI server listening on {mock_url}")
+        # Point the planner at the mock and keep the user DB and cache files out of the repo
+        os.environ.setdefault("OPENAI_API_KEY", "sk-mock-load-test")
+        os.environ["OPENAI_API_URL"] = mock_url
+        os.chdir(tempfile.mkdtemp(prefix="aitrip-load-"))
+        from app import app as flask_app, ai_planner
+        # Per-request planner logging would drown out the report
+        logging.disable(logging.INFO)
+        make_client = lambda: InProcessClient(flask_app)
+        get_cache_stats = ai_planner.response_cache.stats
+
+    users = register_users(make_client, args.users)
+    print(f"Registered {len(users)} users; running {args.rps} flows/s for {args.duration}s")
+    results = drive(make_client, users, args.rps, args.duration, args.concurrency, args.days, args.stream)
+    try:
+        cache_stats = get_cache_stats()
+    except Exception:
+        cache_stats = None
+    report(results, cache_stats)
+
+
+if __name__ == "__main__":
+    main()
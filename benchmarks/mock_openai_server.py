@@ -0,0 +1,236 @@
+"""
+Mock OpenAI-compatible server for offline benchmarking
+Implements POST /v1/chat/completions (streaming and non-streaming) with
+configurable latency, error rate and token pacing, so the app can be load
+tested without spending API credits.
+
+Usage:
+    python benchmarks/mock_openai_server.py --port 8001 --latency lognormal:1.5:0.5 --error-rate 0.02
+    OPENAI_API_KEY=mock OPENAI_API_URL=http://127.0.0.1:8001/v1 python app.py
+"""
+import json
+import re
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ITINERARY_HTML = (
+    "<h3>{days}-Day Trip</h3><table><tr><th>Day</th><th>Time</th><th>Activity</th></tr>{rows}</table>"
+    "<h3>Budget Estimate</h3><table><tr><th>Item</th><th>Cost</th></tr>"
+    "<tr><td>Accommodation</td><td>${hotel}</td></tr><tr><td>Food</td><td>${food}</td></tr>"
+    "<tr><td>Total</td><td>${total}</td></tr></table>"
+)
+ITINERARY_ROW = "<tr><td>Day {day}</td><td>{time}</td><td>Explore a local highlight and try the food</td></tr>"
+
+
+class LatencyModel:
+    """Samples a latency in seconds from a spec such as "0.5", "uniform:0.2:1.0" or "lognormal:1.5:0.5".
+
+    For lognormal the parameters are the median (seconds) and sigma.
+    """
+
+    def __init__(self, spec):
+        parts = spec.split(":")
+        self.kind = parts[0] if len(parts) > 1 else "constant"
+        self.params = [float(p) for p in (parts[1:] if len(parts) > 1 else parts)]
+        if self.kind not in ("constant", "uniform", "lognormal", "exponential"):
+            raise ValueError(f"Unknown latency distribution: {self.kind}")
+
+    def sample(self):
+        if self.kind == "constant":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        if self.kind == "exponential":
+            return random.expovariate(1.0 / self.params[0])
+        median, sigma = self.params
+        return random.lognormvariate(0, sigma) * median
+
+
+class MockConfig:
+    def __init__(self, latency="0.5", ttft="0.2", token_interval=0.01, error_rate=0.0,
+                 rate_limit_rate=0.0, completion_tokens=400, chunk_chars=20):
+        self.latency = LatencyModel(latency)
+        self.ttft = LatencyModel(ttft)
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.completion_tokens = completion_tokens
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+def build_content(request):
+    """Return a plausible reply for the request (JSON itinerary if a schema was requested)."""
+    text = json.dumps(request.get("messages", [])[-1:])
+    days = 3
+    for token in text.replace("-", " ").split():
+        if token.isdigit():
+            days = max(1, min(int(token), 30))
+            break
+    response_format = request.get("response_format", {})
+    if response_format.get("json_schema", {}).get("name") == "trip_outline":
+        return json.dumps({
+            "title": f"{days}-Day Trip",
+            "days": [{"day": d, "theme": f"Neighbourhood {d}"} for d in range(1, days + 1)],
+            "tips": ["Get a transit pass."]
+        }, separators=(",", ":"))
+    # Long trips ask for one range of days at a time
+    match = re.search(r"days (\d+) to (\d+)", text)
+    first, last = (int(match.group(1)), int(match.group(2))) if match else (1, days)
+    if response_format.get("type") == "json_schema":
+        days = last - first + 1
+        return json.dumps({
+            "title": f"{days}-Day Trip",
+            "question": "",
+            "days": [
+                {"day": d, "slots": [
+                    {"time": t, "activities": [{"name": "Local highlight", "details": "Explore and try the food."}]}
+                    for t in ("Morning", "Afternoon", "Evening")
+                ]}
+                for d in range(first, last + 1)
+            ],
+            "budget": {"currency": "USD", "items": [
+                {"category": "Accommodation", "amount": 120 * days},
+                {"category": "Food", "amount": 50 * days}
+            ], "total": 170 * days},
+            "tips": ["Book popular sights ahead."]
+        }, separators=(",", ":"))
+    rows = "".join(ITINERARY_ROW.format(day=d, time=t) for d in range(1, days + 1) for t in ("Morning", "Evening"))
+    return ITINERARY_HTML.format(days=days, rows=rows, hotel=120 * days, food=50 * days, total=170 * days)
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                return self._send_json(200, {"requests": config.requests, "errors": config.errors})
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send_json(404, {"error": {"message": "Not found"}})
+
+            with config.lock:
+                config.requests += 1
+            roll = random.random()
+            if roll < config.rate_limit_rate:
+                with config.lock:
+                    config.errors += 1
+                return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+            if roll < config.rate_limit_rate + config.error_rate:
+                time.sleep(config.latency.sample())
+                with config.lock:
+                    config.errors += 1
+                return self._send_json(500, {"error": {"message": "Mock upstream error", "type": "server_error"}})
+
+            content = build_content(request)
+            prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+            completion_tokens = len(content) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+            model = request.get("model", "mock")
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                return self._stream(content, model, completion_id, usage if include_usage else None)
+
+            time.sleep(config.latency.sample())
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+        def _stream(self, content, model, completion_id, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_event(payload):
+                data = f"data: {payload}\n\n".encode()
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            time.sleep(config.ttft.sample())
+            for start in range(0, len(content), config.chunk_chars):
+                write_event(json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + config.chunk_chars]}, "finish_reason": None}]
+                }))
+                time.sleep(config.token_interval)
+            write_event(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }))
+            if usage:
+                # Sent as a final chunk with no choices, as with stream_options.include_usage
+                write_event(json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [], "usage": usage
+                }))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_server(host="127.0.0.1", port=0, config=None):
+    """Start the mock server on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(config or MockConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", default="0.5", help="full response latency, e.g. 0.5, uniform:0.2:1, lognormal:1.5:0.5")
+    parser.add_argument("--ttft", default="0.2", help="time to first token when streaming (same format)")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 429")
+
+
+def config_from_args(args):
+    return MockConfig(latency=args.latency, ttft=args.ttft, token_interval=args.token_interval,
+                      error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, url = start_server(args.host, args.port, config_from_args(args))
+    print(f"Mock OpenAI server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,106 @@
+"""
+Content-addressed itinerary blobs for AI Trip Planner
+Saved itineraries are mostly styled HTML, and many users save the very same
+cached response. Each distinct body is stored once, compressed, under the
+SHA-256 of its content; user records keep only that key and a small summary,
+so loading the user database never touches the markup. Deleting an itinerary
+only drops a reference. compact() reclaims blobs that nobody references.
+"""
+import os
+import zlib
+import hashlib
+import tempfile
+
+# zstd is optional; without it blobs are compressed with zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configuration for itinerary blobs
+BLOB_CODEC = os.environ.get("ITINERARY_BLOB_CODEC", "zstd" if zstandard else "zlib")
+BLOB_COMPACT_INTERVAL = float(os.environ.get("BLOB_COMPACT_INTERVAL", "3600"))  # seconds between compactions, 0 = never
+# Also VACUUM SQLite after scheduled compactions; it locks and rewrites the whole database, so off by default
+BLOB_COMPACT_VACUUM = os.environ.get("BLOB_COMPACT_VACUUM", "false").lower() in ("1", "true", "yes")
+
+# The first byte of every stored blob names its codec, so blobs written with either can be read back
+_ZLIB = b"z"
+_ZSTD = b"s"
+
+
+def blob_key(data):
+    """Return the content address (SHA-256 hex digest) of data."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compress(data, codec=BLOB_CODEC):
+    """Compress data with codec ("zstd" or "zlib"), tagged so decompress() knows which was used."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("ITINERARY_BLOB_CODEC=zstd needs the zstandard package")
+        return _ZSTD + zstandard.ZstdCompressor(level=9).compress(data)
+    if codec == "zlib":
+        return _ZLIB + zlib.compress(data, 9)
+    raise ValueError(f"Unknown blob codec: {codec}")
+
+
+def decompress(blob):
+    """Inverse of compress()."""
+    tag, payload = blob[:1], blob[1:]
+    if tag == _ZSTD:
+        if zstandard is None:
+            raise ValueError("Blob was compressed with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if tag == _ZLIB:
+        return zlib.decompress(payload)
+    raise ValueError("Unknown blob codec tag")
+
+
+class FileBlobStore:
+    """Compressed blobs kept as one file each in a directory, named by their key.
+
+    Reference counts live with the references themselves (in the caller's
+    database); this class only stores, reads and removes the files.
+    """
+
+    def __init__(self, directory, codec=BLOB_CODEC):
+        self.directory = directory
+        self.codec = codec
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def put(self, data):
+        """Store data if it is not stored yet; return its key."""
+        key = blob_key(data)
+        path = self._path(key)
+        if not os.path.exists(path):
+            # Write to a temporary file first so a reader never sees a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".blob.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(compress(data, self.codec))
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return key
+
+    def get(self, key):
+        """Return the decompressed data stored under key."""
+        with open(self._path(key), 'rb') as f:
+            return decompress(f.read())
+
+    def delete(self, key):
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def keys(self):
+        """Return the keys of every stored blob."""
+        return [name for name in os.listdir(self.directory) if not name.startswith(".")]
+
+    def stored_size(self, key):
+        """Bytes the blob takes on disk."""
+        return os.path.getsize(self._path(key))
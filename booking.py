@@ -1,26 +1,260 @@
-# booking.py - Mock version for testing
+"""
+Flight and hotel search for AI Trip Planner
+Every search fans out to all booking providers at once, so a search takes
+about as long as the slowest provider that answers in time rather than the
+sum of all of them. Each provider has its own timeout; offers from providers
+that miss it are left out and the search returns what the others found. The
+cheapest offers are kept in a bounded heap as providers answer, and
+iter_cheapest() yields them after each answer so callers can show early
+results while slower providers are still running. Results are cached per
+(origin, destination, days) for BOOKING_CACHE_TTL seconds. The bundled mock
+providers have configurable latency so the fan-out can be benchmarked offline
+(see benchmarks/booking_benchmark.py).
+"""
+import os
+import time
+import heapq
 import random
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from response_cache import ResponseCache
+from metrics import BOOKING_PROVIDER_CALLS, BOOKING_PROVIDER_SECONDS
+
+logger = logging.getLogger('booking')
+
+# Configuration for booking search
+BOOKING_PROVIDERS = int(os.environ.get("BOOKING_PROVIDERS", "3"))  # number of mock providers
+BOOKING_MOCK_LATENCY = os.environ.get("BOOKING_MOCK_LATENCY", "0")  # latency spec per provider, comma-separated
+BOOKING_MOCK_ERROR_RATE = float(os.environ.get("BOOKING_MOCK_ERROR_RATE", "0"))
+BOOKING_PROVIDER_TIMEOUT = float(os.environ.get("BOOKING_PROVIDER_TIMEOUT", "2.0"))  # seconds per provider
+BOOKING_RESULTS = int(os.environ.get("BOOKING_RESULTS", "5"))  # cheapest offers returned per search
+BOOKING_CACHE_TTL = float(os.environ.get("BOOKING_CACHE_TTL", "600"))  # seconds
+BOOKING_PARTIAL_CACHE_TTL = float(os.environ.get("BOOKING_PARTIAL_CACHE_TTL", "30"))  # when a provider missed its timeout
+BOOKING_CACHE_MAX_ENTRIES = int(os.environ.get("BOOKING_CACHE_MAX_ENTRIES", "1000"))
+BOOKING_MAX_WORKERS = int(os.environ.get("BOOKING_MAX_WORKERS", "32"))
+
+# Search kinds and the field each kind's offers are ranked by
+FLIGHTS = "flights"
+HOTELS = "hotels"
+PRICE_FIELDS = {FLIGHTS: "price", HOTELS: "price_per_night"}
+
+# Mock providers quote the same offers with slightly different prices
+MOCK_PRICE_FACTORS = (1.0, 1.08, 0.93, 1.15, 0.97)
+
+
+def sample_latency(spec):
+    """Sample a latency in seconds from a spec such as "0.5", "uniform:0.2:1.0", "lognormal:1.5:0.5" or
+    "exponential:0.3" (the same specs as benchmarks/mock_openai_server.py)."""
+    parts = spec.split(":")
+    if len(parts) == 1:
+        return float(parts[0])
+    kind, params = parts[0], [float(p) for p in parts[1:]]
+    if kind == "uniform":
+        return random.uniform(params[0], params[1])
+    if kind == "exponential":
+        return random.expovariate(1.0 / params[0])
+    if kind == "lognormal":
+        return random.lognormvariate(0, params[1]) * params[0]
+    raise ValueError(f"Unknown latency distribution: {kind}")
+
+
+class BookingProvider:
+    """A source of flight and hotel offers; subclasses implement the two searches."""
+
+    def __init__(self, name, timeout=BOOKING_PROVIDER_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+
+    def search_flights(self, origin, destination, days):
+        """Return a list of flight offers, each with at least "airline" and "price"."""
+        raise NotImplementedError
+
+    def search_hotels(self, destination, days):
+        """Return a list of hotel offers, each with at least "name" and "price_per_night"."""
+        raise NotImplementedError
+
+
+class MockProvider(BookingProvider):
+    """Offline provider with fixed offers, scaled by price_factor and returned after a sampled latency."""
+
+    def __init__(self, name, latency="0", price_factor=1.0, error_rate=0.0, timeout=BOOKING_PROVIDER_TIMEOUT):
+        super().__init__(name, timeout)
+        self.latency = latency
+        self.price_factor = price_factor
+        self.error_rate = error_rate
+        sample_latency(latency)  # reject a bad spec here rather than on every search
+
+    def _respond(self):
+        time.sleep(sample_latency(self.latency))
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"{self.name} search failed")
+
+    def search_flights(self, origin, destination, days):
+        self._respond()
+        return [
+            {"airline": "FlyFast Airways", "price": round(350 * self.price_factor), "origin": origin,
+             "destination": destination},
+            {"airline": "BudgetAir", "price": round(280 * self.price_factor), "origin": origin,
+             "destination": destination}
+        ]
+
+    def search_hotels(self, destination, days):
+        self._respond()
+        return [
+            {"name": f"{destination} Hotel", "price_per_night": round(120 * self.price_factor)},
+            {"name": f"{destination} Inn", "price_per_night": round(75 * self.price_factor)}
+        ]
+
+
+class BookingSearch:
+    """Searches every provider at once and merges their offers, cheapest first."""
+
+    def __init__(self, providers, results=BOOKING_RESULTS, cache=None, max_workers=BOOKING_MAX_WORKERS):
+        self.providers = list(providers)
+        self.results = results
+        self.cache = cache if cache is not None else ResponseCache(max_entries=BOOKING_CACHE_MAX_ENTRIES,
+                                                                   ttl=BOOKING_CACHE_TTL)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="booking")
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.partial = 0  # searches where at least one provider timed out or failed
+        self._provider_counts = {provider.name: {"ok": 0, "timeout": 0, "error": 0} for provider in self.providers}
+
+    def search_flights(self, origin, destination, days, k=None):
+        return self.search(FLIGHTS, origin, destination, days, k)
+
+    def search_hotels(self, destination, days, k=None):
+        return self.search(HOTELS, None, destination, days, k)
+
+    def search(self, kind, origin, destination, days, k=None):
+        """Return the k cheapest offers from the providers that answer in time, using the cache when possible."""
+        key = (kind, origin, destination, days, k or self.results)
+        offers = self.cache.get(key)
+        if offers is not None:
+            return offers
+        offers, complete = [], True
+        for offers, complete in self.iter_cheapest(kind, origin, destination, days, k):
+            pass
+        self.cache.set(key, offers, ttl=None if complete else BOOKING_PARTIAL_CACHE_TTL)
+        return offers
+
+    def iter_cheapest(self, kind, origin, destination, days, k=None):
+        """
+        Search every provider concurrently and yield (offers, complete) each time one answers:
+        the k cheapest offers found so far, and whether every provider has answered or given up.
+        A last yield with complete=True follows once the remaining providers have missed their timeouts.
+        """
+        k = k or self.results
+        price_field = PRICE_FIELDS[kind]
+        start = time.monotonic()
+        futures = {
+            self.executor.submit(self._call, provider, kind, origin, destination, days): provider
+            for provider in self.providers
+        }
+        pending = set(futures)
+        # Max-heap of the k cheapest offers so far: (-price, arrival order, offer)
+        cheapest = []
+        arrival = itertools.count()
+        complete = True
+        while pending:
+            # Stop waiting once every provider still running is past its own timeout
+            remaining = max(start + futures[future].timeout for future in pending) - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = futures[future]
+                try:
+                    offers, elapsed = future.result()
+                except Exception as e:
+                    self._record(provider, "error")
+                    logger.warning(f"Booking provider {provider.name} failed: {str(e)}")
+                    complete = False
+                    continue
+                if elapsed > provider.timeout:
+                    self._record(provider, "timeout")
+                    complete = False
+                    continue
+                self._record(provider, "ok")
+                for offer in offers:
+                    entry = (-offer[price_field], next(arrival), offer)
+                    if len(cheapest) < k:
+                        heapq.heappush(cheapest, entry)
+                    elif entry[0] > cheapest[0][0]:
+                        heapq.heapreplace(cheapest, entry)
+            if pending:
+                yield self._ordered(cheapest), False
+        for future in pending:
+            # Providers past their timeout keep running in the pool; their offers are ignored
+            future.cancel()
+            self._record(futures[future], "timeout")
+            complete = False
+        with self._lock:
+            self.searches += 1
+            self.partial += not complete
+        yield self._ordered(cheapest), complete
+
+    def _ordered(self, cheapest):
+        return [offer for _, _, offer in sorted(cheapest, key=lambda entry: (-entry[0], entry[1]))]
+
+    def _call(self, provider, kind, origin, destination, days):
+        """Run one provider's search; return its offers, tagged with the provider, and how long it took."""
+        started = time.monotonic()
+        if kind == FLIGHTS:
+            offers = provider.search_flights(origin, destination, days)
+        else:
+            offers = provider.search_hotels(destination, days)
+        elapsed = time.monotonic() - started
+        BOOKING_PROVIDER_SECONDS.observe(elapsed, provider=provider.name)
+        return [dict(offer, provider=provider.name) for offer in offers], elapsed
+
+    def _record(self, provider, result):
+        BOOKING_PROVIDER_CALLS.inc(provider=provider.name, result=result)
+        with self._lock:
+            self._provider_counts[provider.name][result] += 1
+
+    def stats(self):
+        """Return search counts, how many were partial, per-provider outcomes and cache statistics."""
+        with self._lock:
+            return {
+                "providers": len(self.providers),
+                "searches": self.searches,
+                "partial": self.partial,
+                "provider_results": {name: dict(counts) for name, counts in self._provider_counts.items()},
+                "cache": self.cache.stats(),
+            }
+
+
+def create_mock_providers(count=BOOKING_PROVIDERS, latency=BOOKING_MOCK_LATENCY,
+                          error_rate=BOOKING_MOCK_ERROR_RATE, timeout=BOOKING_PROVIDER_TIMEOUT):
+    """Create count mock providers; latency is one spec for all or a comma-separated spec per provider."""
+    specs = [spec.strip() for spec in latency.split(",")]
+    return [
+        MockProvider(f"mock-{i + 1}", latency=specs[i % len(specs)],
+                     price_factor=MOCK_PRICE_FACTORS[i % len(MOCK_PRICE_FACTORS)],
+                     error_rate=error_rate, timeout=timeout)
+        for i in range(count)
+    ]
+
+
+# Shared search over the configured providers
+booking_search = BookingSearch(create_mock_providers())
+
 
 def search_flights(origin, destination, days):
     """
-    Simulate a flight search with simplified results.
-    Returns a minimal list of flight options to save processing time.
+    Search every booking provider for flights.
+    Returns the cheapest offers from the providers that answered in time.
     """
-    # Simplified dummy data - just two options instead of three
-    flight_options = [
-        {"airline": "FlyFast Airways", "price": 350, "origin": origin, "destination": destination},
-        {"airline": "BudgetAir", "price": 280, "origin": origin, "destination": destination}
-    ]
-    return flight_options
+    return booking_search.search_flights(origin, destination, days)
+
 
 def search_hotels(destination, days):
     """
-    Simulate a hotel search with simplified results.
-    Returns a minimal list of hotels to save processing time.
+    Search every booking provider for hotels.
+    Returns the cheapest offers from the providers that answered in time.
     """
-    # Simplified dummy data - just two options instead of three
-    hotel_options = [
-        {"name": f"{destination} Hotel", "price_per_night": 120},
-        {"name": f"{destination} Inn", "price_per_night": 75}
-    ]
-    return hotel_options
+    return booking_search.search_hotels(destination, days)
@@ -1,4 +1,16 @@
 # budget.py
+# NumPy is optional; without it only the single-trip estimate_budget is available
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from booking import search_flights, search_hotels
+
+DAILY_EXPENSE = 80  # food, transport and activities per day, reduced from 100 to be more conservative
+DEFAULT_PERCENTILES = (10, 50, 90)
+
+
 def estimate_budget(flights, hotels, days):
     """
     Estimate total trip cost based on flight, hotel, and daily expenses.
@@ -8,20 +20,127 @@ def estimate_budget(flights, hotels, days):
     """
     if not flights or not hotels or days is None:
         return 0
-    
+
     # Choose the cheapest flight option and hotel option
     cheapest_flight = min(f["price"] for f in flights)
     cheapest_hotel_nightly = min(h["price_per_night"] for h in hotels)
-    
+
     # Calculate hotel cost for the entire trip
     hotel_cost = cheapest_hotel_nightly * days
-    
+
     # Simplified daily expenses (food, transport, activities)
-    daily_expense = 80  # reduced from 100 to be more conservative
-    other_costs = daily_expense * days
-    
+    other_costs = DAILY_EXPENSE * days
+
     # Calculate total and round to nearest 10 for simplicity
     total_estimate = cheapest_flight + hotel_cost + other_costs
     rounded_estimate = round(total_estimate / 10) * 10
-    
+
     return rounded_estimate
+
+
+def price_columns(trips):
+    """
+    Turn booking search results into columnar price arrays.
+    - trips: list of (flights, hotels) pairs as returned by search_flights and search_hotels
+    Returns (flight_prices, hotel_prices) of shape (trips, most flights) and (trips, most hotels),
+    padded with NaN where a trip has fewer options.
+    """
+    flight_prices = np.full((len(trips), max((len(f) for f, _ in trips), default=0)), np.nan)
+    hotel_prices = np.full((len(trips), max((len(h) for _, h in trips), default=0)), np.nan)
+    for row, (flights, hotels) in enumerate(trips):
+        flight_prices[row, :len(flights)] = [f["price"] for f in flights]
+        hotel_prices[row, :len(hotels)] = [h["price_per_night"] for h in hotels]
+    return flight_prices, hotel_prices
+
+
+def batch_budget(flight_prices, hotel_prices, trip_days, top_k=3, percentiles=DEFAULT_PERCENTILES,
+                 daily_expense=DAILY_EXPENSE):
+    """
+    Price every flight x hotel x trip length combination for many trips at once.
+    - flight_prices: (trips, flights) array of flight prices, NaN for missing options
+    - hotel_prices: (trips, hotels) array of nightly hotel prices, NaN for missing options
+    - trip_days: trip lengths in days to price, shared by every trip
+    - top_k: number of cheapest combinations to return per trip
+    - percentiles: percentiles of the total cost to return per trip and length
+    Returns a dict of arrays:
+    - totals: (trips, flights, hotels, lengths) cost of every combination, NaN where an option is missing
+    - cheapest: (trips, lengths) lowest total per trip length
+    - percentiles: (trips, len(percentiles), lengths) spread of totals per trip length
+    - top_flight, top_hotel, top_days, top_total: (trips, top_k) the cheapest combinations over all
+      lengths, cheapest first (indices into the option columns; totals are inf if there are fewer)
+    """
+    flight_prices = np.atleast_2d(np.asarray(flight_prices, dtype=float))
+    hotel_prices = np.atleast_2d(np.asarray(hotel_prices, dtype=float))
+    trip_days = np.atleast_1d(np.asarray(trip_days, dtype=float))
+    trips, flights = flight_prices.shape
+    hotels, lengths = hotel_prices.shape[1], trip_days.size
+
+    # (trips, flights, 1, 1) + (trips, 1, hotels, lengths) + (lengths,)
+    totals = (
+        flight_prices[:, :, None, None]
+        + hotel_prices[:, None, :, None] * trip_days
+        + daily_expense * trip_days
+    )
+
+    # Missing options are NaN, which the nan* reductions skip
+    combinations = totals.reshape(trips, flights * hotels, lengths)
+    has_options = ~np.isnan(combinations).all(axis=1)
+    filled = np.where(np.isnan(combinations), np.inf, combinations)
+    cheapest = np.where(has_options, filled.min(axis=1, initial=np.inf), np.nan)
+    spread = _percentiles(combinations, percentiles)
+
+    # Partial sort of the flattened (flights, hotels, lengths) combinations of each trip
+    flat = filled.reshape(trips, -1) if trips else np.empty((0, 0))
+    k = min(top_k, flat.shape[1])
+    top = np.argpartition(flat, k - 1, axis=1)[:, :k] if k else np.empty((trips, 0), dtype=int)
+    order = np.take_along_axis(flat, top, axis=1).argsort(axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    flight_index, hotel_index, length_index = np.unravel_index(top, (flights, hotels, lengths))
+    return {
+        "totals": totals,
+        "cheapest": cheapest,
+        "percentiles": spread,
+        "top_flight": flight_index,
+        "top_hotel": hotel_index,
+        "top_days": trip_days[length_index].astype(int),
+        "top_total": np.take_along_axis(flat, top, axis=1),
+    }
+
+
+def _percentiles(values, percentiles):
+    """
+    Linearly interpolated percentiles over axis 1 of a (trips, combinations, lengths) array, skipping NaN.
+    One sort for every trip instead of np.nanpercentile's per-row Python loop.
+    Returns (trips, len(percentiles), lengths), NaN where a trip has no combinations.
+    """
+    if values.shape[1] == 0:
+        return np.full((values.shape[0], len(percentiles), values.shape[2]), np.nan)
+    ordered = np.sort(values, axis=1)  # NaN sorts last
+    counts = (~np.isnan(ordered)).sum(axis=1)  # (trips, lengths)
+    positions = (np.maximum(counts, 1) - 1)[:, None, :] * (np.asarray(percentiles, dtype=float) / 100)[None, :, None]
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, np.maximum(counts, 1)[:, None, :] - 1)
+    low_values = np.take_along_axis(ordered, lower, axis=1)
+    high_values = np.take_along_axis(ordered, upper, axis=1)
+    return low_values + (high_values - low_values) * (positions - lower)
+
+
+def price_trips(destinations, trip_days, origin=None, top_k=3, percentiles=DEFAULT_PERCENTILES):
+    """
+    Search and price every flight x hotel x trip length combination for several destinations.
+    Returns (options, result): the (flights, hotels) found per destination and the batch_budget result.
+    """
+    trip_days = list(trip_days)
+    longest = max(trip_days)
+    options = [(search_flights(origin, destination, longest), search_hotels(destination, longest))
+               for destination in destinations]
+    return options, batch_budget(*price_columns(options), trip_days, top_k=top_k, percentiles=percentiles)
+
+
+def trip_budget(destination, days, origin=None):
+    """Cheapest flight, hotel and daily costs for one trip, rounded to the nearest 10."""
+    flights, hotels = search_flights(origin, destination, days), search_hotels(destination, days)
+    if np is None:
+        return estimate_budget(flights, hotels, days)
+    cheapest = batch_budget(*price_columns([(flights, hotels)]), [days], top_k=1, percentiles=())["cheapest"][0, 0]
+    return 0 if np.isnan(cheapest) else round(float(cheapest) / 10) * 10
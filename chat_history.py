@@ -0,0 +1,144 @@
+"""
+Chat history management for AI Trip Planner
+Keeps each conversation within a prompt token budget by holding the most
+recent turns verbatim and folding older turns into a short rolling summary.
+Conversations live in a state store (so every worker sees them) and expire
+after an idle timeout.
+"""
+import os
+import re
+import time
+import logging
+import threading
+
+from state_store import MemoryStateStore
+
+logger = logging.getLogger('chat_history')
+
+# Configuration for conversation history
+HISTORY_MAX_TOKENS = int(os.environ.get("CHAT_HISTORY_MAX_TOKENS", "3000"))
+HISTORY_KEEP_TURNS = int(os.environ.get("CHAT_HISTORY_KEEP_TURNS", "2"))  # user/assistant pairs kept verbatim
+HISTORY_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_HISTORY_SUMMARY_MAX_TOKENS", "300"))
+HISTORY_IDLE_TIMEOUT = float(os.environ.get("CHAT_HISTORY_IDLE_TIMEOUT", str(60 * 60)))  # seconds
+HISTORY_NAMESPACE = "chat_history"
+
+# Use tiktoken for exact counts when it is installed, otherwise estimate
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators added by the chat format
+
+
+def count_tokens(text):
+    """Count (or estimate, without tiktoken) the number of tokens in text."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(messages):
+    """Count the prompt tokens used by a list of chat messages."""
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _plain_text(text):
+    """Strip HTML tags and collapse whitespace."""
+    return _SPACE_RE.sub(" ", _TAG_RE.sub(" ", text)).strip()
+
+
+def _shorten(text, max_words):
+    words = _plain_text(text).split(" ")
+    if len(words) <= max_words:
+        return " ".join(words)
+    return " ".join(words[:max_words]) + "..."
+
+
+def summarise_turn(user_content, assistant_content):
+    """Compress one user/assistant exchange into a single summary line."""
+    return f"User asked: {_shorten(user_content, 20)} Assistant replied: {_shorten(assistant_content, 40)}"
+
+
+class ChatHistoryManager:
+    """Per-user conversation histories with a token budget and idle eviction.
+
+    With a shared store, concurrent turns for the same user on different
+    workers are last-writer-wins.
+    """
+
+    def __init__(self, max_tokens=HISTORY_MAX_TOKENS, keep_turns=HISTORY_KEEP_TURNS,
+                 summary_max_tokens=HISTORY_SUMMARY_MAX_TOKENS, idle_timeout=HISTORY_IDLE_TIMEOUT, store=None):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.idle_timeout = idle_timeout
+        # user_id -> {"summary": [...], "messages": [...], "last_active": ts}, expiring when idle
+        self.store = store if store is not None else MemoryStateStore()
+        self._lock = threading.Lock()
+
+    def _new_conversation(self):
+        return {"summary": [], "messages": [], "last_active": time.time()}
+
+    def get_messages(self, user_id):
+        """Return the messages to send as context for user_id's next request."""
+        with self._lock:
+            conversation = self.store.get(HISTORY_NAMESPACE, user_id)
+            if conversation is None:
+                return []
+            messages = []
+            if conversation["summary"]:
+                summary = "\n".join(conversation["summary"])
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+            messages.extend(conversation["messages"])
+            return messages
+
+    def add_turn(self, user_id, user_content, assistant_content):
+        """Record a completed exchange and compact the conversation to its budget."""
+        with self._lock:
+            conversation = self.store.get(HISTORY_NAMESPACE, user_id) or self._new_conversation()
+            conversation["messages"].append({"role": "user", "content": user_content})
+            conversation["messages"].append({"role": "assistant", "content": assistant_content})
+            conversation["last_active"] = time.time()
+            self._compact(conversation)
+            # Each new turn restarts the idle timeout
+            self.store.set(HISTORY_NAMESPACE, user_id, conversation, ttl=self.idle_timeout)
+
+    def clear(self, user_id):
+        """Forget the conversation for user_id."""
+        with self._lock:
+            self.store.delete(HISTORY_NAMESPACE, user_id)
+
+    def token_count(self, user_id):
+        """Return the prompt tokens the stored context for user_id would use."""
+        return count_message_tokens(self.get_messages(user_id))
+
+    def __contains__(self, user_id):
+        return self.store.get(HISTORY_NAMESPACE, user_id) is not None
+
+    def __len__(self):
+        return self.store.count(HISTORY_NAMESPACE)
+
+    def _compact(self, conversation):
+        """Fold the oldest turns into the summary until the conversation fits its budget."""
+        messages = conversation["messages"]
+        summary = conversation["summary"]
+
+        # Always keep the latest turn, even if it alone is over budget
+        while len(messages) > 2 and (
+            len(messages) > self.keep_turns * 2
+            or count_message_tokens(messages) + count_tokens("\n".join(summary)) > self.max_tokens
+        ):
+            user_message, assistant_message = messages[0], messages[1]
+            del messages[:2]
+            summary.append(summarise_turn(user_message["content"], assistant_message["content"]))
+
+        # Drop the oldest summary lines once the summary itself is too long
+        while len(summary) > 1 and count_tokens("\n".join(summary)) > self.summary_max_tokens:
+            summary.pop(0)
@@ -0,0 +1,152 @@
+"""
+Circuit breaker for AI Trip Planner
+Tracks the outcome and latency of recent upstream calls. When too many fail
+or are too slow the circuit opens and callers fail fast (so they can use the
+local fallback) until a probe call succeeds.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('circuit_breaker')
+
+# Configuration for the OpenAI circuit breaker
+CIRCUIT_WINDOW = int(os.environ.get("CIRCUIT_WINDOW", "20"))  # most recent calls considered
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", "5"))  # calls needed before the circuit can open
+CIRCUIT_FAILURE_RATE = float(os.environ.get("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "20"))
+CIRCUIT_SLOW_CALL_RATE = float(os.environ.get("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))  # wait before probing again
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get("CIRCUIT_HALF_OPEN_PROBES", "1"))  # concurrent probe calls
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker driven by failure and slow-call rates."""
+
+    def __init__(self, name, window=CIRCUIT_WINDOW, min_calls=CIRCUIT_MIN_CALLS,
+                 failure_rate=CIRCUIT_FAILURE_RATE, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+                 slow_call_rate=CIRCUIT_SLOW_CALL_RATE, open_seconds=CIRCUIT_OPEN_SECONDS,
+                 half_open_probes=CIRCUIT_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._calls = deque(maxlen=window)  # (failed, slow) for recent calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        # An open circuit becomes half-open once the wait is over
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info(f"Circuit '{self.name}' half-open, probing upstream")
+        return self._state
+
+    def allow_request(self):
+        """Return True if a call may go upstream now (counting it as a probe when half-open)."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        """Raise CircuitOpenError if a call may not go upstream now."""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def check_available(self):
+        """
+        Raise CircuitOpenError if check() would refuse a call now, without taking a half-open probe.
+        Lets callers fail fast before waiting for rate limit capacity; check() still gates the call itself.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED or (state == HALF_OPEN and self._probes_in_flight < self.half_open_probes):
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def record_success(self, latency):
+        """Record a completed call and its latency in seconds."""
+        self._record(failed=False, latency=latency)
+
+    def record_failure(self, latency):
+        """Record a failed call and its latency in seconds."""
+        self._record(failed=True, latency=latency)
+
+    def _record(self, failed, latency):
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed or slow:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"Circuit '{self.name}' closed after successful probe")
+                return
+            self._calls.append((failed, slow))
+            if state == CLOSED and len(self._calls) >= self.min_calls:
+                failure_rate, slow_rate = self._rates()
+                if failure_rate >= self.failure_rate or slow_rate >= self.slow_call_rate:
+                    self._open()
+
+    def _rates(self):
+        calls = len(self._calls)
+        if not calls:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return failures / calls, slow / calls
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(f"Circuit '{self.name}' opened")
+
+    def snapshot(self):
+        """Return the breaker's state and recent rates for monitoring."""
+        with self._lock:
+            state = self._current_state()
+            failure_rate, slow_rate = self._rates()
+            return {
+                "name": self.name,
+                "state": state,
+                "recent_calls": len(self._calls),
+                "failure_rate": failure_rate,
+                "slow_call_rate": slow_rate,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "open_for": max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)) if state == OPEN else 0.0,
+            }
@@ -0,0 +1,172 @@
+"""
+Destination gazetteer for AI Trip Planner
+Resolves place names in free text ("I want to go to NYC", "Roma", "Paris,
+France") to canonical destinations using the bundled data/gazetteer.json and
+a word-level trie, so phrasing variants map to one destination ID and share
+one response cache entry.
+"""
+import os
+import re
+import json
+import logging
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+logger = logging.getLogger('gazetteer')
+
+GAZETTEER_PATH = os.environ.get(
+    "GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.json")
+)
+
+# Words that frame a destination request without changing what is asked for
+FILLER_WORDS = frozenset("""
+a an the i im id ive ill me my we our us to in into at on of for from and or with please
+want wanna would like love go going travel travelling traveling trip trips visit visiting
+plan planning planned itinerary vacation vacations holiday holidays getaway tour
+day days week weeks weekend night nights long city some can could you help make create
+show give suggest let lets take spend spending few next this
+nice great good amazing awesome perfect lovely beautiful fun
+""".split())
+
+Place = namedtuple("Place", ["id", "name", "country", "is_country"])
+Match = namedtuple("Match", ["place", "start", "end"])  # token positions, end exclusive
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+_TERMINAL = None  # trie key holding the places that end at a node
+
+
+def _fold(text):
+    """Strip accents and the punctuation inside names ("Xi'an", "U.K.") before tokenising."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[.'’]", "", text)
+
+
+def tokenize(text):
+    """Return the words of text with their original case."""
+    return _TOKEN_RE.findall(_fold(text))
+
+
+class Gazetteer:
+    """Place names and aliases indexed in a word trie for leftmost-longest matching."""
+
+    def __init__(self, entries):
+        self.places = {}
+        self._trie = {}
+        for entry in entries:
+            place = Place(entry["id"], entry["name"], entry["country"], entry.get("type") == "country")
+            self.places[place.id] = place
+            names = [place.name] + entry.get("aliases", [])
+            if not place.is_country:
+                names.append(f"{place.name} {place.country}")
+            for name in names:
+                self._add(name, place, entry.get("capitalised_only", False))
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        logger.info(f"Loaded {len(entries)} places from {path}")
+        return cls(entries)
+
+    def _add(self, name, place, capitalised_only):
+        words = [w.lower() for w in tokenize(name)]
+        if not words:
+            return
+        node = self._trie
+        for word in words:
+            node = node.setdefault(word, {})
+        # Very short aliases ("LA", "DC") only count when written in capitals
+        all_caps = len(words) == 1 and len(words[0]) <= 2
+        node.setdefault(_TERMINAL, []).append((place, capitalised_only, all_caps))
+
+    def get(self, place_id):
+        return self.places.get(place_id)
+
+    def find_all(self, text):
+        """Return the non-overlapping place matches in text, leftmost-longest first."""
+        tokens = tokenize(text)
+        lowered = [t.lower() for t in tokens]
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self._trie
+            best = None
+            for j in range(i, len(tokens)):
+                node = node.get(lowered[j])
+                if node is None:
+                    break
+                for place, capitalised_only, all_caps in node.get(_TERMINAL, ()):
+                    if capitalised_only and not all(t[0].isupper() for t in tokens[i:j + 1]):
+                        continue
+                    if all_caps and not tokens[i].isupper():
+                        continue
+                    best = Match(place, i, j + 1)
+                    break
+            if best:
+                matches.append(best)
+                i = best.end
+            else:
+                i += 1
+        return matches
+
+    def resolve(self, text):
+        """Return (place, extra) for a message, or (None, words) if no place is named.
+
+        A city or region wins over a country ("Kyoto, Japan" is Kyoto). The extra
+        words are what the message asks for beyond the place, e.g. ("kids",)
+        for "Rome with kids", plus the IDs of any other places named; filler
+        such as "I want to go to" is ignored.
+        """
+        matches = self.find_all(text)
+        tokens = [t.lower() for t in tokenize(text)]
+        covered = set()
+        for match in matches:
+            covered.update(range(match.start, match.end))
+        extra = tuple(
+            t for i, t in enumerate(tokens)
+            if i not in covered and t not in FILLER_WORDS and not t.isdigit() and not re.fullmatch(r"\d+(day|days|d)", t)
+        )
+        if not matches:
+            return None, extra
+        specific = [m for m in matches if not m.place.is_country]
+        place = (specific or matches)[0].place
+        # Other places named ("Tokyo and Kyoto") are part of the request too, but the
+        # chosen place's own country ("Kyoto, Japan") is not
+        others = tuple(dict.fromkeys(
+            m.place.id for m in matches
+            if m.place != place and not (m.place.is_country and m.place.country == place.country)
+        ))
+        return place, others + extra
+
+
+@lru_cache(maxsize=1)
+def default_gazetteer():
+    return Gazetteer.load()
+
+
+@lru_cache(maxsize=4096)
+def resolve_destination(text):
+    """Resolve a message with the bundled gazetteer; see Gazetteer.resolve."""
+    return default_gazetteer().resolve(text)
+
+
+def find_destination(text):
+    """Return the canonical Place named in text, or None."""
+    return resolve_destination(text)[0]
+
+
+def canonical_destination(text):
+    """Destination to plan for: the canonical name when text only names a place, else text itself."""
+    place, extra = resolve_destination(text)
+    if place is not None and not extra:
+        return place.name
+    return text.strip()
+
+
+def destination_key(text):
+    """Cache key for a destination: its place ID plus any extra request words."""
+    place, extra = resolve_destination(text)
+    if place is None:
+        return " ".join(extra) or " ".join(t.lower() for t in tokenize(text))
+    return "+".join((place.id,) + tuple(sorted(extra)))
@@ -0,0 +1,168 @@
+"""
+Hedged requests for AI Trip Planner
+An occasional upstream call stalls for 30 s or more and dominates the p99 of
+/chat. With hedging on, a call that has not answered (or, for streams, sent
+its first token) by a high percentile of recent latency gets a second,
+identical call. Whichever succeeds first wins; the other is cancelled (async
+calls, and streams once their first token arrives) or its reply dropped
+(blocking sync calls, which cannot be interrupted). Hedges are paid for from a budget that grows with ordinary calls, so they can
+never add more than a fixed fraction of extra upstream requests.
+"""
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import HEDGED_REQUESTS
+
+logger = logging.getLogger('hedging')
+
+# Configuration for hedged requests (off unless HEDGE_REQUESTS is set)
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))  # of recent latency, before hedging
+HEDGE_BUDGET = float(os.environ.get("HEDGE_BUDGET", "0.05"))  # hedges allowed per ordinary call
+HEDGE_MAX_BURST = float(os.environ.get("HEDGE_MAX_BURST", "5"))  # hedges that can be saved up
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.5"))  # seconds
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "10"))  # seconds, until there are enough samples
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200  # latency samples kept per call kind
+HEDGE_MAX_WORKERS = int(os.environ.get("HEDGE_MAX_WORKERS", "64"))
+
+
+class Hedger:
+    """Runs a call with a delayed backup copy, within a budget of extra calls."""
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET, max_burst=HEDGE_MAX_BURST,
+                 min_delay=HEDGE_MIN_DELAY, default_delay=HEDGE_DEFAULT_DELAY, max_workers=HEDGE_MAX_WORKERS):
+        self.percentile = percentile
+        self.budget = budget
+        self.max_burst = max_burst
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self._credits = 1.0  # allow one hedge before any budget has built up
+        self._latencies = {}  # call kind -> recent successful latencies
+        self._lock = threading.Lock()
+        # Sync calls run here so the caller can wait on whichever copy finishes first
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, kind, latency):
+        """Record the latency of a successful call (time to first token for streams)."""
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=HEDGE_WINDOW)).append(latency)
+
+    def delay(self, kind):
+        """Seconds to wait for a call of this kind before hedging it."""
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, samples[min(len(samples) - 1, int(self.percentile * len(samples)))])
+
+    def _start(self):
+        """Count an ordinary call, which adds to the hedge budget."""
+        with self._lock:
+            self.calls += 1
+            self._credits = min(self.max_burst, self._credits + self.budget)
+
+    def _take_hedge(self, admit):
+        """Spend one hedge from the budget if there is one and admit() agrees."""
+        with self._lock:
+            if self._credits < 1:
+                HEDGED_REQUESTS.inc(result="over_budget")
+                return False
+            self._credits -= 1
+        if admit is not None and not admit():
+            # No spare rate limit capacity; give the credit back
+            with self._lock:
+                self._credits += 1
+            HEDGED_REQUESTS.inc(result="rate_limited")
+            return False
+        with self._lock:
+            self.hedged += 1
+        return True
+
+    def _won(self, hedge_won):
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+        HEDGED_REQUESTS.inc(result="hedge_won" if hedge_won else "primary_won")
+
+    def run(self, call, kind, discard=None, admit=None):
+        """Return call()'s result, starting a second call() if the first is slower than delay(kind).
+
+        Once one copy succeeds, discard(result) is applied to the other copy's result if it
+        also succeeds (a blocking sync request cannot be interrupted before it returns).
+        Raises the last error if both copies fail.
+        """
+        self._start()
+        primary = self.executor.submit(call)
+        done, _ = wait([primary], timeout=self.delay(kind))
+        if done or not self._take_hedge(admit):
+            return primary.result()
+        logger.info(f"Hedging slow {kind} call")
+        hedge = self.executor.submit(call)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._won(future is hedge)
+                    for loser in pending:
+                        if discard is not None:
+                            loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def run_async(self, call, kind, admit=None):
+        """run() for coroutines: call() returns an awaitable, and the losing task is cancelled."""
+        self._start()
+        primary = asyncio.ensure_future(call())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay(kind))
+            if done or not self._take_hedge(admit):
+                return await primary
+            logger.info(f"Hedging slow {kind} call")
+            hedge = asyncio.ensure_future(call())
+            tasks.add(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._won(task is hedge)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser, or both copies if the caller itself was cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self):
+        """Return hedge counts, the remaining budget and the current hedge delay per call kind."""
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "budget_available": round(self._credits, 2),
+            }
+            kinds = list(self._latencies)
+        stats["delays"] = {kind: round(self.delay(kind), 3) for kind in kinds}
+        return stats
+
+
+def create_hedger():
+    """Create the hedger, or None unless HEDGE_REQUESTS is on."""
+    return Hedger() if HEDGE_REQUESTS else None
@@ -1,57 +1,312 @@
-# itinerary_generator.py - Mock version for testing
-import random
+# itinerary_generator.py - Local itinerary engine, used whenever OpenAI is unavailable
+#
+# During an outage every request is answered from here, so the work per request
+# is kept small: row fragments are built once at import, activities are indexed
+# by preference, the choice of activities is seeded by the request so the same
+# trip always gets the same plan, and finished itineraries are cached.
+import os
+import html
+import zlib
+from functools import lru_cache
+
+# Configuration for the local itinerary engine
+LOCAL_ITINERARY_CACHE_SIZE = int(os.environ.get("LOCAL_ITINERARY_CACHE_SIZE", "4096"))  # rendered itineraries kept
+
+SLOTS = ("Morning", "Afternoon", "Evening")
+
+# Activities for any trip, by time slot ("{destination}" is filled in when rendering)
+GENERAL_ACTIVITIES = {
+    "Morning": [
+        "Visit the main attractions and landmarks",
+        "Take a guided walking tour of the historic center",
+        "Climb to a viewpoint for a panorama of {destination}",
+        "Explore a neighborhood off the usual tourist routes",
+        "Visit the city's best-known museum before the crowds arrive",
+        "Browse the morning market for local produce",
+    ],
+    "Afternoon": [
+        "Enjoy lunch at a popular local eatery",
+        "Visit markets or shopping districts",
+        "Relax in a park or scenic area",
+        "Take part in a local cultural activity or workshop",
+        "Take a boat, tram or bus tour around {destination}",
+        "Explore cultural sites or museums",
+    ],
+    "Evening": [
+        "Have dinner at a local restaurant to sample the cuisine",
+        "Try local specialties at a night market or food hall",
+        "Watch the sunset from a rooftop or waterfront",
+        "Take an evening stroll through the old town",
+        "See a local performance or concert",
+        "Dine in a lively neighborhood popular with locals",
+    ],
+}
+
+# Activities for each preference, by time slot
+PREFERENCE_ACTIVITIES = {
+    "food": {
+        "Morning": ["Take a food tour of {destination}'s markets", "Join a cooking class with a local chef"],
+        "Afternoon": ["Sample street food in a busy food district", "Visit a bakery or café known for local pastries"],
+        "Evening": ["Book a tasting menu featuring regional dishes", "Dine at a long-established traditional restaurant"],
+    },
+    "culture": {
+        "Morning": ["Visit a major museum or gallery", "Tour a historic palace, temple or cathedral"],
+        "Afternoon": ["Join a traditional craft workshop", "Explore a cultural quarter and its small museums"],
+        "Evening": ["Attend a traditional music or dance performance", "See a show at a local theater"],
+    },
+    "history": {
+        "Morning": ["Explore the old town with a history guide", "Visit an archaeological site or ancient ruins"],
+        "Afternoon": ["Tour a fortress, castle or historic house", "Visit the city's history museum"],
+        "Evening": ["Join a twilight walking tour of historic streets", "Dine in a historic building or former monastery"],
+    },
+    "adventure": {
+        "Morning": ["Go on a guided hike near {destination}", "Try kayaking, rafting or paddleboarding"],
+        "Afternoon": ["Rent bikes and ride out of the city", "Try climbing, zip-lining or another outdoor sport"],
+        "Evening": ["Join a night hike or evening wildlife tour", "Refuel at a hearty local grill after the day's activities"],
+    },
+    "nature": {
+        "Morning": ["Take a day trip to natural attractions near {destination}", "Walk through botanical gardens"],
+        "Afternoon": ["Enjoy outdoor activities suitable for the location", "Picnic in a large park or nature reserve"],
+        "Evening": ["Watch the sunset from a scenic lookout", "Return to the city for dinner in the evening"],
+    },
+    "shopping": {
+        "Morning": ["Browse a local flea or antiques market", "Visit artisan shops for handmade souvenirs"],
+        "Afternoon": ["Explore the main shopping streets and boutiques", "Shop for local specialties to take home"],
+        "Evening": ["Visit a night market", "Browse late-opening design and concept stores"],
+    },
+    "nightlife": {
+        "Morning": ["Start slowly with brunch at a popular café", "Take a relaxed walk along the waterfront"],
+        "Afternoon": ["Visit a brewery, winery or distillery", "Relax at a rooftop terrace"],
+        "Evening": ["Go bar-hopping in the liveliest district", "Catch live music at a well-known venue"],
+    },
+    "relaxation": {
+        "Morning": ["Enjoy a slow breakfast and a quiet morning", "Spend the morning at a beach or lakeside"],
+        "Afternoon": ["Visit a spa, hot spring or bathhouse", "Read and unwind in a peaceful garden"],
+        "Evening": ["Have a leisurely dinner with a view", "Take a gentle sunset cruise"],
+    },
+    "art": {
+        "Morning": ["Visit the leading art museum", "Tour galleries in the arts district"],
+        "Afternoon": ["Go on a street-art walking tour", "Visit artists' studios or a design museum"],
+        "Evening": ["Attend an exhibition opening or late museum night", "See a contemporary performance"],
+    },
+    "family": {
+        "Morning": ["Visit the zoo, aquarium or a science museum", "Spend the morning at a family-friendly park"],
+        "Afternoon": ["Try a hands-on workshop for kids", "Visit a theme park or playground with a view"],
+        "Evening": ["Have an early dinner at a family-friendly restaurant", "Take an easy evening boat ride"],
+    },
+    "romance": {
+        "Morning": ["Have breakfast at a charming café", "Stroll through a picturesque old quarter"],
+        "Afternoon": ["Take a scenic cruise or gondola ride", "Visit a vineyard or romantic garden"],
+        "Evening": ["Book a candlelit dinner with a view", "Take a moonlit walk along the water"],
+    },
+}
+
+# Other words users choose for the same preferences
+PREFERENCE_ALIASES = {
+    "foodie": "food", "cuisine": "food", "culinary": "food", "gastronomy": "food", "dining": "food",
+    "cultural": "culture", "museums": "culture", "museum": "culture", "traditions": "culture",
+    "historical": "history", "historic": "history", "heritage": "history",
+    "adventurous": "adventure", "hiking": "adventure", "sports": "adventure", "outdoor": "adventure",
+    "outdoors": "nature", "wildlife": "nature", "parks": "nature", "scenery": "nature",
+    "markets": "shopping", "souvenirs": "shopping",
+    "bars": "nightlife", "party": "nightlife", "clubs": "nightlife", "music": "nightlife",
+    "relax": "relaxation", "relaxing": "relaxation", "beach": "relaxation", "beaches": "relaxation", "wellness": "relaxation",
+    "arts": "art", "galleries": "art", "design": "art",
+    "kids": "family", "children": "family", "family-friendly": "family",
+    "romantic": "romance", "honeymoon": "romance", "couple": "romance", "couples": "romance",
+}
+
+ARRIVAL_DAY = (
+    "Arrive and check into your accommodation",
+    "Take a walking tour of the central area to get familiar with the surroundings",
+    "Have dinner at a local restaurant to sample the cuisine",
+)
+DEPARTURE_DAY = (
+    "Last-minute souvenir shopping",
+    "Visit any missed attractions",
+    "Departure from {destination}",
+)
+SINGLE_DAY = (
+    "Arrive and see the main landmarks",
+    "Enjoy lunch at a popular local eatery and explore the center",
+    "Departure from {destination}",
+)
+
+# Daily cost ranges in USD: (category, low, high)
+DAILY_BUDGET = (
+    ("🏨 Accommodation", 75, 150),
+    ("🍽️ Food", 30, 60),
+    ("🚌 Transportation", 20, 40),
+    ("🎭 Activities", 25, 50),
+)
+
+# HTML fragments, built once
+_SHADED = ' style="background-color: #f9f9f9;"'
+_TH = '<th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">{}</th>'
+_TD = '<td style="padding: 10px; border-bottom: 1px solid #eee;">'
+_TABLE_OPEN = '<table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">\n'
+_HEADER_ROW = (
+    '    <tr style="background-color: #f2f7ff; font-weight: bold;">\n'
+    + "".join(f"        {_TH.format(name)}\n" for name in ("Day", "Time", "Activity"))
+    + "    </tr>\n"
+)
+
+
+def _day_template(row_style):
+    rows = [
+        f'    <tr{row_style}>\n'
+        '        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day {day}</td>\n'
+        f'        {_TD}Morning</td>\n'
+        f'        {_TD}{{0}}</td>\n'
+        '    </tr>\n'
+    ]
+    for index, slot in enumerate(SLOTS[1:], start=1):
+        rows.append(
+            f'    <tr{row_style}>\n'
+            f'        {_TD}{slot}</td>\n'
+            f'        {_TD}{{{index}}}</td>\n'
+            '    </tr>\n'
+        )
+    return "".join(rows)
+
+
+# Alternating day backgrounds: odd days plain, even days shaded
+_DAY_TEMPLATES = (_day_template(_SHADED), _day_template(""))
+
+_BUDGET_TEMPLATE = (
+    '<h3>Budget Estimate</h3>\n\n'
+    + _TABLE_OPEN
+    + '    <tr style="background-color: #f2f7ff; font-weight: bold;">\n'
+    '        <th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">Category</th>\n'
+    '        <th style="padding: 10px; text-align: right; border-bottom: 1px solid #ddd;">Estimated Cost</th>\n'
+    '    </tr>\n'
+    + "".join(
+        f'    <tr{_SHADED if index % 2 else ""}>\n'
+        f'        {_TD}{category}</td>\n'
+        f'        <td style="padding: 10px; border-bottom: 1px solid #eee; text-align: right;">${{{2 * index}}} - ${{{2 * index + 1}}}</td>\n'
+        '    </tr>\n'
+        for index, (category, _, _) in enumerate(DAILY_BUDGET)
+    )
+    + '    <tr style="font-weight: bold; background-color: #e6f0ff;">\n'
+    '        <td style="padding: 10px;">💰 Total estimate</td>\n'
+    f'        <td style="padding: 10px; text-align: right;">${{{2 * len(DAILY_BUDGET)}}} - ${{{2 * len(DAILY_BUDGET) + 1}}}</td>\n'
+    '    </tr>\n'
+    '</table>\n'
+)
+
+
+def _normalize_preferences(preferences):
+    """Return preferences as a sorted, de-duplicated tuple, so equivalent requests share a cache entry."""
+    return tuple(sorted({preference.strip() for preference in preferences or () if preference.strip()}))
+
+
+def _preference_keys(preferences):
+    """Map free-text preferences to PREFERENCE_ACTIVITIES keys."""
+    keys = []
+    for preference in preferences:
+        for word in preference.lower().replace(",", " ").split():
+            key = word if word in PREFERENCE_ACTIVITIES else PREFERENCE_ALIASES.get(word)
+            if key and key not in keys:
+                keys.append(key)
+    return tuple(keys)
+
+
+@lru_cache(maxsize=256)
+def _activity_pools(keys):
+    """Per slot, the activities matching the preference keys and then the general ones."""
+    return {
+        slot: (
+            [activity for key in keys for activity in PREFERENCE_ACTIVITIES[key][slot]],
+            GENERAL_ACTIVITIES[slot]
+        )
+        for slot in SLOTS
+    }
+
+
+def plan_days(destination, days, preferences):
+    """Return the (morning, afternoon, evening) activity templates for each day of the trip.
+
+    The selection is seeded by the request, so the same trip always gets the
+    same plan. Activities matching the preferences come first, and a slot's
+    activities only repeat once all of them have been used. Templates still
+    contain "{destination}".
+    """
+    if days <= 1:
+        return [SINGLE_DAY]
+    pools = _activity_pools(_preference_keys(preferences))
+    seed = zlib.crc32(f"{destination.lower()}|{days}|{'|'.join(preferences)}".encode())
+    orders = []
+    for index, slot in enumerate(SLOTS):
+        preferred, general = pools[slot]
+        # Each slot starts its lists at different seeded points
+        offset = seed >> (index * 10)
+        orders.append(_rotate(preferred, offset) + _rotate(general, offset >> 5))
+    plan = [ARRIVAL_DAY]
+    plan.extend(tuple(order[day % len(order)] for order in orders) for day in range(days - 2))
+    plan.append(DEPARTURE_DAY)
+    return plan
+
+
+def _rotate(items, offset):
+    if not items:
+        return items
+    offset %= len(items)
+    return items[offset:] + items[:offset]
+
+
+@lru_cache(maxsize=1024)
+def _escaped(template):
+    """HTML-escaped activity template; the catalog is fixed, so each is escaped once."""
+    return html.escape(template)
+
+
+def _budget_values(days):
+    low = [low * days for _, low, _ in DAILY_BUDGET]
+    high = [high * days for _, _, high in DAILY_BUDGET]
+    return [value for pair in zip(low, high) for value in pair] + [sum(low), sum(high)]
+
+
+@lru_cache(maxsize=LOCAL_ITINERARY_CACHE_SIZE)
+def _render_html(destination, days, preferences):
+    escaped = html.escape(destination)
+    pref_intro = f" focusing on {html.escape(', '.join(preferences))}" if preferences else ""
+    rows = "".join(
+        _DAY_TEMPLATES[day % 2].format(*(_escaped(activity).format(destination=escaped) for activity in activities), day=day)
+        for day, activities in enumerate(plan_days(destination, days, preferences), start=1)
+    )
+    return (
+        f"<h3>{days}-Day Trip to {escaped}</h3>\n\n"
+        f"<p>I've created a {days}-day itinerary for your trip to {escaped}{pref_intro}.</p>\n\n"
+        + _TABLE_OPEN + _HEADER_ROW + rows + "</table>\n\n"
+        + _BUDGET_TEMPLATE.format(*_budget_values(days))
+        + f"\n<p>I hope this helps with your trip planning! Feel free to ask for more specific recommendations "
+        f"about accommodations, restaurants, or activities in {escaped}.</p>\n"
+    )
+
+
+def render_itinerary_html(destination, days, preferences):
+    """Return the styled HTML itinerary, with a budget table, for any trip length (cached)."""
+    return _render_html(destination, max(1, days), _normalize_preferences(preferences))
+
+
+@lru_cache(maxsize=LOCAL_ITINERARY_CACHE_SIZE)
+def _render_text(destination, days, preferences):
+    pref_text = ", ".join(preferences) if preferences else "general sightseeing"
+    parts = [f"\n{days}-Day Trip to {destination}\n\nYour personalized itinerary focusing on {pref_text}.\n"]
+    for day, activities in enumerate(plan_days(destination, days, preferences), start=1):
+        parts.append(f"\nDay {day}\n" + "".join(
+            f"- {slot}: {activity.format(destination=destination)}\n" for slot, activity in zip(SLOTS, activities)
+        ))
+    parts.append(f"\nEnjoy your trip to {destination}!\n")
+    return "".join(parts)
+
 
 def generate_itinerary(destination, days, preferences):
     """
-    Mock function to generate a travel itinerary.
+    Generate a travel itinerary without the AI.
     :param destination: str, trip destination
     :param days: int, number of days for the trip
     :param preferences: list of str, e.g. ["Adventure", "Food"]
     :return: str itinerary text
     """
-    # Create a simple mock itinerary
-    pref_text = ", ".join(preferences) if preferences else "general sightseeing"
-    
-    itinerary = f"""
-{days}-Day Trip to {destination}
-
-Your personalized itinerary focusing on {pref_text}.
-
-Day 1
-- Arrive at {destination}
-- Check into your hotel
-- Explore the local area
-- Dinner at a popular restaurant
-
-"""
-    
-    # Add middle days
-    for day in range(2, days):
-        activities = [
-            f"Visit {destination}'s famous landmarks",
-            "Try local cuisine at a recommended restaurant",
-            "Shopping at local markets",
-            "Museum or cultural site visit",
-            "Relax at a park or scenic area"
-        ]
-        # Shuffle and pick 2-3 activities
-        random.shuffle(activities)
-        day_activities = activities[:random.randint(2, 3)]
-        
-        itinerary += f"""
-Day {day}
-"""
-        for activity in day_activities:
-            itinerary += f"- {activity}\n"
-    
-    # Add last day
-    itinerary += f"""
-Day {days}
-- Final sightseeing
-- Souvenir shopping
-- Departure
-
-Enjoy your trip to {destination}!
-"""
-    
-    return itinerary
+    return _render_text(destination, max(1, days), _normalize_preferences(preferences))
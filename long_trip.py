@@ -0,0 +1,134 @@
+"""
+Long-trip generation for AI Trip Planner
+With MAX_TOKENS = 1024 a single call truncates or crushes 10-14 day
+itineraries, and raising the limit makes that one call slow. Long trips are
+planned in two steps instead: a short outline call gives every day a theme,
+then day ranges are written concurrently as structured itineraries and merged
+in order, with their budgets summed by category. Wall-clock latency is about
+one outline call plus one short-trip call, whatever the trip length.
+"""
+import os
+import json
+
+from structured_itinerary import SYSTEM_PROMPT, validate
+
+# Configuration for chunked generation
+LONG_TRIP_MIN_DAYS = int(os.environ.get("LONG_TRIP_MIN_DAYS", "7"))  # shorter trips use a single call
+LONG_TRIP_CHUNK_DAYS = int(os.environ.get("LONG_TRIP_CHUNK_DAYS", "3"))  # days written per call
+LONG_TRIP_MAX_WORKERS = int(os.environ.get("LONG_TRIP_MAX_WORKERS", "8"))  # concurrent chunk calls per process
+OUTLINE_MAX_TOKENS = 400
+MAX_TIPS = 5
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["title", "days", "tips"],
+    "properties": {
+        "title": {"type": "string"},
+        "days": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["day", "theme"],
+                "properties": {
+                    "day": {"type": "integer"},
+                    "theme": {"type": "string"}
+                }
+            }
+        },
+        "tips": {"type": "array", "items": {"type": "string"}}
+    }
+}
+
+OUTLINE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "trip_outline", "strict": True, "schema": OUTLINE_SCHEMA}
+}
+
+OUTLINE_SYSTEM_PROMPT = """You are an expert travel planner with deep knowledge of destinations worldwide.
+Outline a multi-day trip as JSON matching the provided schema, with one entry in "days" per trip day.
+- Each theme is a few words naming the area or focus of that day (e.g. "Old Town and riverside").
+- Spread the highlights over the whole trip without repeating them, group nearby sights on one day
+  and include day trips where they fit.
+- Add at most 3 short tips."""
+
+EMPTY_OUTLINE = {"title": "", "days": [], "tips": []}
+
+
+def is_long_trip(days):
+    """Whether a trip is long enough to be generated in chunks."""
+    return days >= LONG_TRIP_MIN_DAYS
+
+
+def split_days(days, chunk_days=LONG_TRIP_CHUNK_DAYS):
+    """Return the (first, last) day ranges, inclusive, that a trip is generated in."""
+    return [(first, min(first + chunk_days - 1, days)) for first in range(1, days + 1, chunk_days)]
+
+
+def _trip_request(destination, days, preferences):
+    request = f"I want a {days}-day trip to {destination}."
+    if preferences:
+        request += f" I'm interested in {', '.join(preferences)}."
+    return request
+
+
+def outline_messages(destination, days, preferences):
+    """Messages for the outline call."""
+    return [
+        {"role": "system", "content": OUTLINE_SYSTEM_PROMPT},
+        {"role": "user", "content": _trip_request(destination, days, preferences)}
+    ]
+
+
+def parse_outline(text):
+    """Parse and validate the outline reply; raise ValueError if it is malformed."""
+    data = json.loads(text)
+    validate(data, OUTLINE_SCHEMA)
+    return data
+
+
+def chunk_messages(destination, days, preferences, outline, first, last):
+    """Messages asking for days first..last of the trip, following the outline."""
+    request = _trip_request(destination, days, preferences)
+    if outline["days"]:
+        themes = "\n".join(f"Day {day['day']}: {day['theme']}" for day in outline["days"])
+        request += f"\nThe trip follows this outline:\n{themes}"
+    request += (
+        f"\nWrite only days {first} to {last} of the trip, numbered {first} to {last}."
+        f" Budget items cover these {last - first + 1} days only (accommodation, food, local transport,"
+        f" activities), not travel to or from {destination}. Leave \"question\" empty and give at most one tip."
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": request}
+    ]
+
+
+def merge_chunks(destination, days, outline, ranges, chunks):
+    """Merge the itineraries written for each day range into one itinerary for the whole trip."""
+    merged_days = []
+    budget = {}  # lower-cased category -> [category, amount]
+    tips = list(outline["tips"])
+    for (first, last), chunk in zip(ranges, chunks):
+        # Renumber in case the model counted from 1, and drop any days beyond the range
+        ordered = sorted(chunk["days"], key=lambda day: day["day"])[:last - first + 1]
+        for offset, day in enumerate(ordered):
+            merged_days.append({"day": first + offset, "slots": day["slots"]})
+        for item in chunk["budget"]["items"]:
+            entry = budget.setdefault(item["category"].strip().lower(), [item["category"].strip(), 0.0])
+            entry[1] += item["amount"]
+        tips.extend(chunk["tips"])
+
+    items = [{"category": category, "amount": round(amount, 2)} for category, amount in budget.values()]
+    return {
+        "title": outline["title"] or f"{days}-Day Trip to {destination}",
+        "question": "",
+        "days": merged_days,
+        "budget": {
+            "currency": chunks[0]["budget"]["currency"] if chunks else "USD",
+            "items": items,
+            "total": round(sum(item["amount"] for item in items), 2)
+        },
+        "tips": list(dict.fromkeys(tips))[:MAX_TIPS]
+    }
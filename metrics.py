@@ -0,0 +1,271 @@
+"""
+Metrics for AI Trip Planner
+A small in-process registry of counters and histograms, exposed in the
+Prometheus text format by the /metrics endpoint. Recording a value is a
+dictionary lookup and a few additions under a lock, so it is cheap enough for
+the request path.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Latency buckets in seconds, from cache lookups (sub-millisecond) to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Unlabelled counters are reported as 0 before their first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge:
+    """Value that goes up and down (e.g. a queue depth), optionally split by labels."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(labels[name] for name in self.labelnames)] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies in seconds), optionally split by labels."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels[name] for name in self.labelnames))
+        return sum(series[:-1]) if series else 0
+
+    def collect(self):
+        with self._lock:
+            snapshot = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "aitrip_stage_duration_seconds",
+    "Time spent in each stage of request handling",
+    ["stage"]
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "aitrip_http_request_duration_seconds",
+    "End-to-end request latency by endpoint",
+    ["endpoint", "status"]
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "aitrip_response_cache_requests_total",
+    "Response cache lookups by result (hit, fuzzy_hit or miss)",
+    ["result"]
+))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "aitrip_llm_requests_total",
+    "OpenAI API calls by mode and outcome",
+    ["mode", "outcome"]
+))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "aitrip_llm_retries_total",
+    "OpenAI API calls retried after an error"
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "aitrip_llm_tokens_total",
+    "Tokens reported in the OpenAI usage field",
+    ["type"]
+))
+FALLBACKS = REGISTRY.register(Counter(
+    "aitrip_fallbacks_total",
+    "Responses produced without the OpenAI API",
+    ["source"]
+))
+CLARIFICATIONS = REGISTRY.register(Counter(
+    "aitrip_clarifications_total",
+    "Responses that asked the user a clarification question"
+))
+LLM_MODEL_SECONDS = REGISTRY.register(Histogram(
+    "aitrip_llm_model_latency_seconds",
+    "OpenAI call duration by model, streams included",
+    ["model", "outcome"]
+))
+MODEL_FAILOVERS = REGISTRY.register(Counter(
+    "aitrip_model_failovers_total",
+    "Times a request type was routed away from its preferred model",
+    ["request_type", "model"]
+))
+HEDGED_REQUESTS = REGISTRY.register(Counter(
+    "aitrip_hedged_requests_total",
+    "Slow OpenAI calls considered for a hedge, by result (primary_won, hedge_won, over_budget or rate_limited)",
+    ["result"]
+))
+PREFETCH_EVENTS = REGISTRY.register(Counter(
+    "aitrip_prefetch_events_total",
+    "Follow-up prefetch activity (scheduled, stored, failed, skipped_load, skipped_budget, hit or miss)",
+    ["event"]
+))
+BOOKING_PROVIDER_CALLS = REGISTRY.register(Counter(
+    "aitrip_booking_provider_calls_total",
+    "Booking provider searches, by provider and result (ok, timeout or error)",
+    ["provider", "result"]
+))
+BOOKING_PROVIDER_SECONDS = REGISTRY.register(Histogram(
+    "aitrip_booking_provider_seconds",
+    "Booking provider search latency, by provider",
+    ["provider"]
+))
+RATE_LIMIT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "aitrip_rate_limit_queue_depth",
+    "OpenAI calls waiting for rate limit capacity"
+))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "aitrip_rate_limit_wait_seconds",
+    "Time OpenAI calls waited for rate limit capacity, by priority",
+    ["priority"]
+))
+RATE_LIMIT_REJECTIONS = REGISTRY.register(Counter(
+    "aitrip_rate_limit_rejections_total",
+    "OpenAI calls that fell back after waiting too long for capacity, by priority",
+    ["priority"]
+))
+
+
+def timed(stage):
+    """Decorator recording the wrapped function's duration under the given stage."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def record_usage(usage):
+    """Count prompt and completion tokens from an API response's usage field (may be None)."""
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, type="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, type="completion")
@@ -0,0 +1,135 @@
+"""
+Model routing for AI Trip Planner
+Picks the model for each OpenAI call from a table keyed by request type, so
+cheap follow-ups and trip outlines can use a fast model while new itineraries
+use the detailed one. Every model's recent latency and error rate are tracked;
+when the preferred model for a request type gets too slow or starts failing,
+calls fail over to the next model in its list until it recovers.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from metrics import LLM_MODEL_SECONDS, MODEL_FAILOVERS
+
+logger = logging.getLogger('model_router')
+
+# Request types
+REQUEST_ITINERARY = "itinerary"  # new trip plans, including the day ranges of long trips
+REQUEST_FOLLOWUP = "followup"  # questions about a plan already given
+REQUEST_OUTLINE = "outline"  # day-by-day themes planned before a long trip is written
+
+# Configuration for model routing
+DETAILED_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+FAST_MODEL = os.environ.get("OPENAI_FAST_MODEL", "gpt-4.1-nano")
+# Preferred model first, then the models to fail over to, and the p95 latency (seconds) each type tolerates
+DEFAULT_ROUTES = {
+    REQUEST_ITINERARY: {"models": [DETAILED_MODEL, FAST_MODEL], "max_p95": 30.0},
+    REQUEST_FOLLOWUP: {"models": [FAST_MODEL, DETAILED_MODEL], "max_p95": 10.0},
+    REQUEST_OUTLINE: {"models": [FAST_MODEL, DETAILED_MODEL], "max_p95": 5.0},
+}
+MODEL_ROUTES = os.environ.get("MODEL_ROUTES")  # JSON overriding entries of DEFAULT_ROUTES
+MODEL_STATS_WINDOW = float(os.environ.get("MODEL_STATS_WINDOW", "300"))  # seconds of calls kept per model
+MODEL_MIN_CALLS = int(os.environ.get("MODEL_MIN_CALLS", "10"))  # calls needed before a model can be judged
+MODEL_MAX_ERROR_RATE = float(os.environ.get("MODEL_MAX_ERROR_RATE", "0.25"))
+
+
+def load_routes(overrides=MODEL_ROUTES):
+    """Return DEFAULT_ROUTES with the entries given as JSON in overrides replaced."""
+    routes = {request_type: dict(route) for request_type, route in DEFAULT_ROUTES.items()}
+    if overrides:
+        try:
+            for request_type, route in json.loads(overrides).items():
+                # A bare list of models keeps the default latency threshold
+                if isinstance(route, list):
+                    route = {"models": route}
+                routes[request_type] = {**routes.get(request_type, {"max_p95": 30.0}), **route}
+        except (ValueError, AttributeError, TypeError) as e:
+            logger.error(f"Ignoring invalid MODEL_ROUTES: {e}")
+    for route in routes.values():
+        # Drop repeats, e.g. when the fast and detailed models are the same
+        route["models"] = list(dict.fromkeys(route["models"]))
+    return routes
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class ModelRouter:
+    """Chooses a model per request type and fails over on rolling p95 latency or error rate."""
+
+    def __init__(self, routes=None, window=MODEL_STATS_WINDOW, min_calls=MODEL_MIN_CALLS,
+                 max_error_rate=MODEL_MAX_ERROR_RATE):
+        self.routes = routes if routes is not None else load_routes()
+        self.window = window
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self._calls = {}  # model -> deque of (time, latency, failed)
+        self._chosen = {}  # request type -> model last chosen, to log changes
+        self._lock = threading.Lock()
+
+    def choose(self, request_type):
+        """Return the model to use for a request of request_type."""
+        route = self.routes.get(request_type) or self.routes[REQUEST_ITINERARY]
+        with self._lock:
+            now = time.monotonic()
+            health = [(model, self._health(model, now)) for model in route["models"]]
+            model = next((model for model, (p95, error_rate) in health
+                          if not self._is_degraded(p95, error_rate, route["max_p95"])), None)
+            if model is None:
+                # Every model is degraded: take the one failing least, then the fastest
+                model = min(health, key=lambda item: (item[1][1], item[1][0]))[0]
+            previous = self._chosen.get(request_type)
+            self._chosen[request_type] = model
+        if model != route["models"][0] and model != previous:
+            MODEL_FAILOVERS.inc(request_type=request_type, model=model)
+            logger.warning(f"Routing {request_type} requests to {model}: {route['models'][0]} is degraded")
+        elif model != previous and previous is not None:
+            logger.info(f"Routing {request_type} requests back to {model}")
+        return model
+
+    def record(self, model, latency, failed):
+        """Record the outcome of a call to model; latency is the whole call's duration, for streams too."""
+        LLM_MODEL_SECONDS.observe(latency, model=model, outcome="error" if failed else "success")
+        with self._lock:
+            self._calls.setdefault(model, deque()).append((time.monotonic(), latency, failed))
+
+    def stats(self):
+        """Return each model's recent call count, p50/p95 latency and error rate, and the current routes."""
+        with self._lock:
+            now = time.monotonic()
+            models = {}
+            for model in list(self._calls):
+                calls = self._recent(model, now)
+                latencies = sorted(latency for _, latency, failed in calls if not failed)
+                models[model] = {
+                    "calls": len(calls),
+                    "p50": _percentile(latencies, 0.5) if latencies else None,
+                    "p95": _percentile(latencies, 0.95) if latencies else None,
+                    "error_rate": sum(failed for _, _, failed in calls) / len(calls) if calls else 0.0,
+                }
+            return {"models": models, "routes": dict(self._chosen)}
+
+    def _recent(self, model, now):
+        """Calls to model within the window, dropping older ones (lock held)."""
+        calls = self._calls.get(model, deque())
+        while calls and now - calls[0][0] > self.window:
+            calls.popleft()
+        return calls
+
+    def _health(self, model, now):
+        """Return (p95 latency, error rate) for model, or (0, 0) until it has enough recent calls (lock held)."""
+        calls = self._recent(model, now)
+        if len(calls) < self.min_calls:
+            # Too little traffic to judge; a degraded model also gets retried this way once its calls age out
+            return 0.0, 0.0
+        latencies = sorted(latency for _, latency, failed in calls if not failed)
+        error_rate = sum(failed for _, _, failed in calls) / len(calls)
+        return (_percentile(latencies, 0.95) if latencies else float("inf")), error_rate
+
+    def _is_degraded(self, p95, error_rate, max_p95):
+        return p95 > max_p95 or error_rate > self.max_error_rate
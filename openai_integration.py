@@ -6,8 +6,27 @@ import os
 import json
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openai import OpenAI
 from dotenv import load_dotenv
+from response_cache import create_response_cache
+from chat_history import ChatHistoryManager, count_message_tokens
+from state_store import create_state_store
+from gazetteer import destination_key
+from similarity_cache import create_similarity_cache
+from single_flight import SingleFlight
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
+from model_router import ModelRouter, REQUEST_ITINERARY, REQUEST_FOLLOWUP, REQUEST_OUTLINE
+from hedging import create_hedger
+from prefetch import create_prefetcher
+from rate_limiter import RateLimiter, RateLimitTimeout, PRIORITY_NEW, PRIORITY_FOLLOWUP, PRIORITY_PREFETCH
+from structured_itinerary import RESPONSE_FORMAT, SYSTEM_PROMPT as STRUCTURED_SYSTEM_PROMPT, to_response
+from itinerary_generator import render_itinerary_html
+from long_trip import (
+    LONG_TRIP_MAX_WORKERS, OUTLINE_MAX_TOKENS, OUTLINE_RESPONSE_FORMAT, EMPTY_OUTLINE,
+    is_long_trip, split_days, outline_messages, parse_outline, chunk_messages, merge_chunks
+)
+from metrics import STAGE_SECONDS, CACHE_REQUESTS, LLM_REQUESTS, LLM_RETRIES, FALLBACKS, record_usage
 
 # Configure logging
 logging.basicConfig(
@@ -21,8 +40,11 @@ load_dotenv()
 
 # Configuration for OpenAI API
 API_KEY = os.environ.get("OPENAI_API_KEY")
+API_URL = os.environ.get("OPENAI_API_URL") or None  # Defaults to https://api.openai.com/v1
 MODEL_NAME = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")  # Fastest GPT-4 option
 MAX_TOKENS = 1024  # Limiting max tokens to get faster responses
+# Ask for compact JSON itineraries (rendered to HTML on the server) instead of model-written HTML
+STRUCTURED_OUTPUT = os.environ.get("OPENAI_STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
 
 # Validate API key exists
 if not API_KEY:
@@ -35,18 +57,31 @@ else:
     logger.info(f"Using model: {MODEL_NAME}")
 
 class OpenAITravelPlanner:
-    def __init__(self):
-        self.chat_histories = {}  # Store chat histories by user_id
-        self.client = OpenAI(api_key=API_KEY)
-        self.response_cache = {}  # Cache for common destinations
+    def __init__(self, chat_histories=None, response_cache=None):
+        # Histories and cache can be shared with another planner instance (e.g. the async variant)
+        if chat_histories is None:
+            chat_histories = ChatHistoryManager(store=create_state_store())
+        if response_cache is None:
+            response_cache = create_response_cache()
+        self.chat_histories = chat_histories  # Token-budgeted chat histories by user_id, in the shared state store
+        self.client = OpenAI(api_key=API_KEY, base_url=API_URL)
+        self.response_cache = response_cache  # Bounded LRU/TTL cache for common destinations
+        self.similarity_cache = create_similarity_cache()  # Finds near-duplicate queries on an exact miss (None if disabled)
+        self.single_flight = SingleFlight()  # Coalesces identical new queries that are in flight together
+        self.circuit_breaker = CircuitBreaker("openai")  # Fails fast to the local fallback during outages
+        self.rate_limiter = RateLimiter()  # Queues calls to stay within the account's RPM/TPM limits
+        self.model_router = ModelRouter()  # Picks the model per request type, failing over when one degrades
+        self.hedger = create_hedger()  # Backs up stalled calls with a second copy (None unless HEDGE_REQUESTS is on)
+        # Answers common follow-ups in the background (None unless PREFETCH_FOLLOWUPS is on)
+        self.prefetcher = create_prefetcher(self.response_cache, self._prefetch_answer, self._has_spare_capacity)
+        self.structured_output = STRUCTURED_OUTPUT
+        # Day ranges of long trips are generated concurrently on this pool
+        self.chunk_executor = ThreadPoolExecutor(max_workers=LONG_TRIP_MAX_WORKERS, thread_name_prefix="trip-chunk")
         logger.info("OpenAITravelPlanner initialized")
     
     def _get_chat_history(self, user_id):
-        """Get chat history for a specific user"""
-        if user_id not in self.chat_histories:
-            self.chat_histories[user_id] = []
-            logger.debug(f"Created new chat history for user_id: {user_id}")
-        return self.chat_histories[user_id]
+        """Get the (budgeted) chat history for a specific user"""
+        return self.chat_histories.get_messages(user_id)
     
     def _build_prompt(self, destination, days, preferences, chat_history=None):
         """Build a detailed prompt for OpenAI based on user inputs and history"""
@@ -63,6 +98,8 @@ Format your responses in a visually appealing way using HTML tables for better r
 If you need more information to create a high-quality itinerary, politely ask 1-2 specific questions first.
 Keep your overall responses concise and well-structured.
 For trips shorter than the requested duration, explain why and offer alternatives."""
+        if self.structured_output:
+            system_prompt = STRUCTURED_SYSTEM_PROMPT
         
         # Build user query
         user_query = f"I want a {days}-day trip to {destination}."
@@ -84,35 +121,271 @@ For trips shorter than the requested duration, explain why and offer alternative
         logger.debug(f"Built prompt for destination: {destination}, days: {days}, preferences: {preferences}")
         return messages
     
-    def generate_travel_plan(self, user_id, destination, days, preferences, new_message=None):
-        """Generate a travel plan using OpenAI API"""
-        logger.info(f"Generating travel plan for user_id: {user_id}, destination: {destination}, days: {days}")
+    def _get_cache_key(self, destination, days, preferences):
+        """Build the response cache key for a new destination query"""
+        # Phrasing variants of the same place ("Rome", "roma", "Rome, Italy") share one key
+        key = f"{destination_key(destination)}_{days}_{'-'.join(sorted(preferences))}"
+        return self._cache_namespace() + key
+    
+    def _cache_namespace(self):
+        """Cache key prefix; structured entries hold JSON rather than HTML, so keep them apart"""
+        return "json:" if self.structured_output else ""
+    
+    def _get_cached_response(self, cache_key):
+        """Return the cached response for cache_key (rendered, for structured entries) or None"""
+        cached = self.response_cache.get(cache_key)
+        if cached is not None and cache_key.startswith("json:"):
+            return to_response(cached)
+        return cached
+    
+    def _lookup_cache(self, cache_key, user_id, destination, days, preferences):
+        """Cache lookup for an incoming new query: exact key first, then a near-duplicate query"""
+        result = "hit"
+        with STAGE_SECONDS.time(stage="cache_lookup"):
+            cached = self._get_cached_response(cache_key)
+            if self.similarity_cache is not None:
+                group, vector = self.similarity_cache.describe(destination, days, preferences, self._cache_namespace())
+                if group is not None and cached is not None:
+                    self.similarity_cache.observe(user_id, group)
+                elif group is not None:
+                    cached = self._get_similar_response(user_id, group, vector)
+                    result = "fuzzy_hit"
+        CACHE_REQUESTS.inc(result="miss" if cached is None else result)
+        return cached
+    
+    def _get_similar_response(self, user_id, group, vector):
+        """Return the cached response for the nearest similar past query, or None"""
+        similar_key, similarity = self.similarity_cache.lookup(group, vector, user_id)
+        if similar_key is None:
+            return None
+        cached = self._get_cached_response(similar_key)
+        if cached is None:
+            # The response has left the exact cache, so the index entry is stale
+            self.similarity_cache.remove(similar_key)
+            return None
+        self.similarity_cache.record_hit(user_id, group, similarity)
+        logger.info(f"Using cached response for similar query {similar_key} (similarity {similarity:.2f})")
+        return cached
+    
+    def _lookup_prefetched(self, user_id, cache_key, destination, preferences, new_message):
+        """Return a prefetched answer to a generic follow-up (recorded in the chat history), or None"""
+        if self.prefetcher is None:
+            return None
+        answer = self.prefetcher.lookup(destination, preferences, new_message)
+        if answer is not None:
+            logger.info(f"Using prefetched answer for follow-up about {destination}")
+            self._record_response(user_id, cache_key, destination, answer, new_message)
+        return answer
+    
+    def _schedule_prefetch(self, destination, preferences):
+        """Start prefetching likely follow-ups once a new plan for destination has been given"""
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(destination, preferences)
+    
+    def _prefetch_answer(self, destination, preferences, question):
+        """Answer a follow-up question ahead of time, at the lowest priority and without retries"""
+        request = f"I'm planning a trip to {destination}."
         if preferences:
-            logger.info(f"Preferences: {preferences}")
-        if new_message:
-            logger.info(f"Follow-up message: {new_message}")
-        
-        # Check cache for common destinations (only for new queries, not follow-ups)
-        cache_key = f"{destination.lower()}_{days}_{'-'.join(sorted(preferences))}"
-        if not new_message and cache_key in self.response_cache:
-            logger.info(f"Using cached response for {destination}")
-            return self.response_cache[cache_key]
-        
+            request += f" I'm interested in {', '.join(preferences)}."
+        messages = [
+            {"role": "system", "content": "You are an expert travel planner."},
+            {"role": "user", "content": f"{request} {question}"}
+        ]
+        self.circuit_breaker.check_available()
+        self.rate_limiter.acquire(self._estimate_tokens(messages), None, PRIORITY_PREFETCH)
+        return self._call_openai_api(messages, request_type=REQUEST_FOLLOWUP)
+    
+    def _has_spare_capacity(self):
+        """Whether upstream is healthy and idle enough for background work"""
+        return self.circuit_breaker.state == CLOSED and self.rate_limiter.has_spare_capacity()
+    
+    def _prepare_messages(self, user_id, destination, days, preferences, new_message=None):
+        """Return the messages to send for a new query or follow-up"""
         # Get existing chat history
         chat_history = self._get_chat_history(user_id)
         
         # If there's a new message and we have history, add it to continue the conversation
         if new_message and chat_history:
-            chat_history.append({"role": "user", "content": new_message})
             messages = [{"role": "system", "content": "You are an expert travel planner."}]
             messages.extend(chat_history)
-            logger.debug(f"Added follow-up message to chat history for user_id: {user_id}")
+            messages.append({"role": "user", "content": new_message})
+            logger.debug(f"Continuing conversation for user_id: {user_id} with {count_message_tokens(messages)} prompt tokens")
         else:
             # Starting a new conversation
             messages = self._build_prompt(destination, days, preferences)
             logger.debug(f"Started new conversation for user_id: {user_id}")
         
-        # Try the API call with retries
+        return messages
+    
+    def _record_response(self, user_id, cache_key, destination, response, new_message=None, days=None, preferences=None):
+        """Store a completed response in the chat history and, for new queries, the response cache"""
+        # Structured itineraries are stored as their compact JSON source
+        stored = getattr(response, "source", response)
+        
+        # Add the exchange to the chat history, which compacts itself to its token budget
+        self.chat_histories.add_turn(user_id, new_message or f"Plan a trip to {destination}", stored)
+        logger.debug(f"Updated chat history for user_id: {user_id}")
+        
+        # Cache the response for future use (only for new queries, not follow-ups)
+        if not new_message:
+            self.response_cache.set(cache_key, stored)
+            logger.debug(f"Cached response for {destination}")
+            if self.similarity_cache is not None and days is not None:
+                group, vector = self.similarity_cache.describe(destination, days, preferences or [], self._cache_namespace())
+                if group is not None:
+                    self.similarity_cache.add(cache_key, group, vector)
+    
+    def generate_travel_plan(self, user_id, destination, days, preferences, new_message=None):
+        """Generate a travel plan using OpenAI API"""
+        logger.info(f"Generating travel plan for user_id: {user_id}, destination: {destination}, days: {days}")
+        if preferences:
+            logger.info(f"Preferences: {preferences}")
+        if new_message:
+            logger.info(f"Follow-up message: {new_message}")
+        
+        # Check cache for common destinations (only for new queries, not follow-ups)
+        cache_key = self._get_cache_key(destination, days, preferences)
+        if not new_message:
+            cached = self._lookup_cache(cache_key, user_id, destination, days, preferences)
+            if cached is not None:
+                logger.info(f"Using cached response for {destination}")
+                self._schedule_prefetch(destination, preferences)
+                return cached
+        else:
+            prefetched = self._lookup_prefetched(user_id, cache_key, destination, preferences, new_message)
+            if prefetched is not None:
+                return prefetched
+        
+        try:
+            if new_message:
+                messages = self._prepare_messages(user_id, destination, days, preferences, new_message)
+                response = self._call_with_retries(
+                    user_id, messages, priority=PRIORITY_FOLLOWUP, request_type=REQUEST_FOLLOWUP
+                )
+            else:
+                # Identical new queries that arrive together share a single API call
+                response = self.single_flight.do(
+                    cache_key,
+                    lambda: self._generate_long_trip(user_id, destination, days, preferences) if is_long_trip(days)
+                    else self._call_with_retries(
+                        user_id,
+                        self._prepare_messages(user_id, destination, days, preferences),
+                        structured=self.structured_output
+                    ),
+                    check=lambda: self._get_cached_response(cache_key)
+                )
+        except Exception:
+            # All retries failed, return a fallback response
+            logger.info(f"All API attempts failed, using fallback response")
+            return self.get_fallback_response(destination, days, preferences)
+        
+        self._record_response(user_id, cache_key, destination, response, new_message, days, preferences)
+        if not new_message:
+            self._schedule_prefetch(destination, preferences)
+        return response
+    
+    def _generate_long_trip(self, user_id, destination, days, preferences):
+        """Generate a long trip as an outline plus day ranges written concurrently; raises if a range fails"""
+        ranges = split_days(days)
+        logger.info(f"Generating {days}-day trip to {destination} in {len(ranges)} concurrent chunks")
+        outline = self._generate_outline(user_id, destination, days, preferences)
+        replies = self._generate_chunks(
+            user_id, [chunk_messages(destination, days, preferences, outline, first, last) for first, last in ranges]
+        )
+        return self._merge_long_trip(destination, days, outline, ranges, replies)
+    
+    def _generate_chunks(self, user_id, chunk_message_lists):
+        """Run one structured call per chunk on the shared chunk pool; raises once a chunk runs out of retries
+
+        Waiting for rate limit capacity and retry backoff happen in the calling
+        thread, so pool workers only ever hold a call that is in flight and one
+        slow or failing trip cannot tie up slots other trips' chunks need.
+        """
+        max_retries = 2
+        retry_delay = 2  # seconds
+        replies = [None] * len(chunk_message_lists)
+        attempts = [0] * len(chunk_message_lists)
+        retry_at = {}  # chunk index -> when to resubmit it
+        futures = {}  # chunk index -> future of its current attempt
+        
+        def submit(index):
+            messages = chunk_message_lists[index]
+            # Fail fast while the circuit is open instead of spending rate limit capacity first
+            self.circuit_breaker.check_available()
+            self.rate_limiter.acquire(self._estimate_tokens(messages), user_id, PRIORITY_NEW)
+            futures[index] = self.chunk_executor.submit(self._call_openai_api, messages, True)
+        
+        try:
+            for index in range(len(chunk_message_lists)):
+                submit(index)
+            while futures or retry_at:
+                now = time.monotonic()
+                for index in [index for index, due in retry_at.items() if due <= now]:
+                    del retry_at[index]
+                    logger.info(f"Calling OpenAI API for user_id: {user_id} (chunk {index+1}, attempt {attempts[index]+1}/{max_retries+1})")
+                    submit(index)
+                timeout = max(0.0, min(retry_at.values()) - time.monotonic()) if retry_at else None
+                if not futures:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(futures.values(), timeout=timeout, return_when=FIRST_COMPLETED)
+                for index, future in list(futures.items()):
+                    if future not in done:
+                        continue
+                    del futures[index]
+                    try:
+                        replies[index] = future.result()
+                    except CircuitOpenError:
+                        logger.info(f"Circuit open, skipping OpenAI API call for user_id: {user_id}")
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error generating trip chunk {index+1} (attempt {attempts[index]+1}/{max_retries+1}): {str(e)}", exc_info=True)
+                        if not self._should_retry(attempts[index], max_retries):
+                            raise
+                        # Resubmit after exponential backoff instead of sleeping in a pool worker
+                        sleep_time = retry_delay * (2 ** attempts[index])
+                        logger.info(f"Retrying chunk {index+1} in {sleep_time} seconds...")
+                        LLM_RETRIES.inc()
+                        attempts[index] += 1
+                        retry_at[index] = time.monotonic() + sleep_time
+        finally:
+            # Chunks not started yet are pointless once the trip has failed
+            for future in futures.values():
+                future.cancel()
+        return replies
+    
+    def _generate_outline(self, user_id, destination, days, preferences):
+        """Ask for a day-by-day outline of a long trip; without one the chunks are planned independently"""
+        try:
+            reply = self._call_with_retries(
+                user_id, outline_messages(destination, days, preferences),
+                response_format=OUTLINE_RESPONSE_FORMAT, max_tokens=OUTLINE_MAX_TOKENS, request_type=REQUEST_OUTLINE
+            )
+            return parse_outline(reply)
+        except (CircuitOpenError, RateLimitTimeout):
+            raise
+        except Exception as e:
+            logger.warning(f"Trip outline failed, generating chunks without it: {str(e)}")
+            return EMPTY_OUTLINE
+    
+    def _merge_long_trip(self, destination, days, outline, ranges, replies):
+        """Merge the rendered chunk replies of a long trip into one response"""
+        with STAGE_SECONDS.time(stage="postprocess"):
+            for reply in replies:
+                if not reply.data["days"]:
+                    # A chunk that only asked a question cannot be merged
+                    raise ValueError("Trip chunk returned no days")
+            merged = merge_chunks(destination, days, outline, ranges, [reply.data for reply in replies])
+            response = to_response(json.dumps(merged, separators=(",", ":")))
+        # HTML mode caches and stores the rendered text, like any other HTML response
+        return response if self.structured_output else str(response)
+    
+    def _estimate_tokens(self, messages, max_tokens=MAX_TOKENS):
+        """Tokens a call counts against the TPM limit: the prompt plus max_tokens, as OpenAI counts them"""
+        return count_message_tokens(messages) + max_tokens
+    
+    def _call_with_retries(self, user_id, messages, structured=False, priority=PRIORITY_NEW, **kwargs):
+        """Call the OpenAI API, retrying with exponential backoff; raises once all attempts fail"""
         max_retries = 2
         retry_delay = 2  # seconds
         
@@ -120,77 +393,316 @@ For trips shorter than the requested duration, explain why and offer alternative
             try:
                 # Call OpenAI API with the prepared messages
                 logger.info(f"Calling OpenAI API for user_id: {user_id}" + (f" (attempt {attempt+1}/{max_retries+1})" if attempt > 0 else ""))
-                response = self._call_openai_api(messages)
-                
-                # Add response to chat history
-                chat_history.append({"role": "user", "content": new_message or f"Plan a trip to {destination}"})
-                chat_history.append({"role": "assistant", "content": response})
-                
-                # Update the stored chat history
-                self.chat_histories[user_id] = chat_history
-                logger.debug(f"Updated chat history for user_id: {user_id}")
-                
-                # Cache the response for future use (only for new queries, not follow-ups)
-                if not new_message:
-                    self.response_cache[cache_key] = response
-                    logger.debug(f"Cached response for {destination}")
-                
-                return response
+                # Fail fast while the circuit is open, then wait for capacity under the account's rate limits
+                # (raises RateLimitTimeout after the maximum wait)
+                self.circuit_breaker.check_available()
+                self.rate_limiter.acquire(self._estimate_tokens(messages, kwargs.get("max_tokens", MAX_TOKENS)), user_id, priority)
+                return self._call_openai_api(messages, structured, **kwargs)
                 
+            except CircuitOpenError:
+                logger.info(f"Circuit open, skipping OpenAI API call for user_id: {user_id}")
+                raise
+            except RateLimitTimeout:
+                raise
             except Exception as e:
                 logger.error(f"Error generating travel plan (attempt {attempt+1}/{max_retries+1}): {str(e)}", exc_info=True)
                 
-                if attempt < max_retries:
+                if self._should_retry(attempt, max_retries):
                     # Use exponential backoff
                     sleep_time = retry_delay * (2 ** attempt)
                     logger.info(f"Retrying in {sleep_time} seconds...")
+                    LLM_RETRIES.inc()
                     time.sleep(sleep_time)
                 else:
-                    # All retries failed, return a fallback response
-                    logger.info(f"All API attempts failed, using fallback response")
-                    return self.get_fallback_response(destination, days, preferences)
+                    raise
+    
+    def _should_retry(self, attempt, max_retries):
+        """Retry only if attempts remain and the circuit hasn't opened in the meantime"""
+        return attempt < max_retries and self.circuit_breaker.state == CLOSED
     
-    def _call_openai_api(self, messages):
-        """Call the OpenAI API using the official client library"""
+    def generate_travel_plan_stream(self, user_id, destination, days, preferences, new_message=None):
+        """Generate a travel plan using OpenAI API, yielding text chunks as they arrive.
+        
+        The generator returns the final post-processed text (the same value
+        generate_travel_plan would return), which is also recorded in the chat
+        history and the response cache once the stream completes.
+        """
+        logger.info(f"Streaming travel plan for user_id: {user_id}, destination: {destination}, days: {days}")
+        
+        # Structured itineraries are rendered only once the JSON is complete, and long trips once
+        # every chunk is in, so send them in one piece
+        if (self.structured_output or is_long_trip(days)) and not new_message:
+            response = self.generate_travel_plan(user_id, destination, days, preferences)
+            yield response
+            return response
+        
+        # Cached responses are sent in one piece
+        cache_key = self._get_cache_key(destination, days, preferences)
+        if not new_message:
+            cached = self._lookup_cache(cache_key, user_id, destination, days, preferences)
+            if cached is not None:
+                logger.info(f"Using cached response for {destination}")
+                self._schedule_prefetch(destination, preferences)
+                yield cached
+                return cached
+        else:
+            prefetched = self._lookup_prefetched(user_id, cache_key, destination, preferences, new_message)
+            if prefetched is not None:
+                yield prefetched
+                return prefetched
+        
+        # Identical new queries that arrive together subscribe to one upstream stream
+        flight = None
+        if not new_message:
+            flight, is_leader = self.single_flight.join(cache_key)
+            if not is_leader:
+                logger.info(f"Joining in-flight stream for {destination}")
+                try:
+                    response = yield from flight.subscribe()
+                except Exception:
+                    logger.info(f"In-flight stream failed, using fallback response")
+                    response = self.get_fallback_response(destination, days, preferences)
+                    yield response
+                    return response
+                self._record_response(user_id, cache_key, destination, response, new_message, days, preferences)
+                return response
+        
         try:
-            logger.info(f"Calling OpenAI API with model {MODEL_NAME}")
+            messages = self._prepare_messages(user_id, destination, days, preferences, new_message)
+            
+            # Retry only while nothing has been sent to the client yet
+            max_retries = 2
+            retry_delay = 2  # seconds
             
-            # Log request data (excluding sensitive information)
-            logger.debug(f"Sending {len(messages)} messages to OpenAI")
+            stream_error = None  # set when the stream broke off after part of the answer was sent
+            for attempt in range(max_retries + 1):
+                chunks = []
+                try:
+                    logger.info(f"Streaming from OpenAI API for user_id: {user_id}" + (f" (attempt {attempt+1}/{max_retries+1})" if attempt > 0 else ""))
+                    self.circuit_breaker.check_available()
+                    self.rate_limiter.acquire(
+                        self._estimate_tokens(messages), user_id, PRIORITY_FOLLOWUP if new_message else PRIORITY_NEW
+                    )
+                    for chunk in self._open_stream(messages, REQUEST_FOLLOWUP if new_message else REQUEST_ITINERARY):
+                        chunks.append(chunk)
+                        if flight:
+                            flight.publish(chunk)
+                        yield chunk
+                    break
+                except Exception as e:
+                    if isinstance(e, CircuitOpenError):
+                        logger.info(f"Circuit open, skipping OpenAI API call for user_id: {user_id}")
+                    elif not isinstance(e, RateLimitTimeout):
+                        logger.error(f"Error streaming travel plan (attempt {attempt+1}/{max_retries+1}): {str(e)}", exc_info=True)
+                    
+                    if chunks:
+                        # Part of the answer is already on the client, so keep what we have
+                        stream_error = e
+                        break
+                    if not isinstance(e, (CircuitOpenError, RateLimitTimeout)) and self._should_retry(attempt, max_retries):
+                        sleep_time = retry_delay * (2 ** attempt)
+                        logger.info(f"Retrying in {sleep_time} seconds...")
+                        LLM_RETRIES.inc()
+                        time.sleep(sleep_time)
+                    else:
+                        logger.info(f"All API attempts failed, using fallback response")
+                        if flight:
+                            flight.finish(error=e)
+                        response = self.get_fallback_response(destination, days, preferences)
+                        yield response
+                        return response
             
+            with STAGE_SECONDS.time(stage="postprocess"):
+                response = self._postprocess_content("".join(chunks))
+            if stream_error is not None:
+                # A truncated answer must not be cached or handed to coalesced waiters as a full one
+                if flight:
+                    flight.finish(error=stream_error)
+                return response
+            self._record_response(user_id, cache_key, destination, response, new_message, days, preferences)
+            if flight:
+                flight.finish(result=response)
+            if not new_message:
+                self._schedule_prefetch(destination, preferences)
+            return response
+        finally:
+            if flight:
+                self.single_flight.release(cache_key, flight)
+    
+    def _call_openai_api(self, messages, structured=False, response_format=None, max_tokens=MAX_TOKENS,
+                         request_type=REQUEST_ITINERARY):
+        """Call the OpenAI API using the official client library
+
+        With a custom response_format (e.g. a trip outline) the raw JSON text is returned.
+        """
+        # Fail fast while the circuit is open; the caller falls back to the local generator
+        self.circuit_breaker.check()
+        model = self.model_router.choose(request_type)
+        logger.info(f"Calling OpenAI API with model {model}")
+        
+        # Log request data (excluding sensitive information)
+        logger.debug(f"Sending {len(messages)} messages to OpenAI")
+        
+        # Structured requests ask for JSON matching the itinerary schema
+        if structured:
+            response_format = RESPONSE_FORMAT
+        
+        def create():
+            return self._create_completion(model, messages, max_tokens, response_format, request_type)
+        
+        if self.hedger is None:
+            response = create()
+        else:
+            # A stalled call gets a second copy if the hedge budget and the rate limiter allow one
+            response = self.hedger.run(
+                create, f"sync:{request_type}",
+                admit=lambda: self.rate_limiter.try_acquire(self._estimate_tokens(messages, max_tokens))
+            )
+        
+        # Extract content from the response
+        content = response.choices[0].message.content
+        with STAGE_SECONDS.time(stage="postprocess"):
+            if structured:
+                # Validate the JSON and render it; a malformed reply raises ValueError and is retried
+                content = to_response(content)
+            elif response_format is None:
+                content = self._postprocess_content(content)
+        
+        logger.info(f"OpenAI API response successful")
+        # Log a portion of the response for debugging
+        preview = content[:100] + "..." if len(content) > 100 else content
+        logger.debug(f"Response preview: {preview}")
+        
+        return content
+    
+    def _create_completion(self, model, messages, max_tokens, response_format, request_type):
+        """Make one non-streaming API call and record its outcome"""
+        start = time.monotonic()
+        try:
             # Using the official OpenAI client library
             response = self.client.chat.completions.create(
-                model=MODEL_NAME,
+                model=model,
                 messages=messages,
                 temperature=0.7,
-                max_tokens=MAX_TOKENS,
-                stream=False,  # We'll implement streaming in the Flask endpoint
+                max_tokens=max_tokens,
+                stream=False,  # Streaming callers use _stream_openai_api instead
                 presence_penalty=0.2,  # Add slight presence penalty for more concise responses
-                frequency_penalty=0.2   # Add slight frequency penalty for more concise responses
+                frequency_penalty=0.2,  # Add slight frequency penalty for more concise responses
+                **({"response_format": response_format} if response_format else {})
             )
-            
-            # Extract content from the response
-            content = response.choices[0].message.content
-            
-            # Improve formatting for better UX - replace markdown headers with more user-friendly formatting
-            content = content.replace("### ", "")
-            content = content.replace("## ", "")
-            content = content.replace("# ", "")
-            
-            # Format the budget section to be more user-friendly if it's not already in a table
-            if ("Budget Estimate" in content or "Total Estimated Budget" in content) and "<table" not in content:
-                content = self._format_budget_section(content)
-            
-            logger.info(f"OpenAI API response successful")
-            # Log a portion of the response for debugging
-            preview = content[:100] + "..." if len(content) > 100 else content
-            logger.debug(f"Response preview: {preview}")
-            
-            return content
-                
         except Exception as e:
+            self._record_call("sync", "error", time.monotonic() - start, error=e, model=model)
             logger.error(f"Error calling OpenAI API: {str(e)}", exc_info=True)
             raise
+        
+        duration = time.monotonic() - start
+        self._record_call("sync", "success", duration, model=model)
+        if self.hedger is not None:
+            self.hedger.observe(f"sync:{request_type}", duration)
+        record_usage(getattr(response, "usage", None))
+        return response
+    
+    def _open_stream(self, messages, request_type=REQUEST_ITINERARY):
+        """Start a stream of content deltas, hedged on time to first token when hedging is on"""
+        if self.hedger is None:
+            return self._stream_openai_api(messages, request_type)
+        
+        def start():
+            stream = self._stream_openai_api(messages, request_type)
+            return stream, next(stream, None)
+        
+        # The losing stream is closed as soon as its first token arrives
+        stream, first = self.hedger.run(
+            start, f"stream:{request_type}",
+            discard=lambda result: result[0].close(),
+            admit=lambda: self.rate_limiter.try_acquire(self._estimate_tokens(messages))
+        )
+        
+        def deltas():
+            try:
+                if first is not None:
+                    yield first
+                yield from stream
+            finally:
+                stream.close()
+        return deltas()
+    
+    def _stream_openai_api(self, messages, request_type=REQUEST_ITINERARY):
+        """Call the OpenAI API with streaming enabled and yield content deltas"""
+        self.circuit_breaker.check()
+        model = self.model_router.choose(request_type)
+        logger.info(f"Streaming from OpenAI API with model {model}")
+        logger.debug(f"Sending {len(messages)} messages to OpenAI")
+        
+        # For streams the breaker judges latency by time to first token
+        start = time.monotonic()
+        first_token_latency = None
+        try:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=MAX_TOKENS,
+                stream=True,
+                presence_penalty=0.2,
+                frequency_penalty=0.2,
+                # Ask for a final chunk carrying the token usage (sent with empty choices)
+                extra_body={"stream_options": {"include_usage": True}}
+            )
+            
+            for chunk in stream:
+                record_usage(getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_latency is None:
+                        first_token_latency = time.monotonic() - start
+                        if self.hedger is not None:
+                            self.hedger.observe(f"stream:{request_type}", first_token_latency)
+                    yield delta
+        except GeneratorExit:
+            # The client went away (or a hedge won); that says nothing bad about upstream.
+            # Closing the response stops upstream generating tokens nobody will read
+            stream.close()
+            self._record_call("stream", "cancelled", time.monotonic() - start, first_token_latency, model=model)
+            raise
+        except Exception as e:
+            self._record_call("stream", "error", time.monotonic() - start, error=e, model=model)
+            raise
+        
+        self._record_call("stream", "success", time.monotonic() - start, first_token_latency, model=model)
+        logger.info(f"OpenAI API stream completed")
+    
+    def _record_call(self, mode, outcome, duration, first_token_latency=None, error=None, model=None):
+        """Feed an API call's outcome to the circuit breaker, the rate limiter, the model router and the metrics"""
+        # Latency as the breaker sees it: time to first token for streams
+        latency = first_token_latency if first_token_latency is not None else duration
+        if outcome == "error":
+            self.circuit_breaker.record_failure(latency)
+            if getattr(error, "status_code", None) == 429:
+                # Upstream says we are over the limit after all, so hold back new calls for a moment
+                self.rate_limiter.throttle()
+        else:
+            self.circuit_breaker.record_success(latency)
+        if model is not None and outcome != "cancelled":
+            # The router compares models by whole-call duration, the same measure for streamed and sync calls
+            self.model_router.record(model, duration, outcome == "error")
+        STAGE_SECONDS.observe(duration, stage="llm_call")
+        LLM_REQUESTS.inc(mode=mode, outcome=outcome)
+    
+    def _postprocess_content(self, content):
+        """Clean up markdown headers and format the budget section of a model response"""
+        # Improve formatting for better UX - replace markdown headers with more user-friendly formatting
+        content = content.replace("### ", "")
+        content = content.replace("## ", "")
+        content = content.replace("# ", "")
+        
+        # Format the budget section to be more user-friendly if it's not already in a table
+        if ("Budget Estimate" in content or "Total Estimated Budget" in content) and "<table" not in content:
+            content = self._format_budget_section(content)
+        
+        return content
     
     def _format_budget_section(self, content):
         """Format the budget section to be more user-friendly"""
@@ -239,130 +751,10 @@ For trips shorter than the requested duration, explain why and offer alternative
     def get_fallback_response(self, destination, days, preferences):
         """Generate a fallback response when the API is unavailable"""
         logger.info(f"Generating fallback response for destination: {destination}")
+        FALLBACKS.inc(source="planner")
         
-        # Create a preference-tailored introduction
-        pref_intro = ""
-        if preferences:
-            pref_intro = f"focusing on {', '.join(preferences)}"
-        
-        response = f"""<h3>5-Day Trip to {destination}</h3>
-
-<p>I've created a {days}-day itinerary for your trip to {destination} {pref_intro}.</p>
-
-<table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">
-    <tr style="background-color: #f2f7ff; font-weight: bold;">
-        <th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">Day</th>
-        <th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">Time</th>
-        <th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">Activity</th>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day 1</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Morning</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Arrive and check into your accommodation</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Afternoon</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Take a walking tour of the central area to get familiar with the surroundings</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Evening</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Have dinner at a local restaurant to sample the cuisine</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day 2</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Morning</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Visit the main attractions and landmarks</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Afternoon</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Enjoy lunch at a popular local eatery</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Evening</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Explore cultural sites or museums in the afternoon</td>
-    </tr>
-"""
-        
-        # Add middle days based on trip length
-        if days > 3:
-            response += f"""    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day 3</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Morning</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Take part in a local cultural activity or workshop</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Afternoon</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Visit markets or shopping districts</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Evening</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Try local specialties for lunch and dinner</td>
-    </tr>
-"""
-        
-        if days > 4:
-            response += f"""    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day 4</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Morning</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Take a day trip to natural attractions near {destination}</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Afternoon</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Enjoy outdoor activities suitable for the location</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Evening</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Return to the city for dinner in the evening</td>
-    </tr>
-"""
-        
-        # Final day
-        response += f"""    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;" rowspan="3">Day {days}</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Morning</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Last-minute souvenir shopping</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Afternoon</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Visit any missed attractions</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Evening</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">Departure from {destination}</td>
-    </tr>
-</table>
-
-<h3>Budget Estimate</h3>
-
-<table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">
-    <tr style="background-color: #f2f7ff; font-weight: bold;">
-        <th style="padding: 10px; text-align: left; border-bottom: 1px solid #ddd;">Category</th>
-        <th style="padding: 10px; text-align: right; border-bottom: 1px solid #ddd;">Estimated Cost</th>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">🏨 Accommodation</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; text-align: right;">${75 * days} - ${150 * days}</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">🍽️ Food</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; text-align: right;">${30 * days} - ${60 * days}</td>
-    </tr>
-    <tr>
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">🚌 Transportation</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; text-align: right;">${20 * days} - ${40 * days}</td>
-    </tr>
-    <tr style="background-color: #f9f9f9;">
-        <td style="padding: 10px; border-bottom: 1px solid #eee;">🎭 Activities</td>
-        <td style="padding: 10px; border-bottom: 1px solid #eee; text-align: right;">${25 * days} - ${50 * days}</td>
-    </tr>
-    <tr style="font-weight: bold; background-color: #e6f0ff;">
-        <td style="padding: 10px;">💰 Total estimate</td>
-        <td style="padding: 10px; text-align: right;">${(150 * days)} - ${(300 * days)}</td>
-    </tr>
-</table>
-
-<p>I hope this helps with your trip planning! Feel free to ask for more specific recommendations about accommodations, restaurants, or activities in {destination}.</p>
-"""
+        # Rendered by the local engine from precompiled fragments and cached per trip
+        response = render_itinerary_html(destination, days, preferences)
         
         logger.debug("Generated detailed fallback response")
         return response
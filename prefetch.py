@@ -0,0 +1,186 @@
+"""
+Speculative follow-up prefetch for AI Trip Planner
+After a new itinerary, most users next ask where to stay, where to eat or how
+to get around. When enabled, the prefetcher answers the most common of these
+follow-up intents for the destination in the background, at the lowest rate
+limit priority, and stores the answers in the response cache keyed by
+destination and intent. A later generic question such as "where should I
+eat?" is then answered instantly. Prefetching stops when its per-minute
+budget is spent or the planner is busy with real requests.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gazetteer import resolve_destination, destination_key
+from metrics import PREFETCH_EVENTS
+
+logger = logging.getLogger('prefetch')
+
+# Configuration for follow-up prefetch (off unless PREFETCH_FOLLOWUPS is set)
+PREFETCH_FOLLOWUPS = os.environ.get("PREFETCH_FOLLOWUPS", "false").lower() in ("1", "true", "yes")
+PREFETCH_TOP_K = int(os.environ.get("PREFETCH_TOP_K", "3"))  # intents prefetched per destination
+PREFETCH_MAX_PER_MINUTE = float(os.environ.get("PREFETCH_MAX_PER_MINUTE", "20"))  # API calls spent on prefetch
+PREFETCH_MAX_WORKERS = int(os.environ.get("PREFETCH_MAX_WORKERS", "2"))
+PREFETCH_MAX_PENDING = 50  # prefetches queued at once; more are dropped
+
+# Follow-up intents, most common first: (name, keywords, question asked on the user's behalf)
+FOLLOWUP_INTENTS = [
+    ("hotels", {"stay", "staying", "hotel", "hotels", "accommodation", "accommodations", "lodging", "hostel",
+                "hostels", "airbnb", "neighborhood", "neighbourhood", "area", "areas"},
+     "Where should I stay in {destination}? Suggest the best areas and a few hotels at different price levels."),
+    ("restaurants", {"eat", "eating", "food", "restaurant", "restaurants", "dinner", "lunch", "breakfast",
+                     "dining", "cuisine", "dishes", "dish"},
+     "Where should I eat in {destination}? Suggest local dishes to try and a few restaurants at different price levels."),
+    ("transport", {"transport", "transportation", "transit", "metro", "subway", "bus", "buses", "taxi", "taxis",
+                   "train", "trains", "around", "getting"},
+     "How should I get around {destination}? Explain the main transport options, passes and typical costs."),
+    ("weather", {"weather", "pack", "packing", "wear", "climate", "rain", "temperature"},
+     "What is the weather like in {destination} and what should I pack?"),
+    ("safety", {"safe", "safety", "dangerous", "scams", "scam", "avoid"},
+     "Is {destination} safe for tourists? What scams or areas should I avoid?"),
+]
+_INTENT_BY_WORD = {word: name for name, words, _ in FOLLOWUP_INTENTS for word in words}
+_QUESTIONS = {name: question for name, _, question in FOLLOWUP_INTENTS}
+
+# Words that make up a generic question without asking for anything specific
+QUESTION_WORDS = frozenset("""
+what where how which who when should shall do does is are there any good best top recommend recommendation
+recommendations suggestion suggestions options option places place tell about get go find need know idea ideas
+think cheap affordable local nearby near by here there it its that those these tips tip advice suggest
+""".split())
+
+
+class Prefetcher:
+    """Background answers to common follow-up questions, keyed by destination and intent."""
+
+    def __init__(self, cache, generate, has_capacity, top_k=PREFETCH_TOP_K,
+                 max_per_minute=PREFETCH_MAX_PER_MINUTE, max_workers=PREFETCH_MAX_WORKERS):
+        self.cache = cache  # response cache holding the answers
+        self.generate = generate  # (destination, preferences, question) -> answer; raises on failure
+        self.has_capacity = has_capacity  # () -> False while the planner is busy with real requests
+        self.top_k = top_k
+        self.max_per_minute = max_per_minute
+        self._budget = max_per_minute
+        self._updated = time.monotonic()
+        self._pending = set()  # keys being prefetched
+        self._intent_counts = {name: 0 for name, _, _ in FOLLOWUP_INTENTS}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.hits = 0
+        self.stored = 0
+
+    def _key(self, destination, intent, preferences):
+        return f"followup:{destination_key(destination)}_{intent}_{'-'.join(sorted(preferences))}"
+
+    def classify(self, message, destination):
+        """Return the intent of a generic follow-up about destination, or None.
+
+        Only questions that ask for nothing beyond the intent ("where should I
+        eat?", "any hotel tips for Rome?") qualify, since a prefetched answer
+        cannot address anything more specific.
+        """
+        place, extra = resolve_destination(message)
+        if place is not None and place != resolve_destination(destination)[0]:
+            return None
+        intents = {_INTENT_BY_WORD[word] for word in extra if word in _INTENT_BY_WORD}
+        if len(intents) != 1:
+            return None
+        intent = intents.pop()
+        with self._lock:
+            self._intent_counts[intent] += 1
+        if any(word not in _INTENT_BY_WORD and word not in QUESTION_WORDS for word in extra):
+            return None
+        return intent
+
+    def lookup(self, destination, preferences, message):
+        """Return a prefetched answer to message, or None."""
+        if resolve_destination(destination)[0] is None:
+            return None
+        intent = self.classify(message, destination)
+        if intent is None:
+            return None
+        answer = self.cache.get(self._key(destination, intent, preferences))
+        PREFETCH_EVENTS.inc(event="hit" if answer is not None else "miss")
+        if answer is not None:
+            with self._lock:
+                self.hits += 1
+        return answer
+
+    def schedule(self, destination, preferences):
+        """Queue answers to the top follow-up intents for destination, if budget and load allow."""
+        if resolve_destination(destination)[0] is None:
+            return
+        for intent in self.top_intents():
+            key = self._key(destination, intent, preferences)
+            if self.cache.get(key) is not None:
+                continue
+            if not self.has_capacity():
+                PREFETCH_EVENTS.inc(event="skipped_load")
+                return
+            with self._lock:
+                if key in self._pending:
+                    continue
+                if len(self._pending) >= PREFETCH_MAX_PENDING or not self._take_budget():
+                    PREFETCH_EVENTS.inc(event="skipped_budget")
+                    return
+                self._pending.add(key)
+            PREFETCH_EVENTS.inc(event="scheduled")
+            self.executor.submit(self._prefetch, key, destination, preferences, intent)
+
+    def top_intents(self):
+        """The top_k intents, most asked first (ties keep the FOLLOWUP_INTENTS order)."""
+        with self._lock:
+            counts = dict(self._intent_counts)
+        ranked = sorted(FOLLOWUP_INTENTS, key=lambda intent: -counts[intent[0]])
+        return [name for name, _, _ in ranked[:self.top_k]]
+
+    def _prefetch(self, key, destination, preferences, intent):
+        try:
+            # Real requests may have arrived since this was queued
+            if not self.has_capacity():
+                PREFETCH_EVENTS.inc(event="skipped_load")
+                return
+            question = _QUESTIONS[intent].format(destination=destination)
+            answer = self.generate(destination, preferences, question)
+            self.cache.set(key, answer)
+            with self._lock:
+                self.stored += 1
+            PREFETCH_EVENTS.inc(event="stored")
+            logger.info(f"Prefetched {intent} answer for {destination}")
+        except Exception as e:
+            PREFETCH_EVENTS.inc(event="failed")
+            logger.info(f"Prefetch of {intent} for {destination} skipped: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _take_budget(self):
+        """Spend one prefetch call from the per-minute budget (lock held)."""
+        now = time.monotonic()
+        self._budget = min(self.max_per_minute, self._budget + (now - self._updated) * self.max_per_minute / 60)
+        self._updated = now
+        if self._budget < 1:
+            return False
+        self._budget -= 1
+        return True
+
+    def stats(self):
+        """Return the intents being prefetched, hit counts and the remaining budget."""
+        top_intents = self.top_intents()
+        with self._lock:
+            return {
+                "top_intents": top_intents,
+                "pending": len(self._pending),
+                "stored": self.stored,
+                "hits": self.hits,
+                "budget_available": round(self._budget, 2),
+                "intent_counts": dict(self._intent_counts),
+            }
+
+
+def create_prefetcher(cache, generate, has_capacity):
+    """Create the follow-up prefetcher, or None unless PREFETCH_FOLLOWUPS is on."""
+    return Prefetcher(cache, generate, has_capacity) if PREFETCH_FOLLOWUPS else None
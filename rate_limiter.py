@@ -0,0 +1,254 @@
+"""
+Rate limiter for AI Trip Planner
+Keeps OpenAI calls within the account's requests-per-minute and
+tokens-per-minute limits, so load turns into short queueing here instead of
+429s that each cost a round of retries. Requests wait in a priority queue: new
+itineraries go ahead of follow-ups, which go ahead of background prefetch, and
+within a priority users with fewer recent calls go first, so one user sending
+many follow-ups cannot starve everyone else. A request that cannot be served
+within its maximum wait is rejected and the caller falls back.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+
+from metrics import RATE_LIMIT_QUEUE_DEPTH, RATE_LIMIT_WAIT_SECONDS, RATE_LIMIT_REJECTIONS
+
+logger = logging.getLogger('rate_limiter')
+
+# Configuration for the OpenAI rate limiter (limits are per process)
+OPENAI_RPM_LIMIT = float(os.environ.get("OPENAI_RPM_LIMIT", "500"))  # requests per minute
+OPENAI_TPM_LIMIT = float(os.environ.get("OPENAI_TPM_LIMIT", "200000"))  # tokens per minute (prompt + max_tokens)
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "10"))  # seconds before falling back
+FAIRNESS_WINDOW = 60  # seconds of recent calls that count against a user
+
+# Priorities, most urgent first
+PRIORITY_NEW = 0
+PRIORITY_FOLLOWUP = 1
+PRIORITY_PREFETCH = 2
+PRIORITY_NAMES = {PRIORITY_NEW: "new", PRIORITY_FOLLOWUP: "followup", PRIORITY_PREFETCH: "prefetch"}
+
+MIN_POLL_INTERVAL = 0.005  # seconds
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request could not be admitted within its maximum wait."""
+
+
+class _Waiter:
+    """A request waiting in the queue; wake() is called from whichever thread admits it."""
+
+    __slots__ = ("tokens", "user_id", "priority", "wake", "enqueued", "granted", "cancelled")
+
+    def __init__(self, tokens, user_id, priority, wake):
+        self.tokens = tokens
+        self.user_id = user_id
+        self.priority = priority
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """Request and token buckets shared by every caller, served from a fair priority queue."""
+
+    def __init__(self, rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT, max_wait=RATE_LIMIT_MAX_WAIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self._requests = rpm  # buckets start full
+        self._tokens = tpm
+        self._updated = time.monotonic()
+        self._queue = []  # heap of (priority, user load, sequence, waiter)
+        self._sequence = itertools.count()
+        self._queued_by_user = {}  # user_id -> requests waiting
+        self._recent = {}  # user_id -> times of calls admitted within FAIRNESS_WINDOW
+        self._last_prune = time.monotonic()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.wait_sum = 0.0
+
+    def acquire(self, tokens, user_id=None, priority=PRIORITY_NEW, max_wait=None):
+        """Block until one request of about `tokens` tokens may be sent; raise RateLimitTimeout after max_wait."""
+        event = threading.Event()
+        waiter = self._enqueue(tokens, user_id, priority, event.set)
+        deadline = waiter.enqueued + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            delay = self._poll(waiter, deadline)
+            if delay is None:
+                return
+            event.wait(delay)
+
+    async def acquire_async(self, tokens, user_id=None, priority=PRIORITY_NEW, max_wait=None):
+        """acquire() for coroutines: waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(tokens, user_id, priority, lambda: loop.call_soon_threadsafe(_resolve, future))
+        deadline = waiter.enqueued + (self.max_wait if max_wait is None else max_wait)
+        try:
+            while True:
+                delay = self._poll(waiter, deadline)
+                if delay is None:
+                    return
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                self._cancel(waiter)
+            raise
+
+    def try_acquire(self, tokens, user_id=None):
+        """Take capacity for one request only if it is free now and nobody is waiting; return whether it was."""
+        with self._lock:
+            now = time.monotonic()
+            self._admit_waiting(now)
+            tokens = min(tokens, self.tpm)
+            if self._queue or self._requests < 1 or self._tokens < tokens:
+                return False
+            self._requests -= 1
+            self._tokens -= tokens
+            self._recent.setdefault(user_id, deque()).append(now)
+            self.admitted += 1
+            return True
+
+    def has_spare_capacity(self, fraction=0.5):
+        """Whether nobody is waiting and both buckets are at least `fraction` full (i.e. not under load)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return not self._queue and self._requests >= self.rpm * fraction and self._tokens >= self.tpm * fraction
+
+    def throttle(self):
+        """Empty the request bucket after upstream answered 429, pausing new calls until it refills."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._requests = min(self._requests, 0.0)
+            self.throttled += 1
+
+    def stats(self):
+        """Return queue depth, admission counters and the current bucket levels."""
+        with self._lock:
+            self._refill(time.monotonic())
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _, waiter in self._queue:
+                if not waiter.cancelled:
+                    queued[PRIORITY_NAMES[priority]] += 1
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "queued": queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "mean_wait": self.wait_sum / self.admitted if self.admitted else 0.0,
+                "requests_available": round(self._requests, 2),
+                "tokens_available": round(self._tokens),
+            }
+
+    def _enqueue(self, tokens, user_id, priority, wake):
+        waiter = _Waiter(tokens, user_id, priority, wake)
+        with self._lock:
+            # Users with more recent and queued calls wait behind lighter users of the same priority
+            load = self._user_load(user_id, waiter.enqueued)
+            self._queued_by_user[user_id] = self._queued_by_user.get(user_id, 0) + 1
+            heapq.heappush(self._queue, (priority, load, next(self._sequence), waiter))
+            RATE_LIMIT_QUEUE_DEPTH.inc()
+        return waiter
+
+    def _poll(self, waiter, deadline):
+        """Admit whoever can go now; return None once waiter is admitted, else how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._admit_waiting(now)
+            if waiter.granted:
+                wait = now - waiter.enqueued
+                self.wait_sum += wait
+                RATE_LIMIT_WAIT_SECONDS.observe(wait, priority=PRIORITY_NAMES[waiter.priority])
+                return None
+            if now >= deadline:
+                self._cancel(waiter)
+                self.rejected += 1
+                RATE_LIMIT_REJECTIONS.inc(priority=PRIORITY_NAMES[waiter.priority])
+                logger.warning(f"Rate limit wait exceeded for user_id: {waiter.user_id}, falling back")
+                raise RateLimitTimeout(f"No OpenAI capacity within {deadline - waiter.enqueued:.1f}s")
+            return max(MIN_POLL_INTERVAL, min(deadline - now, self._time_until_head_fits()))
+
+    def _admit_waiting(self, now):
+        """Admit queued requests in priority order while both buckets have room (lock held)."""
+        self._refill(now)
+        while self._queue:
+            waiter = self._queue[0][3]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            # A request larger than the whole bucket goes once the bucket is full
+            tokens = min(waiter.tokens, self.tpm)
+            if self._requests < 1 or self._tokens < tokens:
+                break
+            heapq.heappop(self._queue)
+            self._requests -= 1
+            self._tokens -= tokens
+            waiter.granted = True
+            self._dequeued(waiter)
+            self._recent.setdefault(waiter.user_id, deque()).append(now)
+            self.admitted += 1
+            waiter.wake()
+
+    def _cancel(self, waiter):
+        if not waiter.granted and not waiter.cancelled:
+            waiter.cancelled = True
+            self._dequeued(waiter)
+
+    def _dequeued(self, waiter):
+        RATE_LIMIT_QUEUE_DEPTH.dec()
+        remaining = self._queued_by_user[waiter.user_id] - 1
+        if remaining:
+            self._queued_by_user[waiter.user_id] = remaining
+        else:
+            del self._queued_by_user[waiter.user_id]
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _time_until_head_fits(self):
+        """Seconds until both buckets can cover the request at the head of the queue (lock held)."""
+        # _admit_waiting has already dropped cancelled requests from the head
+        if not self._queue:
+            return 0.0
+        head = self._queue[0][3]
+        request_wait = max(0.0, 1 - self._requests) * 60 / self.rpm
+        token_wait = max(0.0, min(head.tokens, self.tpm) - self._tokens) * 60 / self.tpm
+        return max(request_wait, token_wait)
+
+    def _user_load(self, user_id, now):
+        """Calls by user_id admitted within FAIRNESS_WINDOW plus those still queued (lock held)."""
+        if now - self._last_prune > FAIRNESS_WINDOW:
+            # Forget users who have been quiet for the whole window
+            self._last_prune = now
+            self._recent = {
+                user: times for user, times in self._recent.items() if times and now - times[-1] <= FAIRNESS_WINDOW
+            }
+        recent = self._recent.get(user_id, ())
+        while recent and now - recent[0] > FAIRNESS_WINDOW:
+            recent.popleft()
+        if not recent:
+            # Drop the emptied entry; the user may not be admitted again (e.g. the request times out)
+            self._recent.pop(user_id, None)
+        return len(recent) + self._queued_by_user.get(user_id, 0)
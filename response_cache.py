@@ -0,0 +1,225 @@
+"""
+Response cache for AI Trip Planner
+Bounded LRU/TTL caches for generated itineraries, with an in-memory backend,
+an SQLite backend that survives restarts and is shared by every worker
+process on the same host, and a Redis backend shared between hosts.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from state_store import STATE_STORE_BACKEND, RedisStateStore
+
+logger = logging.getLogger('response_cache')
+
+# Configuration for the response cache
+# "memory", "sqlite" or "redis"; follows STATE_STORE_BACKEND unless set
+CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND") or STATE_STORE_BACKEND
+CACHE_NAMESPACE = "response_cache"
+CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.db")
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))  # seconds
+
+
+class ResponseCache:
+    """In-memory response cache with a size bound, per-entry TTL and LRU eviction."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entries if full."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove key from the cache if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Response cache stored in an SQLite file shared by all processes on the host.
+
+    Entries survive restarts. Hit/miss/eviction counters are per process.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        super().__init__(max_entries=max_entries, ttl=ttl)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_last_access ON response_cache (last_access)"
+        )
+        logger.info(f"SQLite response cache opened at {path}")
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.misses += 1
+                return default
+            self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now)
+                )
+                # Drop expired entries first, then the least recently used ones
+                self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+                (size,) = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+                overflow = size - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM response_cache WHERE key IN ("
+                        "SELECT key FROM response_cache ORDER BY last_access LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def __len__(self):
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+        return size
+
+    def stats(self):
+        stats = super().stats()
+        stats["backend"] = "sqlite"
+        stats["path"] = self.path
+        return stats
+
+
+class StateStoreResponseCache(ResponseCache):
+    """Response cache kept in a shared state store (e.g. Redis), visible to every host.
+
+    Entries expire by TTL; the size bound is left to the server's eviction
+    policy (e.g. Redis maxmemory-policy allkeys-lru). Counters are per process.
+    """
+
+    def __init__(self, store, ttl=CACHE_TTL):
+        super().__init__(max_entries=None, ttl=ttl)
+        self.store = store
+
+    def get(self, key, default=None):
+        value = self.store.get(CACHE_NAMESPACE, key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.store.set(CACHE_NAMESPACE, key, value, ttl=self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self.store.delete(CACHE_NAMESPACE, key)
+
+    def clear(self):
+        self.store.clear(CACHE_NAMESPACE)
+
+    def __len__(self):
+        return self.store.count(CACHE_NAMESPACE)
+
+    def stats(self):
+        stats = super().stats()
+        stats["backend"] = type(self.store).__name__
+        return stats
+
+
+def create_response_cache(backend=CACHE_BACKEND):
+    """Create the response cache configured by RESPONSE_CACHE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteResponseCache()
+    if backend == "redis":
+        return StateStoreResponseCache(RedisStateStore())
+    if backend != "memory":
+        logger.warning(f"Unknown response cache backend '{backend}', using in-memory cache")
+    return ResponseCache()
@@ -0,0 +1,214 @@
+"""
+Near-duplicate query cache for AI Trip Planner
+A second-tier lookup behind the exact-match response cache. Past new queries
+are indexed as hashed word and character n-gram vectors in a fixed-size NumPy
+matrix. On an exact miss, the nearest past query for the same destination and
+trip length is reused when its cosine similarity clears a threshold, so
+"romantic Paris with food" can be answered from "Paris, foodie couple".
+"""
+import os
+import re
+import time
+import zlib
+import logging
+import threading
+
+from gazetteer import resolve_destination
+
+logger = logging.getLogger('similarity_cache')
+
+# NumPy is optional; without it the second tier is simply disabled
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Configuration for the near-duplicate cache
+FUZZY_CACHE_ENABLED = os.environ.get("FUZZY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+FUZZY_CACHE_THRESHOLD = float(os.environ.get("FUZZY_CACHE_THRESHOLD", "0.8"))  # minimum cosine similarity
+FUZZY_CACHE_MAX_ENTRIES = int(os.environ.get("FUZZY_CACHE_MAX_ENTRIES", "2000"))
+FUZZY_CACHE_DIM = int(os.environ.get("FUZZY_CACHE_DIM", "1024"))  # hashed feature dimensions (index uses entries x dim x 4 bytes)
+# A new query for the same destination this soon after a fuzzy hit counts as the hit being wrong
+FUZZY_CACHE_REJECT_WINDOW = float(os.environ.get("FUZZY_CACHE_REJECT_WINDOW", "120"))  # seconds
+
+CHAR_NGRAM = 3
+CHAR_NGRAM_WEIGHT = 0.3  # relative to whole-word features
+
+# Travel intents that users phrase in different ways
+INTENT_SYNONYMS = {
+    "romance": ["romantic", "romance", "couple", "couples", "honeymoon", "anniversary", "partner", "wife", "husband", "girlfriend", "boyfriend"],
+    "food": ["food", "foodie", "foodies", "culinary", "cuisine", "eat", "eating", "restaurant", "restaurants", "gastronomy", "dining", "dine"],
+    "family": ["family", "families", "kid", "kids", "child", "children", "toddler", "toddlers"],
+    "culture": ["culture", "cultural", "museum", "museums", "art", "arts", "gallery", "galleries"],
+    "history": ["history", "historic", "historical", "heritage", "ancient", "ruins"],
+    "nature": ["nature", "outdoor", "outdoors", "hiking", "hike", "hikes", "trekking", "wildlife", "scenery"],
+    "nightlife": ["nightlife", "party", "parties", "clubbing", "bars", "bar", "pubs"],
+    "budget": ["budget", "cheap", "affordable", "backpacking", "backpacker", "frugal"],
+    "luxury": ["luxury", "luxurious", "upscale", "splurge", "premium", "fancy"],
+    "beach": ["beach", "beaches", "seaside", "coast", "coastal"],
+    "shopping": ["shopping", "shops", "markets", "market", "boutiques"],
+    "adventure": ["adventure", "adventurous", "adrenaline", "extreme"],
+    "relaxation": ["relax", "relaxing", "relaxation", "chill", "slow", "spa", "wellness"],
+    "solo": ["solo", "alone"],
+}
+_SYNONYMS = {word: f"intent:{intent}" for intent, words in INTENT_SYNONYMS.items() for word in words}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def query_features(text):
+    """Return {feature: weight} for the words of text: known intents, or the word plus its character n-grams."""
+    features = {}
+    for word in _WORD_RE.findall(text.lower()):
+        intent = _SYNONYMS.get(word)
+        if intent is not None:
+            features[intent] = features.get(intent, 0.0) + 1.0
+            continue
+        features[f"word:{word}"] = features.get(f"word:{word}", 0.0) + 1.0
+        # N-grams let inflections and typos ("sightseeing"/"sightsee") partly match
+        padded = f"#{word}#"
+        for i in range(len(padded) - CHAR_NGRAM + 1):
+            gram = f"gram:{padded[i:i + CHAR_NGRAM]}"
+            features[gram] = features.get(gram, 0.0) + CHAR_NGRAM_WEIGHT
+    return features
+
+
+class SimilarityCache:
+    """Bounded index of past queries; finds the nearest one within a (destination, days) group."""
+
+    def __init__(self, max_entries=FUZZY_CACHE_MAX_ENTRIES, threshold=FUZZY_CACHE_THRESHOLD,
+                 dim=FUZZY_CACHE_DIM, reject_window=FUZZY_CACHE_REJECT_WINDOW):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dim = dim
+        self.reject_window = reject_window
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._groups = np.full(max_entries, -1, dtype=np.int64)  # -1 marks a free slot
+        self._keys = [None] * max_entries  # slot -> cache key
+        self._slots = {}  # cache key -> slot
+        self._next_slot = 0  # slots are reused oldest-first once the index is full
+        self._pending = {}  # user_id -> (group, time) of that user's last fuzzy hit
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.similarity_sum = 0.0
+
+    def describe(self, destination, days, preferences, namespace=""):
+        """Return (group, vector) for a query, or (None, None) if it names no known place."""
+        place, extra = resolve_destination(destination)
+        if place is None:
+            return None, None
+        text = " ".join(list(extra) + [p.lower() for p in preferences])
+        if not text:
+            # Nothing beyond the place itself, which the exact cache already covers
+            return None, None
+        group = zlib.crc32(f"{namespace}{place.id}_{days}".encode("utf-8"))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in query_features(text).items():
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dim] += weight
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # No features (e.g. only punctuation); a zero vector would normalise to NaN
+            return None, None
+        return group, vector / norm
+
+    def add(self, cache_key, group, vector):
+        """Index the query answered by cache_key, replacing the oldest entry if full."""
+        if not np.all(np.isfinite(vector)):
+            return
+        with self._lock:
+            slot = self._slots.get(cache_key)
+            if slot is None:
+                slot = self._next_slot
+                self._next_slot = (self._next_slot + 1) % self.max_entries
+                old_key = self._keys[slot]
+                if old_key is not None:
+                    del self._slots[old_key]
+                self._slots[cache_key] = slot
+                self._keys[slot] = cache_key
+            self._vectors[slot] = vector
+            self._groups[slot] = group
+
+    def remove(self, cache_key):
+        """Forget cache_key (e.g. once its response has left the exact cache)."""
+        with self._lock:
+            slot = self._slots.pop(cache_key, None)
+            if slot is not None:
+                self._keys[slot] = None
+                self._groups[slot] = -1
+
+    def lookup(self, group, vector, user_id=None):
+        """Return (cache_key, similarity) of the nearest indexed query in group above the threshold.
+
+        Returns (None, best similarity) when nothing is close enough.
+        """
+        with self._lock:
+            self.lookups += 1
+            self._resolve_pending(user_id, group)
+            candidates = np.flatnonzero(self._groups == group)
+            if not len(candidates):
+                return None, 0.0
+            similarities = self._vectors[candidates] @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None, similarity
+            return self._keys[candidates[best]], similarity
+
+    def record_hit(self, user_id, group, similarity):
+        """Count a near-duplicate that was served, to be judged by the user's next query."""
+        with self._lock:
+            self.hits += 1
+            self.similarity_sum += similarity
+            if user_id is not None:
+                self._pending[user_id] = (group, time.monotonic())
+
+    def observe(self, user_id, group):
+        """Note a new query from user_id that was answered without a fuzzy lookup."""
+        with self._lock:
+            self._resolve_pending(user_id, group)
+
+    def _resolve_pending(self, user_id, group):
+        """Judge the user's previous fuzzy hit: rephrasing the same trip soon after means it missed."""
+        pending = self._pending.pop(user_id, None) if user_id is not None else None
+        if pending is None:
+            return
+        previous_group, hit_time = pending
+        if previous_group == group and time.monotonic() - hit_time < self.reject_window:
+            self.rejected += 1
+        else:
+            self.accepted += 1
+
+    def stats(self):
+        """Return hit counters and the estimated precision of fuzzy hits."""
+        with self._lock:
+            # Hits whose user went quiet for the whole window count as accepted
+            now = time.monotonic()
+            expired = [user_id for user_id, (_, t) in self._pending.items() if now - t >= self.reject_window]
+            for user_id in expired:
+                del self._pending[user_id]
+            self.accepted += len(expired)
+            judged = self.accepted + self.rejected
+            return {
+                "size": len(self._slots),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": self.hits / self.lookups if self.lookups else 0.0,
+                "mean_similarity": self.similarity_sum / self.hits if self.hits else 0.0,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "precision": self.accepted / judged if judged else None,
+            }
+
+
+def create_similarity_cache():
+    """Create the near-duplicate cache, or None if it is disabled or NumPy is missing."""
+    if not FUZZY_CACHE_ENABLED:
+        return None
+    if np is None:
+        logger.warning("NumPy is not installed, near-duplicate query cache disabled")
+        return None
+    return SimilarityCache()
@@ -0,0 +1,167 @@
+"""
+Single-flight request coalescing for AI Trip Planner
+When several callers ask for the same key at the same time, only the first
+(the leader) does the work; the others wait for its result or subscribe to
+its stream of chunks. Optionally, a per-key lock file extends this to other
+worker processes on the same host.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only; without it coalescing is per process
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('single_flight')
+
+# Configuration for cross-process coalescing
+SINGLE_FLIGHT_LOCK_DIR = os.environ.get("SINGLE_FLIGHT_LOCK_DIR")  # unset = coalesce within the process only
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "120"))  # seconds
+
+
+class Flight:
+    """One in-progress call that followers can wait on or stream from."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+    def publish(self, chunk):
+        """Make a streamed chunk available to subscribers."""
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        """Complete the flight with a result or an exception."""
+        with self._cond:
+            if self.done:
+                return
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        """Block until the leader finishes, then return its result or raise its error."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done, timeout):
+                raise TimeoutError("Timed out waiting for in-flight request")
+            if self.error is not None:
+                raise self.error
+            return self.result
+
+    def subscribe(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        """Yield every chunk published so far and as it arrives; return the final result."""
+        position = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self.done or len(self.chunks) > position, timeout):
+                    raise TimeoutError("Timed out waiting for in-flight stream")
+                pending = self.chunks[position:]
+                position = len(self.chunks)
+                finished = self.done and not pending
+            for chunk in pending:
+                yield chunk
+            if finished:
+                break
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_LOCK_DIR, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir if fcntl else None
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def join(self, key):
+        """Return (flight, is_leader). Leaders must call release() when done."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def release(self, key, flight):
+        """Remove a finished flight; followers of an abandoned flight get an error."""
+        flight.finish(error=RuntimeError("In-flight request was abandoned"))
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key, fn, check=None):
+        """Run fn() once for all concurrent callers with the same key.
+
+        check is called by the leader before fn (after taking the cross-process
+        lock, if enabled); if it returns something other than None, that value
+        is used instead, e.g. a response another worker just cached.
+        """
+        flight, is_leader = self.join(key)
+        if not is_leader:
+            logger.info(f"Waiting for in-flight request: {key}")
+            return flight.wait(self.timeout)
+
+        try:
+            with self._process_lock(key):
+                result = check() if check else None
+                if result is None:
+                    result = fn()
+            flight.finish(result=result)
+            return result
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        finally:
+            self.release(key, flight)
+
+    @contextmanager
+    def _process_lock(self, key):
+        """Hold a per-key lock file so only one worker on the host runs the call."""
+        if not self.lock_dir:
+            yield
+            return
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".lock"
+        with open(os.path.join(self.lock_dir, name), 'a') as lock_file:
+            deadline = time.time() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        # Don't hold the request hostage to another worker; just run it
+                        logger.warning(f"Timed out waiting for cross-process lock: {key}")
+                        yield
+                        return
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self):
+        """Return how many calls led a flight and how many were coalesced into one."""
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
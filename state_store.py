@@ -0,0 +1,224 @@
+"""
+Shared state store for AI Trip Planner
+Key/value storage with per-entry TTLs for state that every worker must see:
+user session IDs, chat histories and (with the redis backend) the response
+cache. The in-memory backend keeps state per process; the SQLite backend
+shares it between processes on one host and the Redis backend between hosts.
+Values must be JSON-serialisable.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('state_store')
+
+# Configuration for the shared state store
+STATE_STORE_BACKEND = os.environ.get("STATE_STORE_BACKEND", "memory")  # "memory", "sqlite" or "redis"
+STATE_STORE_PATH = os.environ.get("STATE_STORE_PATH", "state.db")
+STATE_STORE_URL = os.environ.get("STATE_STORE_URL", "redis://localhost:6379/0")
+STATE_STORE_PREFIX = os.environ.get("STATE_STORE_PREFIX", "aitrip:")
+SWEEP_INTERVAL = 60  # seconds between sweeps for expired entries
+
+
+class MemoryStateStore:
+    """State kept in this process only (the behaviour of a single worker)."""
+
+    def __init__(self):
+        self._data = {}  # namespace -> {key: (expires_at or None, value)}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def get(self, namespace, key, default=None):
+        """Return the value stored under namespace/key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(namespace, {}).get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[namespace][key]
+                return default
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        """Store value under namespace/key, expiring after ttl seconds if given."""
+        self._sweep()
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = (time.time() + ttl if ttl else None, value)
+
+    def add(self, namespace, key, value, ttl=None):
+        """Store value only if namespace/key is unset; return the value now stored."""
+        with self._lock:
+            entry = self._data.get(namespace, {}).get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                return entry[1]
+            self._data.setdefault(namespace, {})[key] = (time.time() + ttl if ttl else None, value)
+            return value
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+    def count(self, namespace):
+        """Return the number of live entries in namespace."""
+        now = time.time()
+        with self._lock:
+            return sum(1 for expires_at, _ in self._data.get(namespace, {}).values()
+                       if expires_at is None or expires_at > now)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._data.pop(namespace, None)
+
+    def _sweep(self):
+        """Drop expired entries, at most once per SWEEP_INTERVAL."""
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        with self._lock:
+            self._last_sweep = now
+            expired = 0
+            for entries in self._data.values():
+                stale = [key for key, (expires_at, _) in entries.items() if expires_at is not None and expires_at <= now]
+                for key in stale:
+                    del entries[key]
+                expired += len(stale)
+        if expired:
+            logger.info(f"Evicted {expired} expired entries")
+
+
+class SQLiteStateStore:
+    """State in an SQLite file (WAL mode) shared by every worker process on the host."""
+
+    def __init__(self, path=STATE_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+        logger.info(f"SQLite state store opened at {path}")
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key, default=None):
+        row = self._connect().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        self._sweep()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time() + ttl if ttl else None)
+            )
+
+    def add(self, namespace, key, value, ttl=None):
+        now = time.time()
+        with self._connect() as conn:
+            # Replace only an expired entry; a live one wins
+            conn.execute(
+                "INSERT INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE state.expires_at IS NOT NULL AND state.expires_at <= ?",
+                (namespace, key, json.dumps(value), now + ttl if ttl else None, now)
+            )
+            (stored,) = conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(stored)
+
+    def delete(self, namespace, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def count(self, namespace):
+        (size,) = self._connect().execute(
+            "SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())
+        ).fetchone()
+        return size
+
+    def clear(self, namespace):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+
+class RedisStateStore:
+    """State in Redis (or any server speaking its protocol), shared across hosts.
+
+    Pass client to use an existing connection or a local stand-in such as fakeredis;
+    otherwise the redis package connects to url. Expiry is left to the server.
+    """
+
+    def __init__(self, url=STATE_STORE_URL, client=None, prefix=STATE_STORE_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get(self, namespace, key, default=None):
+        value = self.client.get(self._key(namespace, key))
+        return default if value is None else json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None):
+        self.client.set(self._key(namespace, key), json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def add(self, namespace, key, value, ttl=None):
+        name = self._key(namespace, key)
+        if self.client.set(name, json.dumps(value), nx=True, px=int(ttl * 1000) if ttl else None):
+            return value
+        stored = self.client.get(name)
+        # The other writer's entry may have expired in between
+        return value if stored is None else json.loads(stored)
+
+    def delete(self, namespace, key):
+        self.client.delete(self._key(namespace, key))
+
+    def count(self, namespace):
+        return sum(1 for _ in self.client.scan_iter(match=self._key(namespace, "*")))
+
+    def clear(self, namespace):
+        keys = list(self.client.scan_iter(match=self._key(namespace, "*")))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_state_store(backend=STATE_STORE_BACKEND):
+    """Create the state store selected by STATE_STORE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    if backend == "redis":
+        return RedisStateStore()
+    if backend != "memory":
+        logger.warning(f"Unknown state store backend '{backend}', using in-memory store")
+    return MemoryStateStore()
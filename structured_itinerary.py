@@ -0,0 +1,221 @@
+"""
+Structured itinerary output for AI Trip Planner
+The model returns a compact JSON itinerary (days -> slots -> activities, plus
+a budget breakdown) instead of inline-styled HTML. The JSON is validated
+against ITINERARY_SCHEMA and rendered to HTML on the server with a template
+that is built once at import time.
+"""
+import json
+import html
+from functools import lru_cache
+
+ITINERARY_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["title", "question", "days", "budget", "tips"],
+    "properties": {
+        "title": {"type": "string"},
+        # Non-empty only when more information is needed before planning
+        "question": {"type": "string"},
+        "days": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["day", "slots"],
+                "properties": {
+                    "day": {"type": "integer"},
+                    "slots": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": ["time", "activities"],
+                            "properties": {
+                                "time": {"type": "string"},
+                                "activities": {
+                                    "type": "array",
+                                    "items": {
+                                        "type": "object",
+                                        "additionalProperties": False,
+                                        "required": ["name", "details"],
+                                        "properties": {
+                                            "name": {"type": "string"},
+                                            "details": {"type": "string"}
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        "budget": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["currency", "items", "total"],
+            "properties": {
+                "currency": {"type": "string"},
+                "items": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["category", "amount"],
+                        "properties": {
+                            "category": {"type": "string"},
+                            "amount": {"type": "number"}
+                        }
+                    }
+                },
+                "total": {"type": "number"}
+            }
+        },
+        "tips": {"type": "array", "items": {"type": "string"}}
+    }
+}
+
+# response_format argument for chat.completions.create
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "itinerary", "strict": True, "schema": ITINERARY_SCHEMA}
+}
+
+SYSTEM_PROMPT = """You are an expert travel planner with deep knowledge of destinations worldwide.
+Reply with a JSON itinerary that matches the provided schema. Do not include HTML or markdown.
+- One entry in "days" per trip day; use "Morning", "Afternoon" and "Evening" slots.
+- Keep activity names short and details to one sentence.
+- Budget amounts are per-trip estimates in USD; "total" is their sum.
+If you need more information to create a high-quality itinerary, put 1-2 specific questions in "question"
+and leave "days", "budget.items" and "tips" empty."""
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+}
+
+
+def validate(data, schema=ITINERARY_SCHEMA, path="$"):
+    """Check data against the subset of JSON Schema used by ITINERARY_SCHEMA; raise ValueError."""
+    expected = schema["type"]
+    if not isinstance(data, _JSON_TYPES[expected]) or (expected in ("integer", "number") and isinstance(data, bool)):
+        raise ValueError(f"{path}: expected {expected}")
+    if expected == "object":
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in data:
+                raise ValueError(f"{path}: missing '{key}'")
+        for key, value in data.items():
+            if key not in properties:
+                if schema.get("additionalProperties", True) is False:
+                    raise ValueError(f"{path}: unexpected '{key}'")
+                continue
+            validate(value, properties[key], f"{path}.{key}")
+    elif expected == "array":
+        for index, item in enumerate(data):
+            validate(item, schema["items"], f"{path}[{index}]")
+
+
+def parse_itinerary(text):
+    """Parse and validate the model's JSON reply; raise ValueError if it is malformed."""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Itinerary is not valid JSON: {e}")
+    validate(data)
+    return data
+
+
+class StructuredReply(str):
+    """Text shown to the user for a structured reply, carrying the parsed data and its JSON source."""
+
+    def __new__(cls, text, data, source):
+        reply = super().__new__(cls, text)
+        reply.data = data
+        reply.source = source
+        return reply
+
+
+class RenderedItinerary(StructuredReply):
+    """HTML rendering of a structured itinerary."""
+
+    @property
+    def budget_total(self):
+        return float(self.data["budget"]["total"])
+
+    @property
+    def budget_breakdown(self):
+        return self.data["budget"]
+
+
+# Template fragments, built once (no newlines: the dashboard turns them into <br>)
+_TITLE = "<h3>{title}</h3>"
+_DAYS_OPEN = "<table><tr><th>Day</th><th>Time</th><th>Activity</th></tr>"
+_DAY_FIRST_ROW = "<tr><td rowspan=\"{rows}\">Day {day}</td><td>{time}</td><td>{activities}</td></tr>"
+_DAY_ROW = "<tr><td>{time}</td><td>{activities}</td></tr>"
+_ACTIVITY = "<strong>{name}</strong> - {details}"
+_TABLE_CLOSE = "</table>"
+_BUDGET_OPEN = "<h3>Budget Estimate</h3><table><tr><th>Category</th><th>Estimated Cost</th></tr>"
+_BUDGET_ROW = "<tr><td>{category}</td><td>{amount}</td></tr>"
+_BUDGET_TOTAL = "<tr><td><strong>Total</strong></td><td><strong>{amount}</strong></td></tr>"
+_TIPS = "<h3>Tips</h3><ul>{items}</ul>"
+_TIP = "<li>{tip}</li>"
+
+_esc = html.escape
+
+
+def _money(amount, currency):
+    symbol = "$" if currency.upper() == "USD" else f"{currency} "
+    return _esc(f"{symbol}{amount:,.0f}")
+
+
+def render_itinerary(data):
+    """Render a validated itinerary dictionary to HTML."""
+    parts = [_TITLE.format(title=_esc(data["title"]))]
+
+    if data["days"]:
+        parts.append(_DAYS_OPEN)
+        for day in data["days"]:
+            for index, slot in enumerate(day["slots"]):
+                activities = "<br>".join(
+                    _ACTIVITY.format(name=_esc(a["name"]), details=_esc(a["details"])) for a in slot["activities"]
+                )
+                if index == 0:
+                    parts.append(_DAY_FIRST_ROW.format(
+                        rows=len(day["slots"]), day=day["day"], time=_esc(slot["time"]), activities=activities
+                    ))
+                else:
+                    parts.append(_DAY_ROW.format(time=_esc(slot["time"]), activities=activities))
+        parts.append(_TABLE_CLOSE)
+
+    budget = data["budget"]
+    if budget["items"]:
+        parts.append(_BUDGET_OPEN)
+        for item in budget["items"]:
+            parts.append(_BUDGET_ROW.format(
+                category=_esc(item["category"]), amount=_money(item["amount"], budget["currency"])
+            ))
+        parts.append(_BUDGET_TOTAL.format(amount=_money(budget["total"], budget["currency"])))
+        parts.append(_TABLE_CLOSE)
+
+    if data["tips"]:
+        parts.append(_TIPS.format(items="".join(_TIP.format(tip=_esc(tip)) for tip in data["tips"])))
+
+    return "".join(parts)
+
+
+@lru_cache(maxsize=512)
+def to_response(source):
+    """Turn the model's JSON reply into the text shown to the user.
+
+    Returns the clarification question as a StructuredReply when the model asked
+    one, otherwise a RenderedItinerary. Raises ValueError for malformed replies.
+    """
+    data = parse_itinerary(source)
+    if data["question"] and not data["days"]:
+        return StructuredReply(data["question"], data, source)
+    return RenderedItinerary(render_itinerary(data), data, source)
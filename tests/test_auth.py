@@ -0,0 +1,60 @@
+import threading
+import time
+
+from auth import _CompactionScheduler
+
+
+class FakeManager:
+    def __init__(self):
+        self.compactions = []
+        self.compacted = threading.Event()
+
+    def compact_storage(self, vacuum=False):
+        self.compactions.append(vacuum)
+        self.compacted.set()
+        return 0
+
+
+def _compaction_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "blob-compaction"]
+
+
+def test_one_thread_compacts_every_manager():
+    before = len(_compaction_threads())
+    scheduler = _CompactionScheduler(interval=0.01)
+    managers = [FakeManager(), FakeManager()]
+    for manager in managers:
+        scheduler.register(manager)
+    assert len(_compaction_threads()) == before + 1
+    for manager in managers:
+        assert manager.compacted.wait(2)
+        assert manager.compactions[0] is False
+    for manager in managers:
+        scheduler.unregister(manager)
+
+
+def test_thread_stops_when_last_manager_unregisters():
+    before = len(_compaction_threads())
+    scheduler = _CompactionScheduler(interval=0.01)
+    manager = FakeManager()
+    scheduler.register(manager)
+    scheduler.unregister(manager)
+    deadline = time.monotonic() + 2
+    while len(_compaction_threads()) > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(_compaction_threads()) == before
+
+
+def test_disabled_scheduler_starts_no_thread():
+    before = len(_compaction_threads())
+    _CompactionScheduler(interval=0).register(FakeManager())
+    assert len(_compaction_threads()) == before
+
+
+def test_vacuum_is_passed_through():
+    scheduler = _CompactionScheduler(interval=0.01, vacuum=True)
+    manager = FakeManager()
+    scheduler.register(manager)
+    assert manager.compacted.wait(2)
+    scheduler.unregister(manager)
+    assert manager.compactions[0] is True
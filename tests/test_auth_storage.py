@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+from auth_storage import JSONStorage, SQLiteStorage
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        storage = JSONStorage(str(tmp_path / "users_db.json"))
+    else:
+        storage = SQLiteStorage(str(tmp_path / "users.db"), migrate_from=None)
+    storage.add_user("a@example.com", "hash")
+    return storage
+
+
+def test_ids_stay_stable_after_delete(storage):
+    first = storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    second = storage.add_itinerary("a@example.com", "3-Day Trip to Rome")
+    assert storage.delete_itinerary("a@example.com", first)
+    assert storage.get_itinerary("a@example.com", second) == "3-Day Trip to Rome"
+    assert storage.get_itinerary("a@example.com", first) is None
+    assert [s["id"] for s in storage.get_itinerary_summaries("a@example.com")] == [second]
+
+
+def test_ids_are_not_reused(storage):
+    first = storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    storage.delete_itinerary("a@example.com", first)
+    again = storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    assert again != first
+    assert not storage.has_itinerary("a@example.com", first)
+    assert storage.has_itinerary("a@example.com", again)
+
+
+def test_delete_unknown_id(storage):
+    storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    assert not storage.delete_itinerary("a@example.com", 12345)
+    assert not storage.delete_itinerary("b@example.com", 0)
+    assert storage.count_itineraries("a@example.com") == 1
+
+
+def test_batch_deletes_by_id(storage):
+    first = storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    results = storage.apply_batch([("add", "a@example.com", "3-Day Trip to Rome"), ("delete", "a@example.com", first)])
+    assert results[1] is True
+    assert [s["title"] for s in storage.get_itinerary_summaries("a@example.com")] == ["3-Day Trip to Rome"]
+
+
+def test_legacy_json_entries_keep_their_positions_as_ids(tmp_path):
+    path = tmp_path / "users_db.json"
+    path.write_text(json.dumps({"a@example.com": {"password": "hash", "itineraries": ["Trip one", "Trip two"]}}))
+    storage = JSONStorage(str(path))
+    assert storage.get_itinerary("a@example.com", 1) == "Trip two"
+    assert storage.add_itinerary("a@example.com", "Trip three") == 2
+    storage.delete_itinerary("a@example.com", 0)
+    assert storage.get_itinerary("a@example.com", 1) == "Trip two"
+
+
+def test_compact_removes_unreferenced_blobs(storage):
+    first = storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    storage.add_itinerary("a@example.com", "3-Day Trip to Rome")
+    storage.delete_itinerary("a@example.com", first)
+    assert storage.compact() == 1
+    assert storage.storage_stats()["blobs"] == 1
+    assert storage.compact(vacuum=True) == 0
+
+
+def test_json_writes_leave_the_readers_snapshot_unchanged(tmp_path):
+    storage = JSONStorage(str(tmp_path / "users_db.json"))
+    storage.add_user("a@example.com", "hash")
+    storage.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    snapshot = storage._load_db()
+    storage.add_user("b@example.com", "hash")
+    storage.add_itinerary("a@example.com", "3-Day Trip to Rome")
+    storage.delete_itinerary("a@example.com", 0)
+    assert list(snapshot) == ["a@example.com"]
+    assert [entry["id"] for entry in snapshot["a@example.com"]["itineraries"]] == [0]
+    assert snapshot["a@example.com"]["next_id"] == 1
+    assert storage.storage_stats()["itineraries"] == 1
+
+
+def test_sqlite_migrates_blob_backed_json_database(tmp_path):
+    path = str(tmp_path / "users_db.json")
+    legacy = JSONStorage(path)
+    legacy.add_user("a@example.com", "hash")
+    legacy.add_itinerary("a@example.com", "5-Day Trip to Paris")
+    legacy.add_itinerary("a@example.com", {"title": "3-Day Trip to Rome", "days": []})
+    storage = SQLiteStorage(str(tmp_path / "users.db"), migrate_from=path)
+    assert storage.get_itineraries("a@example.com") == ["5-Day Trip to Paris", {"title": "3-Day Trip to Rome", "days": []}]
+    assert os.path.exists(path + ".migrated")
+
+
+def test_sqlite_leaves_corrupt_json_database_in_place(tmp_path):
+    path = tmp_path / "users_db.json"
+    path.write_text('{"a@example.com": {"password": ')
+    storage = SQLiteStorage(str(tmp_path / "users.db"), migrate_from=str(path))
+    assert storage.get_user("a@example.com") is None
+    assert path.exists()
+    assert not os.path.exists(str(path) + ".migrated")
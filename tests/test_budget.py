@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import booking
+import budget
+from booking import BookingSearch, create_mock_providers
+
+
+def test_batch_budget_prices_cheapest_combinations():
+    flights = [[{"price": 300}, {"price": 250}]]
+    hotels = [[{"price_per_night": 90}, {"price_per_night": 120}]]
+    result = budget.batch_budget(*budget.price_columns(list(zip(flights, hotels))), [3, 5], top_k=2)
+    assert result["cheapest"].tolist() == [[250 + 90 * 3 + 80 * 3, 250 + 90 * 5 + 80 * 5]]
+    assert result["top_flight"].tolist() == [[1, 0]]
+    assert result["top_days"].tolist() == [[3, 3]]
+
+
+@pytest.mark.parametrize("flight_prices, hotel_prices", [
+    (np.empty((1, 0)), np.array([[50.0]])),
+    (np.array([[300.0]]), np.empty((1, 0))),
+    budget.price_columns([([], [])]),
+])
+def test_batch_budget_without_options_is_nan(flight_prices, hotel_prices):
+    result = budget.batch_budget(flight_prices, hotel_prices, [5, 7])
+    assert np.isnan(result["cheapest"]).all()
+    assert np.isnan(result["percentiles"]).all()
+    assert result["percentiles"].shape == (1, len(budget.DEFAULT_PERCENTILES), 2)
+    assert result["top_total"].shape == (1, 0)
+
+
+def test_trip_without_options_among_others():
+    trips = [([], []), ([{"price": 100}], [{"price_per_night": 50}])]
+    result = budget.batch_budget(*budget.price_columns(trips), [5], top_k=1)
+    assert np.isnan(result["cheapest"][0, 0])
+    assert result["cheapest"][1, 0] == 100 + 50 * 5 + 80 * 5
+
+
+def test_trip_budget_when_every_provider_fails(monkeypatch):
+    search = BookingSearch(create_mock_providers(3, "0", error_rate=1.0))
+    monkeypatch.setattr(booking, "booking_search", search)
+    assert budget.trip_budget("Paris", 5) == 0
+    search.executor.shutdown(wait=False)
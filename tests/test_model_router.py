@@ -0,0 +1,26 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from model_router import ModelRouter, REQUEST_FOLLOWUP
+from openai_integration import OpenAITravelPlanner
+
+ROUTES = {REQUEST_FOLLOWUP: {"models": ["fast", "detailed"], "max_p95": 10.0}}
+
+
+def test_slow_model_fails_over():
+    router = ModelRouter(routes=ROUTES, min_calls=3)
+    for _ in range(3):
+        router.record("fast", 12.0, False)
+    assert router.choose(REQUEST_FOLLOWUP) == "detailed"
+
+
+def test_streams_are_judged_by_whole_call_duration():
+    planner = OpenAITravelPlanner()
+    planner.model_router = ModelRouter(routes=ROUTES, min_calls=2)
+    # Streams that start quickly but take 12s to finish are as slow as 12s sync calls
+    for _ in range(2):
+        planner._record_call("stream", "success", 12.0, first_token_latency=0.2, model="fast")
+    planner.chunk_executor.shutdown(wait=False)
+    assert planner.model_router.stats()["models"]["fast"]["p95"] == 12.0
+    assert planner.model_router.choose(REQUEST_FOLLOWUP) == "detailed"
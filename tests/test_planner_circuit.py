@@ -0,0 +1,81 @@
+import os
+import asyncio
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from async_planner import AsyncOpenAITravelPlanner
+from circuit_breaker import CircuitBreaker, CircuitOpenError, HALF_OPEN
+from openai_integration import OpenAITravelPlanner
+
+
+class RecordingLimiter:
+    """Stands in for the rate limiter and records every acquire."""
+
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, tokens, user_id=None, priority=None, max_wait=None):
+        self.acquired.append(user_id)
+
+    async def acquire_async(self, tokens, user_id=None, priority=None, max_wait=None):
+        self.acquired.append(user_id)
+
+    def try_acquire(self, tokens, user_id=None):
+        self.acquired.append(user_id)
+        return True
+
+
+def _open(breaker):
+    with breaker._lock:
+        breaker._open()
+
+
+@pytest.fixture
+def planner():
+    planner = OpenAITravelPlanner()
+    planner.rate_limiter = RecordingLimiter()
+    _open(planner.circuit_breaker)
+    yield planner
+    planner.chunk_executor.shutdown(wait=False)
+
+
+def test_open_circuit_fails_before_acquiring(planner):
+    messages = [{"role": "user", "content": "Plan a trip to Paris"}]
+    with pytest.raises(CircuitOpenError):
+        planner._call_with_retries("u", messages)
+    with pytest.raises(CircuitOpenError):
+        planner._generate_chunks("u", [messages, messages])
+    assert planner.rate_limiter.acquired == []
+
+
+def test_open_circuit_streams_fallback_without_acquiring(planner):
+    chunks = list(planner.generate_travel_plan_stream("u", "Paris", 3, ["food"]))
+    assert len(chunks) == 1
+    assert planner.rate_limiter.acquired == []
+
+
+def test_open_circuit_fails_before_acquiring_async():
+    planner = AsyncOpenAITravelPlanner()
+    planner.rate_limiter = RecordingLimiter()
+    _open(planner.circuit_breaker)
+
+    async def scenario():
+        with pytest.raises(CircuitOpenError):
+            await planner._call_with_retries_async([{"role": "user", "content": "Plan a trip"}], user_id="u")
+        await planner.aclose()
+
+    asyncio.run(scenario())
+    planner.chunk_executor.shutdown(wait=False)
+    assert planner.rate_limiter.acquired == []
+
+
+def test_check_available_does_not_take_the_half_open_probe():
+    breaker = CircuitBreaker("test", open_seconds=0, half_open_probes=1)
+    _open(breaker)
+    assert breaker.state == HALF_OPEN
+    breaker.check_available()
+    breaker.check()  # the probe is still free for the call itself
+    with pytest.raises(CircuitOpenError):
+        breaker.check_available()
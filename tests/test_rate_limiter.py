@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, RateLimitTimeout, PRIORITY_NEW, PRIORITY_PREFETCH
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(1000.0)
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def _cancel(limiter, waiter):
+    with limiter._lock:
+        limiter._cancel(waiter)
+
+
+def test_prune_after_user_history_emptied_without_new_admission(clock):
+    limiter = RateLimiter(rpm=60, tpm=100000)
+    clock.now = 1000.5
+    assert limiter.try_acquire(100, "heavy")
+    # Another user's request prunes the recent-call table, keeping "heavy" (exactly one window old)
+    clock.now = 1060.5
+    _cancel(limiter, limiter._enqueue(100, "other", PRIORITY_NEW, lambda: None))
+    # "heavy" asks again; the load check empties its history, then the request is abandoned
+    clock.now = 1061
+    _cancel(limiter, limiter._enqueue(100, "heavy", PRIORITY_NEW, lambda: None))
+    # The next prune must not trip over the emptied history
+    clock.now = 1121
+    _cancel(limiter, limiter._enqueue(100, "other", PRIORITY_NEW, lambda: None))
+    assert "heavy" not in limiter._recent
+
+
+def test_lighter_user_goes_first_within_a_priority(clock):
+    limiter = RateLimiter(rpm=60, tpm=100000)
+    for _ in range(3):
+        assert limiter.try_acquire(100, "heavy")
+    limiter.throttle()  # empty the request bucket so both requests queue
+    heavy = limiter._enqueue(100, "heavy", PRIORITY_NEW, lambda: None)
+    light = limiter._enqueue(100, "light", PRIORITY_NEW, lambda: None)
+    clock.now += 1  # one request's worth of refill
+    assert limiter._poll(light, clock.now + 10) is None
+    assert not heavy.granted
+
+
+def test_higher_priority_goes_first(clock):
+    limiter = RateLimiter(rpm=60, tpm=100000)
+    limiter.throttle()
+    prefetch = limiter._enqueue(100, "a", PRIORITY_PREFETCH, lambda: None)
+    new = limiter._enqueue(100, "b", PRIORITY_NEW, lambda: None)
+    clock.now += 1
+    assert limiter._poll(new, clock.now + 10) is None
+    assert not prefetch.granted
+
+
+def test_acquire_times_out_and_leaves_the_queue():
+    limiter = RateLimiter(rpm=60, tpm=100000)
+    limiter.throttle()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(100, "u", max_wait=0.05)
+    stats = limiter.stats()
+    assert stats["rejected"] == 1
+    assert stats["queued"]["new"] == 0
+    assert "u" not in limiter._queued_by_user
+
+
+def test_cancelled_async_acquire_does_not_take_capacity():
+    limiter = RateLimiter(rpm=60, tpm=100000)
+    limiter.throttle()
+
+    async def scenario():
+        task = asyncio.create_task(limiter.acquire_async(100, "gone", max_wait=5))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The next request gets the first refilled slot instead of the cancelled one
+        await limiter.acquire_async(100, "next", max_wait=5)
+
+    asyncio.run(scenario())
+    assert limiter.admitted == 1
+    assert limiter.stats()["queued"]["new"] == 0
+    assert "gone" not in limiter._queued_by_user
@@ -0,0 +1,44 @@
+import numpy as np
+
+from similarity_cache import SimilarityCache
+
+
+def test_similar_query_in_same_group_is_found():
+    cache = SimilarityCache(max_entries=10, threshold=0.5)
+    group, vector = cache.describe("Paris", 3, ["food", "museums"])
+    cache.add("k_food", group, vector)
+    other_group, other_vector = cache.describe("Paris", 3, ["museums", "food"])
+    assert other_group == group
+    assert cache.lookup(other_group, other_vector)[0] == "k_food"
+
+
+def test_other_trip_length_is_a_different_group():
+    cache = SimilarityCache(max_entries=10, threshold=0.5)
+    group, vector = cache.describe("Paris", 3, ["food"])
+    cache.add("k_food", group, vector)
+    other_group, other_vector = cache.describe("Paris", 4, ["food"])
+    assert cache.lookup(other_group, other_vector) == (None, 0.0)
+
+
+def test_query_without_features_is_not_indexed():
+    cache = SimilarityCache(max_entries=10, threshold=0.8)
+    assert cache.describe("Paris", 3, ["!!!"]) == (None, None)
+
+
+def test_non_finite_vector_is_refused_and_does_not_poison_group():
+    cache = SimilarityCache(max_entries=10, threshold=0.8)
+    group, vector = cache.describe("Paris", 3, ["food"])
+    cache.add("k_nan", group, np.full_like(vector, np.nan))
+    _, nightlife = cache.describe("Paris", 3, ["nightlife"])
+    assert cache.lookup(group, nightlife) == (None, 0.0)
+    assert cache.stats()["size"] == 0
+
+
+def test_oldest_entry_is_replaced_when_full():
+    cache = SimilarityCache(max_entries=2, threshold=0.5)
+    for key, preferences in [("k1", ["food"]), ("k2", ["nightlife"]), ("k3", ["beaches"])]:
+        group, vector = cache.describe("Paris", 3, preferences)
+        cache.add(key, group, vector)
+    group, vector = cache.describe("Paris", 3, ["food"])
+    assert cache.lookup(group, vector)[0] != "k1"
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from write_behind import WriteBehindQueue, WRITE_ADD, WRITE_DELETE
+
+
+class FakeStorage:
+    """Records committed batches; fails the first `failures` commits, or any batch containing a poisoned write."""
+
+    def __init__(self, failures=0, poison=None):
+        self.failures = failures
+        self.poison = poison
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def apply_batch(self, writes):
+        self.gate.wait()
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("database is locked")
+            if any(argument == self.poison for _, _, argument in writes):
+                raise ValueError("bad write")
+            self.batches.append(list(writes))
+            return [f"id-{argument}" for _, _, argument in writes]
+
+    def committed(self):
+        return [write for batch in self.batches for write in batch]
+
+
+@pytest.fixture
+def queues():
+    created = []
+
+    def make(storage, **kwargs):
+        kwargs.setdefault("flush_interval", 0.01)
+        queue = WriteBehindQueue(storage, **kwargs)
+        created.append(queue)
+        return queue
+
+    yield make
+    for queue in created:
+        queue.close()
+
+
+def test_sync_submit_returns_committed_result(queues):
+    storage = FakeStorage()
+    queue = queues(storage, durability="sync")
+    assert queue.submit(WRITE_ADD, "a@example.com", "trip") == "id-trip"
+    assert not queue.has_pending("a@example.com")
+
+
+def test_concurrent_sync_writes_share_commits(queues):
+    storage = FakeStorage()
+    queue = queues(storage, durability="sync", flush_interval=0.05)
+    threads = [threading.Thread(target=queue.submit, args=(WRITE_ADD, "a@example.com", i)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(storage.committed()) == 20
+    assert queue.stats()["commits"] < 20
+
+
+def test_batched_writes_are_pending_until_flushed(queues):
+    storage = FakeStorage()
+    storage.gate.clear()
+    queue = queues(storage, durability="batched")
+    assert queue.submit(WRITE_ADD, "a@example.com", "one") is True
+    queue.submit(WRITE_DELETE, "a@example.com", 0)
+    assert queue.has_pending("a@example.com")
+    storage.gate.set()
+    assert queue.flush()
+    assert not queue.has_pending("a@example.com")
+
+
+def test_transient_failure_is_retried(queues):
+    storage = FakeStorage(failures=2)
+    queue = queues(storage, durability="batched", max_retries=5)
+    queue.submit(WRITE_ADD, "a@example.com", "trip")
+    assert queue.flush(timeout=5)
+    assert storage.committed() == [(WRITE_ADD, "a@example.com", "trip")]
+    assert queue.stats()["failures"] == 2
+
+
+def test_permanent_failure_gives_up_after_retries(queues):
+    storage = FakeStorage(failures=1000)
+    queue = queues(storage, durability="batched", max_retries=3, retry_max_delay=0.02)
+    queue.submit(WRITE_ADD, "a@example.com", "trip")
+    assert queue.flush(timeout=5)
+    assert not queue.has_pending("a@example.com")
+    assert storage.committed() == []
+    # Later writes are not held up once the database recovers
+    storage.failures = 0
+    queue.submit(WRITE_ADD, "a@example.com", "next")
+    assert queue.flush(timeout=5)
+    assert storage.committed() == [(WRITE_ADD, "a@example.com", "next")]
+
+
+def test_bad_write_fails_alone(queues):
+    storage = FakeStorage(poison="bad")
+    storage.gate.clear()
+    queue = queues(storage, durability="batched", max_retries=1, retry_max_delay=0.02)
+    for argument in ("good", "bad", "also good"):
+        queue.submit(WRITE_ADD, "a@example.com", argument)
+    storage.gate.set()
+    assert queue.flush(timeout=5)
+    assert [argument for _, _, argument in storage.committed()] == ["good", "also good"]
+
+
+def test_sync_failure_is_raised_to_the_caller(queues):
+    storage = FakeStorage(poison="bad")
+    queue = queues(storage, durability="sync")
+    with pytest.raises(ValueError):
+        queue.submit(WRITE_ADD, "a@example.com", "bad")
+
+
+def test_flush_times_out_while_commit_is_stuck(queues):
+    storage = FakeStorage()
+    storage.gate.clear()
+    queue = queues(storage, durability="batched")
+    queue.submit(WRITE_ADD, "a@example.com", "trip")
+    assert queue.flush(timeout=0.05) is False
+    storage.gate.set()
+    assert queue.flush(timeout=5)
+
+
+def test_close_commits_journaled_writes():
+    storage = FakeStorage()
+    queue = WriteBehindQueue(storage, durability="batched", flush_interval=10)
+    queue.submit(WRITE_ADD, "a@example.com", "trip")
+    queue.close()
+    assert storage.committed() == [(WRITE_ADD, "a@example.com", "trip")]
+    with pytest.raises(RuntimeError):
+        queue.submit(WRITE_ADD, "a@example.com", "late")
@@ -0,0 +1,237 @@
+"""
+Write-behind queue for saved itineraries in AI Trip Planner
+Each save or delete used to commit on its own inside the request, so a burst
+of saves at the end of sessions queued up behind one disk write after
+another. With write-behind on, saves and deletes go into an in-memory journal
+that a background thread commits in groups: every AUTH_WRITE_FLUSH_MS, or
+sooner once AUTH_WRITE_BATCH_SIZE writes are waiting. With "sync" durability a
+request still waits until its group is committed, but many requests share one
+commit; with "batched" durability it returns at once and the write is
+committed shortly after. Reads of a user with journaled writes flush them
+first, so users see their own saves and deletes; if the commit does not
+finish within AUTH_WRITE_FLUSH_TIMEOUT the read goes ahead without them. A
+commit that fails is retried with exponential backoff up to
+AUTH_WRITE_MAX_RETRIES times, then each write is tried on its own and the
+ones that still fail are dropped and logged.
+"""
+import os
+import time
+import atexit
+import logging
+import itertools
+import threading
+from collections import deque
+
+logger = logging.getLogger('write_behind')
+
+# Configuration for write-behind itinerary saves (off unless AUTH_WRITE_BEHIND is set)
+AUTH_WRITE_BEHIND = os.environ.get("AUTH_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+AUTH_WRITE_DURABILITY = os.environ.get("AUTH_WRITE_DURABILITY", "sync")  # "sync" or "batched"
+AUTH_WRITE_FLUSH_INTERVAL = float(os.environ.get("AUTH_WRITE_FLUSH_MS", "20")) / 1000  # seconds
+AUTH_WRITE_BATCH_SIZE = int(os.environ.get("AUTH_WRITE_BATCH_SIZE", "100"))  # writes per commit
+AUTH_WRITE_MAX_RETRIES = int(os.environ.get("AUTH_WRITE_MAX_RETRIES", "5"))  # failed commits retried (batched)
+AUTH_WRITE_RETRY_MAX_DELAY = float(os.environ.get("AUTH_WRITE_RETRY_MAX_DELAY", "2"))  # seconds, backoff cap
+AUTH_WRITE_FLUSH_TIMEOUT = float(os.environ.get("AUTH_WRITE_FLUSH_TIMEOUT", "2"))  # seconds a read waits for its writes
+
+# Write operations
+WRITE_ADD = "add"  # argument: the itinerary
+WRITE_DELETE = "delete"  # argument: the itinerary's ID
+
+
+class _Write:
+    """A journaled write and, once committed, its result."""
+
+    __slots__ = ("sequence", "op", "email", "argument", "enqueued", "done", "result", "error")
+
+    def __init__(self, sequence, op, email, argument):
+        self.sequence = sequence
+        self.op = op
+        self.email = email
+        self.argument = argument
+        self.enqueued = time.monotonic()
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class WriteBehindQueue:
+    """Journals itinerary writes and commits them in groups through storage.apply_batch()."""
+
+    def __init__(self, storage, durability=AUTH_WRITE_DURABILITY, flush_interval=AUTH_WRITE_FLUSH_INTERVAL,
+                 batch_size=AUTH_WRITE_BATCH_SIZE, max_retries=AUTH_WRITE_MAX_RETRIES,
+                 retry_max_delay=AUTH_WRITE_RETRY_MAX_DELAY, flush_timeout=AUTH_WRITE_FLUSH_TIMEOUT):
+        if durability not in ("sync", "batched"):
+            raise ValueError(f"Unknown write durability: {durability}")
+        self.storage = storage
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_max_delay = retry_max_delay
+        self.flush_timeout = flush_timeout
+        self._journal = deque()
+        self._sequence = itertools.count(1)
+        self._last_sequence = 0  # of the latest journaled write
+        self._committed = 0  # every write up to this sequence is committed (or failed)
+        self._pending_by_user = {}  # email -> writes journaled but not committed
+        self._flush_waiters = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.commits = 0
+        self.writes = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        # Commit whatever is still journaled when the process exits
+        atexit.register(self.close)
+
+    def submit(self, op, email, argument):
+        """Journal a write; return its committed result with sync durability, or True at once with batched."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            write = _Write(next(self._sequence), op, email, argument)
+            self._journal.append(write)
+            self._last_sequence = write.sequence
+            self._pending_by_user[email] = self._pending_by_user.get(email, 0) + 1
+            self._cond.notify_all()
+            if self.durability == "batched":
+                return True
+            while not write.done:
+                self._cond.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def has_pending(self, email):
+        """Whether email has writes that are journaled but not yet committed."""
+        with self._cond:
+            return email in self._pending_by_user
+
+    def flush(self, timeout=None):
+        """Wait until every write journaled so far is committed or has failed.
+
+        Gives up after timeout seconds (flush_timeout by default, None to wait
+        indefinitely) and returns whether everything was committed in time.
+        """
+        timeout = self.flush_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._last_sequence
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._committed < target and self._thread.is_alive():
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self):
+        """Commit everything journaled and stop the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        """Return the durability mode, journal length and commit counters."""
+        with self._cond:
+            return {
+                "durability": self.durability,
+                "journaled": len(self._journal),
+                "commits": self.commits,
+                "writes": self.writes,
+                "writes_per_commit": self.writes / self.commits if self.commits else 0.0,
+                "failures": self.failures,
+            }
+
+    def _run(self):
+        retries = 0  # failed commits of the batch at the head of the journal
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                results, error = self._apply(batch), None
+            except Exception as e:
+                results, error = None, e
+            retry = (error is not None and self.durability == "batched" and not self._closed
+                     and retries < self.max_retries)
+            if error is not None and not retry and len(batch) > 1:
+                # Out of retries: commit the writes one by one so a single bad write fails alone
+                results = []
+                for write in batch:
+                    try:
+                        results.append((self._apply([write])[0], None))
+                    except Exception as e:
+                        results.append((None, e))
+            with self._cond:
+                if retry:
+                    # The requests already returned, so keep the writes and retry them on a later commit
+                    self._journal.extendleft(reversed(batch))
+                    self.failures += 1
+                    retries += 1
+                    logger.error(f"Committing {len(batch)} itinerary writes failed, retry {retries}/"
+                                 f"{self.max_retries}: {str(error)}")
+                else:
+                    retries = 0
+                    if error is None:
+                        results = [(result, None) for result in results]
+                    elif len(batch) == 1:
+                        results = [(None, error)]
+                    committed = sum(write_error is None for _, write_error in results)
+                    if committed:
+                        self.commits += 1
+                        self.writes += committed
+                    if committed < len(batch):
+                        self.failures += 1
+                        logger.error(f"Dropping {len(batch) - committed} itinerary writes that could not be "
+                                     f"committed: {str(error)}")
+                    for write, (result, write_error) in zip(batch, results):
+                        write.result = result
+                        write.error = write_error
+                        write.done = True
+                        self._committed_write(write)
+                    self._committed = batch[-1].sequence
+                self._cond.notify_all()
+            if retry:
+                # Exponential backoff, capped so a recovered database is picked up again soon
+                delay = min(self.retry_max_delay, self.flush_interval * (2 ** retries))
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, delay)
+
+    def _apply(self, batch):
+        return self.storage.apply_batch([(w.op, w.email, w.argument) for w in batch])
+
+    def _next_batch(self):
+        """Wait for the next group of writes to commit; None once closed and drained."""
+        with self._cond:
+            while not self._journal:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            # Group commit: give other writes until the oldest has waited flush_interval to join
+            deadline = self._journal[0].enqueued + self.flush_interval
+            while len(self._journal) < self.batch_size and not self._flush_waiters and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._journal.popleft() for _ in range(min(self.batch_size, len(self._journal)))]
+
+    def _committed_write(self, write):
+        """Stop counting a write as pending for its user (lock held)."""
+        remaining = self._pending_by_user[write.email] - 1
+        if remaining:
+            self._pending_by_user[write.email] = remaining
+        else:
+            del self._pending_by_user[write.email]
+
+
+def create_write_queue(storage):
+    """Create the write-behind queue for storage, or None unless AUTH_WRITE_BEHIND is on."""
+    return WriteBehindQueue(storage) if AUTH_WRITE_BEHIND else None